@@ -0,0 +1,205 @@
+import contextlib
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+from collections.abc import Iterator
+from typing import Any, BinaryIO, Optional
+
+from yt_dlp.extractor.youtube import YoutubeIE
+
+if os.name == "nt":
+	import msvcrt
+else:
+	import fcntl
+
+
+class AudioCache:
+	def __init__ (self, location: str, max_bytes: int):
+		"""
+		Creates a cache of downloaded source audio, so audio which has already been downloaded (e.g. when a song is
+		remade with a different speedup factor) doesn't need downloading again. Each entry is an audio file and a JSON
+		file with information about it. When the cache grows larger than its budget, the least recently used entries
+		are removed.
+		:param location: The directory to store the cache in
+		:param max_bytes: The most space the cached audio can use, in bytes
+		"""
+		self._location = pathlib.Path(location)
+		self._max_bytes = max_bytes
+
+		# One lock for each key, so only one thread downloads each video at a time. Lock files do the same thing between
+		# processes.
+		self._key_locks: dict[str, threading.Lock] = {}
+		self._key_locks_lock = threading.Lock()
+		self._evict_lock = threading.Lock()
+
+	@staticmethod
+	def get_key (yt_url: str, audio_format: str) -> Optional[str]:
+		"""
+		Get the cache key for a video, which is the same for every URL of the same video
+		:param yt_url: The URL of the video
+		:param audio_format: The yt-dlp format the audio is downloaded with
+		:return: The key, or None if the URL isn't a YouTube video and can't be cached
+		"""
+		if not YoutubeIE.suitable(yt_url):
+			return None
+		return f"{YoutubeIE._match_id(yt_url)}-{re.sub(r'[^A-Za-z0-9]+', '_', audio_format)}"
+
+	def _get_metadata_path (self, key: str) -> pathlib.Path:
+		return self._location.joinpath(f"{key}.json")
+
+	def _read_metadata (self, key: str) -> Optional[dict[str, Any]]:
+		try:
+			with open(self._get_metadata_path(key), "r") as metadata_file:
+				return json.load(metadata_file)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return None
+
+	def get (self, key: str) -> Optional[tuple[str, dict[str, Any]]]:
+		"""
+		Get an entry from the cache, marking it as recently used. Entries are only removed while nobody holds their lock,
+		so the lock for the key must be held from before getting the entry until the audio file has been read.
+		:param key: The key of the entry
+		:return: The path of the audio file and the information saved with it, or None if it isn't cached
+		"""
+		metadata = self._read_metadata(key)
+		if metadata is None:
+			return None
+
+		audio_path = self._location.joinpath(metadata["file"])
+		try:
+			os.utime(audio_path)
+		except FileNotFoundError:
+			return None
+		return str(audio_path), metadata
+
+	def get_temp_location (self, key: str, extension: str) -> str:
+		"""
+		Get a path to download audio to before it's added to the cache with put
+		:param key: The key of the entry the audio is for
+		:param extension: The file extension of the audio
+		:return: The path to download to
+		"""
+		self._location.mkdir(parents = True, exist_ok = True)
+		return str(self._location.joinpath(f"{key}.{extension}.part"))
+
+	def put (self, key: str, temp_location: str, **metadata: Any) -> str:
+		"""
+		Add downloaded audio to the cache, then remove the least recently used entries if the cache is over its budget
+		:param key: The key of the entry
+		:param temp_location: The path the audio was downloaded to, from get_temp_location
+		:param metadata: Information to save with the audio (e.g. its sample rate)
+		:return: The path of the audio file in the cache
+		"""
+		audio_path = self._location.joinpath(pathlib.Path(temp_location).name.removesuffix(".part"))
+		os.replace(temp_location, audio_path)
+
+		# Write the metadata last, as entries without it are ignored
+		metadata_path = self._get_metadata_path(key)
+		with open(f"{metadata_path}.tmp", "w") as metadata_file:
+			json.dump({**metadata, "file": audio_path.name}, metadata_file)
+		os.replace(f"{metadata_path}.tmp", metadata_path)
+
+		self._evict(keep = key)
+		return str(audio_path)
+
+	def _evict (self, keep: str) -> None:
+		"""
+		Remove the least recently used entries until the cache is within its budget
+		:param keep: The key of an entry which shouldn't be removed
+		:return: None
+		"""
+		with self._evict_lock:
+			entries = []
+			total_bytes = 0
+			for metadata_path in self._location.glob("*.json"):
+				key = metadata_path.stem
+				metadata = self._read_metadata(key)
+				if metadata is None:
+					continue
+				audio_path = self._location.joinpath(metadata["file"])
+				try:
+					stat = audio_path.stat()
+				except FileNotFoundError:
+					continue
+				total_bytes += stat.st_size
+				if key != keep:
+					entries.append((stat.st_mtime, stat.st_size, key, audio_path))
+
+			# Oldest first
+			entries.sort()
+			for _, size, key, audio_path in entries:
+				if total_bytes <= self._max_bytes:
+					break
+				# Entries which are being used are skipped, and removed by a later eviction if they're still the oldest
+				with self.lock(key, blocking = False) as locked:
+					if not locked:
+						continue
+					try:
+						self._get_metadata_path(key).unlink(missing_ok = True)
+						audio_path.unlink(missing_ok = True)
+					except PermissionError:  # The file is being read on Windows, try again next time
+						continue
+				total_bytes -= size
+
+	@staticmethod
+	def _lock_file (lock_file: BinaryIO, blocking: bool) -> bool:
+		"""
+		Lock the first byte of a lock file, which only one process can do at a time
+		:param lock_file: The lock file
+		:param blocking: Set to false to not wait if another process has it locked
+		:return: True if the file was locked, false if another process has it locked and blocking is false
+		"""
+		if os.name == "nt":
+			while True:
+				try:
+					msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+					return True
+				except OSError:  # LK_LOCK gives up after 10 seconds
+					if not blocking:
+						return False
+					time.sleep(1)
+		else:
+			try:
+				fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+				return True
+			except BlockingIOError:
+				return False
+
+	@contextlib.contextmanager
+	def lock (self, key: str, blocking: bool = True) -> Iterator[bool]:
+		"""
+		Wait until no other thread or process holds the lock for a key, then hold it until the with block finishes. The
+		lock is released if the process holding it dies.
+		:param key: The key to lock
+		:param blocking: Set to false to not wait if the lock is held
+		:return: A context manager giving true while it holds the lock, or false if the lock was held and blocking is
+		false
+		"""
+		with self._key_locks_lock:
+			key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+		if not key_lock.acquire(blocking = blocking):
+			yield False
+			return
+
+		try:
+			self._location.mkdir(parents = True, exist_ok = True)
+			with open(self._location.joinpath(f"{key}.lock"), "a+b") as lock_file:
+				lock_file.seek(0)
+				if not self._lock_file(lock_file, blocking):
+					yield False
+					return
+
+				try:
+					yield True
+				finally:
+					if os.name == "nt":
+						lock_file.seek(0)
+						msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+					else:
+						fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+		finally:
+			key_lock.release()
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from config import Config
+from job_queue import JobQueue, StageStats
+
+# The stages which are scaled. Uploads wait on the network rather than using the machine, so they're left alone.
+scaled_stages = ("audio", "video")
+
+# The load average covers the last minute, so after a change wait this long to see its effect before changing again
+_cooldown_secs = 60
+
+# How many checks in a row a stage must have idle threads and nothing waiting before it's given fewer threads
+_idle_checks_before_shrink = 3
+
+
+class HostLoad (NamedTuple):
+	# The load average over the last minute divided by the amount of CPUs, or None if this system doesn't have it
+	load_per_cpu: Optional[float]
+	# The memory available for new processes, or None if this system doesn't report it
+	free_memory_mb: Optional[float]
+
+
+class ScalingDecision (NamedTuple):
+	time: datetime
+	stage: str
+	old_count: int
+	new_count: int
+	reason: str
+
+
+class AutoscalerStatus (NamedTuple):
+	enabled: bool
+	host: HostLoad
+	stages: dict[str, StageStats]
+	# The most recent decisions, newest first
+	decisions: list[ScalingDecision]
+
+
+def get_host_load () -> HostLoad:
+	"""
+	Check how loaded the machine is
+	:return: The load per CPU and free memory, each None if it can't be found on this system
+	"""
+	try:
+		load_per_cpu = os.getloadavg()[0] / (os.cpu_count() or 1)
+	except (AttributeError, OSError):
+		load_per_cpu = None
+
+	free_memory_mb = None
+	try:
+		with open("/proc/meminfo", "r") as meminfo_file:
+			for line in meminfo_file:
+				if line.startswith("MemAvailable:"):
+					free_memory_mb = int(line.split()[1]) / 1024
+					break
+	except OSError:
+		pass
+
+	return HostLoad(load_per_cpu, free_memory_mb)
+
+
+def _get_time_to_clear (stats: StageStats) -> float:
+	"""
+	:param stats: The stats of a stage
+	:return: Roughly how long the stage will take to get through every job which needs it with its current threads.
+	Stages which haven't been run yet are assumed to take a second per job.
+	"""
+	mean_secs = stats.mean_secs if stats.mean_secs is not None else 1
+	return (stats.waiting + stats.busy) * mean_secs / max(stats.workers, 1)
+
+
+class Autoscaler:
+	def __init__ (self, job_queue: JobQueue):
+		"""
+		Creates an autoscaler, which gives the audio and video stages of a job queue more threads when jobs are waiting
+		and the machine has room for them, and fewer when the machine is overloaded or the threads are idle. Threads
+		which are no longer needed stop once they have finished their current job. It only runs while autoscale is
+		enabled in the config file, between autoscale_min_threads and autoscale_max_threads for each stage.
+		:param job_queue: The job queue to scale
+		"""
+		self._job_queue = job_queue
+
+		self._decisions: deque[ScalingDecision] = deque(maxlen = 20)
+		self._idle_checks = {stage: 0 for stage in scaled_stages}
+		self._last_change = 0.0
+
+	def start (self) -> None:
+		"""
+		Start checking the load and queue in the background
+		:return: None
+		"""
+		threading.Thread(target = self._autoscale_worker, daemon = True).start()
+
+	def _autoscale_worker (self) -> None:
+		while True:
+			time.sleep(Config.get("autoscale_period_secs"))
+			if not Config.get("autoscale"):
+				continue
+
+			try:
+				decision = self._decide(get_host_load(), self._job_queue.get_stage_stats())
+			except Exception as exception:
+				print(f"Autoscaler: Failed to check load: {exception}")
+				continue
+
+			if decision is not None:
+				print(f"Autoscaler: {decision.stage} threads {decision.old_count} -> {decision.new_count} "
+					  f"({decision.reason})")
+				self._job_queue.set_worker_count(decision.stage, decision.new_count)
+				self._decisions.append(decision)
+				self._last_change = time.monotonic()
+
+	def _decide (self, host: HostLoad, stages: dict[str, StageStats]) -> Optional[ScalingDecision]:
+		"""
+		Decide which stage to change the amount of threads of, changing at most one stage by one thread at a time
+		:param host: How loaded the machine is
+		:param stages: How busy each stage is
+		:return: The change to make, or None if nothing should change
+		"""
+		min_threads = Config.get("autoscale_min_threads")
+		max_threads = Config.get("autoscale_max_threads")
+
+		for stage in scaled_stages:
+			stats = stages[stage]
+			if stats.waiting == 0 and stats.busy < stats.workers:
+				self._idle_checks[stage] += 1
+			else:
+				self._idle_checks[stage] = 0
+
+		def change (stage: str, new_count: int, reason: str) -> ScalingDecision:
+			self._idle_checks[stage] = 0
+			return ScalingDecision(datetime.now(), stage, stages[stage].workers, new_count, reason)
+
+		# Keep the amount of threads within the limits, even if they were changed
+		for stage in scaled_stages:
+			if stages[stage].workers < min_threads:
+				return change(stage, min_threads, "below the minimum")
+			if stages[stage].workers > max_threads:
+				return change(stage, max_threads, "above the maximum")
+
+		if time.monotonic() - self._last_change < _cooldown_secs:
+			return None
+
+		overloaded_reason = None
+		if host.load_per_cpu is not None and host.load_per_cpu > Config.get("autoscale_max_load"):
+			overloaded_reason = f"load {host.load_per_cpu:.2f} per CPU"
+		elif host.free_memory_mb is not None and host.free_memory_mb < Config.get("autoscale_min_free_mb"):
+			overloaded_reason = f"{host.free_memory_mb:.0f} MB free"
+
+		if overloaded_reason is not None:
+			# Take a thread from the stage which will miss it least
+			shrinkable = [stage for stage in scaled_stages if stages[stage].workers > min_threads]
+			if len(shrinkable) == 0:
+				return None
+			stage = min(shrinkable, key = lambda stage: _get_time_to_clear(stages[stage]))
+			return change(stage, stages[stage].workers - 1, overloaded_reason)
+
+		# Give a thread to the stage which is holding up the queue the most, if all its threads are busy
+		growable = [stage for stage in scaled_stages if stages[stage].workers < max_threads and
+					stages[stage].waiting > 0 and stages[stage].busy >= stages[stage].workers]
+		if len(growable) != 0:
+			stage = max(growable, key = lambda stage: _get_time_to_clear(stages[stage]))
+			return change(stage, stages[stage].workers + 1,
+						  f"{stages[stage].waiting} jobs waiting, about {_get_time_to_clear(stages[stage]):.0f}s of work")
+
+		for stage in scaled_stages:
+			if self._idle_checks[stage] >= _idle_checks_before_shrink and stages[stage].workers > min_threads:
+				return change(stage, stages[stage].workers - 1, "idle")
+
+		return None
+
+	def get_status (self) -> AutoscalerStatus:
+		"""
+		:return: The current load and stats of each stage, and the most recent scaling decisions
+		"""
+		return AutoscalerStatus(Config.get("autoscale"), get_host_load(), self._job_queue.get_stage_stats(),
+								list(reversed(self._decisions)))
@@ -0,0 +1,222 @@
+import contextlib
+import os
+import shutil
+import threading
+from collections.abc import Iterator
+from typing import Callable, Optional
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+
+
+def _get_process_tree_rss (pid: int) -> Optional[int]:
+	"""
+	Get the memory used by a process and every process it started, from /proc
+	:param pid: The id of the process
+	:return: The total resident set size of the processes in bytes, or None if this system doesn't have /proc
+	"""
+	if not os.path.isdir("/proc"):
+		return None
+
+	children: dict[int, list[int]] = {}
+	for entry in os.scandir("/proc"):
+		if not entry.name.isdigit():
+			continue
+		try:
+			with open(f"/proc/{entry.name}/stat", "r") as stat_file:
+				# The process name is in brackets and can contain spaces, so the fields after it are found from the end
+				parent_pid = int(stat_file.read().rpartition(")")[2].split()[1])
+		except (OSError, ValueError, IndexError):  # The process exited while reading
+			continue
+		children.setdefault(parent_pid, []).append(int(entry.name))
+
+	page_size = os.sysconf("SC_PAGE_SIZE")
+	total = 0
+	remaining = [pid]
+	while len(remaining) != 0:
+		current_pid = remaining.pop()
+		remaining += children.get(current_pid, [])
+		try:
+			with open(f"/proc/{current_pid}/statm", "r") as statm_file:
+				total += int(statm_file.read().split()[1]) * page_size
+		except (OSError, ValueError, IndexError):
+			pass
+	return total
+
+
+class BrowserSession:
+	def __init__ (self, browser: webdriver.Chrome, profile_directory: Optional[str] = None, startup_secs: float = 0.0):
+		"""
+		A browser kept open between jobs by a BrowserSessionPool
+		:param browser: The browser for this session
+		:param profile_directory: A temporary profile directory used only by this browser, which is removed when the
+		session is closed
+		:param startup_secs: How long the browser took to start
+		"""
+		self.browser = browser
+		self.wait = WebDriverWait(browser, 20)
+		# The amount of jobs this session has been used for
+		self.job_count = 0
+		self.profile_directory = profile_directory
+		self.startup_secs = startup_secs
+
+	def is_healthy (self) -> bool:
+		"""
+		Check that the browser is still running and responding
+		:return: True if the browser responded, false otherwise
+		"""
+		try:
+			return self.browser.execute_script("return 1;") == 1
+		except WebDriverException:
+			return False
+
+	def get_memory_usage (self) -> int:
+		"""
+		:return: The amount of memory used by the page, in bytes, or 0 if the browser doesn't report it
+		"""
+		try:
+			return self.browser.execute_script(
+				"return performance.memory ? performance.memory.usedJSHeapSize : 0;") or 0
+		except WebDriverException:
+			return 0
+
+	def get_process_memory (self) -> Optional[int]:
+		"""
+		:return: The resident set size of the browser and all of its processes, in bytes, or None if it can't be found on
+		this system
+		"""
+		try:
+			# The browser is started by the driver, so the driver's process tree includes every browser process
+			return _get_process_tree_rss(self.browser.service.process.pid)
+		except AttributeError:
+			return None
+
+	def quit (self) -> None:
+		"""
+		Close the browser, and remove its profile directory
+		:return: None
+		"""
+		try:
+			self.browser.quit()
+		except WebDriverException:
+			pass
+		if self.profile_directory is not None:
+			shutil.rmtree(self.profile_directory, ignore_errors = True)
+
+
+class BrowserSessionPool:
+	def __init__ (self, create_session: Callable[[], BrowserSession], reset_session: Callable[[BrowserSession], None],
+			max_jobs: int, max_memory_mb: int):
+		"""
+		Creates a pool of browser sessions, so the cost of starting a browser and getting it ready is only paid once for
+		many jobs, instead of for every job
+		:param create_session: A function which opens a new browser, and gets it ready for a job
+		:param reset_session: A function which gets a used browser ready for another job
+		:param max_jobs: The amount of jobs a session is used for before it is replaced with a new one
+		:param max_memory_mb: The amount of memory a session's browser processes can use before it is replaced with a new
+		one
+		"""
+		self._create_session = create_session
+		self._reset_session = reset_session
+		self._max_jobs = max_jobs
+		self._max_memory_mb = max_memory_mb
+
+		self._idle_sessions: list[BrowserSession] = []
+		# The amount of sessions the pool tries to keep ready
+		self._target_size = 0
+		self._lock = threading.Lock()
+
+	def warm (self, count: int = 1) -> None:
+		"""
+		Start getting more sessions ready in the background, to be used by later jobs
+		:param count: The amount of sessions to add to the pool
+		:return: None
+		"""
+		with self._lock:
+			self._target_size += count
+		for _ in range(count):
+			threading.Thread(target = self._add_new_session, daemon = True).start()
+
+	def shrink (self, count: int = 1) -> None:
+		"""
+		Keep fewer sessions ready, once fewer jobs will be using them at the same time. Ready sessions which are no
+		longer needed are closed.
+		:param count: The amount of sessions to remove from the pool
+		:return: None
+		"""
+		with self._lock:
+			self._target_size = max(self._target_size - count, 0)
+			surplus_sessions = self._idle_sessions[self._target_size:]
+			del self._idle_sessions[self._target_size:]
+		for session in surplus_sessions:
+			session.quit()
+
+	def _add_new_session (self) -> None:
+		try:
+			session = self._create_session()
+		except Exception as exception:
+			print(f"Failed to start browser session: {exception}")
+			return
+		self._add_idle_session(session)
+
+	def _add_idle_session (self, session: BrowserSession) -> None:
+		with self._lock:
+			if len(self._idle_sessions) < self._target_size:
+				self._idle_sessions.append(session)
+				return
+		session.quit()
+
+	def _recycle (self, session: BrowserSession) -> None:
+		"""
+		Get a session ready to be used again, or replace it if it is unhealthy, has been used for too many jobs, or is
+		using too much memory
+		:param session: The session to recycle
+		:return: None
+		"""
+		# The memory of every browser process is used where this system reports it, as the page's heap is only part of it
+		memory = session.get_process_memory()
+		if memory is None:
+			memory = session.get_memory_usage()
+
+		if not session.is_healthy() or session.job_count >= self._max_jobs or \
+				memory > self._max_memory_mb * 1024 * 1024:
+			session.quit()
+			self._add_new_session()
+			return
+
+		try:
+			self._reset_session(session)
+		except Exception as exception:
+			print(f"Failed to reset browser session: {exception}")
+			session.quit()
+			self._add_new_session()
+			return
+		self._add_idle_session(session)
+
+	def _acquire (self) -> BrowserSession:
+		while True:
+			with self._lock:
+				if len(self._idle_sessions) == 0:
+					break
+				session = self._idle_sessions.pop()
+			if session.is_healthy():
+				return session
+			session.quit()
+
+		# No sessions are ready, so start a new one
+		return self._create_session()
+
+	@contextlib.contextmanager
+	def session (self) -> Iterator[BrowserSession]:
+		"""
+		Use a session from the pool, starting a new one if none are ready. Once the with block finishes the session is
+		recycled in the background.
+		:return: A context manager giving the session
+		"""
+		session = self._acquire()
+		try:
+			yield session
+		finally:
+			session.job_count += 1
+			threading.Thread(target = self._recycle, args = [session], daemon = True).start()
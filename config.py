@@ -1,5 +1,10 @@
+import atexit
 import copy
 import json
+import os
+import threading
+import time
+from typing import Callable, Any, Optional
 
 
 class Config:
@@ -7,21 +12,71 @@ class Config:
 
 	_default_config: dict[str, any] = {
 		"chrome_location":        r".\chromium\chrome.exe",
+		"chrome_profile":         "desktop",
+		"chrome_heap_limit_mb":   2048,
 		"template_url":           "https://vizzy.io/editor?project=1fr6ZmEqOSqm4XNFlWJ93",
 		"vizzy_email":            "<enter email>",
 		"vizzy_password":         "<enter password>",
 		"autohotkey_location":    r"C:\Program Files\AutoHotkey\AutoHotkeyU64.exe",
 		"openfile_ahk_script":    r".\openfile.ahk",
 		"savefile_ahk_script":    r".\savefile.ahk",
+		"file_dialog_mode":       "autohotkey",
 		"ffmpeg_location":        r".\ffmpeg\bin\ffmpeg.exe",
 		"ffprobe_location":       r".\ffmpeg\bin\ffprobe.exe",
-		"thread_count":           2,
+		"audio_streaming":        False,
+		"audio_cache_location":   r".\audio_cache",
+		"audio_cache_size_mb":    2048,
+		"variant_factors":        [1.5, 1.65, 1.8225, 2.0],
+		"variant_preview_secs":   20,
+		"ffmpeg_font":            "Arial",
+		"ffmpeg_preset":          "veryfast",
+		"render_engine":          "vizzy",
+		"browser_max_jobs":       25,
+		"browser_max_memory_mb":  3072,
+		"export_timeout_mins":    60,
+		"audio_thread_count":     1,
+		"video_thread_count":     2,
+		"handoff_queue_size":     1,
+		"executor":               "thread",
+		"autoscale":              False,
+		"autoscale_min_threads":  1,
+		"autoscale_max_threads":  4,
+		"autoscale_max_load":     0.9,
+		"autoscale_min_free_mb":  1024,
+		"autoscale_period_secs":  15,
+		"wallpaper_category_url": "https://www.besthdwallpaper.com/anime-wallpapers-ct_en-US-51",
+		"wallpaper_index_file":   r".\wallpaper_index.json",
+		"wallpaper_ttl_hours":    24,
+		"image_pool_location":    r".\image_pool",
+		"image_pool_size":        5,
 		"savestate_file":         r".\savestate.json",
+		"journal_file":           r".\savestate.journal",
+		"journal_max_mb":         8,
+		"job_store":              "memory",
+		"sqlite_file":            r".\jobs.sqlite3",
+		"jobs_page_size":         50,
+		"ingest_thread_count":    8,
+		"event_interval_secs":    1,
+		"event_max_streams":      2,
+		"server_port":            8080,
+		"server_threads":         16,
+		"x_sendfile":             False,
 		"state":                  "",
 		"credentials":            {},
+		"youtube_api_root":       "",
+		"youtube_quota_units":    10000,
+		"youtube_quota_used":     0,
+		"youtube_quota_day":      "",
+		"auto_upload":            False,
+		"upload_thread_count":    2,
+		"upload_chunk_mb":        8,
+		"upload_limit_kbps":      0,
+		"upload_retries":         5,
+		"upload_category_id":     "10",
 		"next_publish_date":      "2023-01-01T00:00:00",
 		"publish_interval_hours": 12,
 		"autosave_interval_mins": 10,
+		"config_poll_secs":       2,
 		"title_format":           "Nightnightcore - {title} ({artist})",
 		"description_format":     "Make sure to like and subscribe for more daily uploads!\n\n\
 Nightnightcore Remix of {title} by {artist}\n\
@@ -33,6 +88,25 @@ faster tempos, more energetic feel, and higher-pitched vocals\n\n\
 
 	_config_location = "./config.json"
 
+	# Every read and change of the config goes through this lock
+	_lock = threading.RLock()
+
+	# Changes are kept in memory and written to the file together, this long after the first unsaved change
+	_flush_delay_secs = 1.0
+	_flush_timer: Optional[threading.Timer] = None
+	# The names of the values changed since the config file was last written
+	_unsaved_names: set[str] = set()
+
+	# The modification time and size of the file when it was last read or written, so changes made to the file by
+	# something else can be told apart from this program's own writes
+	_file_signature: Optional[tuple[int, int]] = None
+
+	# Set in processes which only read the config, so they never overwrite the main process's changes
+	_read_only = False
+
+	# Functions called with (name, old value, new value) whenever a config value changes
+	_subscribers: tuple[Callable[[str, Any, Any], Any], ...] = ()
+
 	@staticmethod
 	def set_config_location (path: str) -> None:
 		"""
@@ -40,22 +114,62 @@ faster tempos, more energetic feel, and higher-pitched vocals\n\n\
 		:param path: The path of the config file to read
 		:return: None
 		"""
-		Config._config_location = path
-		Config.reload_config()
+		with Config._lock:
+			Config.flush()
+			Config._config_location = path
+			Config._file_signature = None
+			Config.reload_config()
 
 	@staticmethod
-	def reload_config () -> None:
+	def set_read_only () -> None:
 		"""
-		Reloads the config file from disk, creating it with the default values if it doesn't exist.
+		Stop this process writing to the config file, for processes which only read the config (e.g. job workers)
 		:return: None
 		"""
+		Config._read_only = True
+
+	@staticmethod
+	def _get_file_signature () -> Optional[tuple[int, int]]:
 		try:
-			with open(Config._config_location, "r") as config_file:
-				Config._config = json.load(config_file)
+			stat = os.stat(Config._config_location)
 		except FileNotFoundError:
-			with open(Config._config_location, "w") as config_file:
-				json.dump(Config._default_config, config_file)
-				Config._config = copy.deepcopy(Config._default_config)
+			return None
+		return stat.st_mtime_ns, stat.st_size
+
+	@staticmethod
+	def reload_config () -> None:
+		"""
+		Reloads the config file from disk, creating it with the default values if it doesn't exist. Subscribers are told
+		about every value which changed.
+		:return: None
+		"""
+		changes = []
+		with Config._lock:
+			try:
+				with open(Config._config_location, "r") as config_file:
+					new_config = json.load(config_file)
+			except FileNotFoundError:
+				new_config = copy.deepcopy(Config._default_config)
+				Config._config = new_config
+				Config.flush(force = True)
+				return
+
+			if Config._config is not None:
+				# Changes which haven't been written yet are newer than the file, so they're kept and written with the
+				# rest of the file once the pending flush runs
+				for name in Config._unsaved_names:
+					new_config[name] = Config._config[name]
+
+				for name in set(Config._config) | set(new_config):
+					old_value = Config._config.get(name, Config._default_config.get(name))
+					new_value = new_config.get(name, Config._default_config.get(name))
+					if old_value != new_value:
+						changes.append((name, old_value, new_value))
+
+			Config._config = new_config
+			Config._file_signature = Config._get_file_signature()
+
+		Config._notify_subscribers(changes)
 
 	@staticmethod
 	def get (name: str) -> any:
@@ -64,24 +178,121 @@ faster tempos, more energetic feel, and higher-pitched vocals\n\n\
 		:param name: The config value to get
 		:return: The config value set, or None if it's not found
 		"""
-		if Config._config is None:
-			Config.reload_config()
+		with Config._lock:
+			if Config._config is None:
+				Config.reload_config()
 
-		if name not in Config._config:
-			Config.set(name, Config._default_config[name])  # Write the defaults to the config file if uninitialised
+			if name not in Config._config:
+				# Write the defaults to the config file if uninitialised
+				Config._config[name] = copy.deepcopy(Config._default_config[name])
+				Config._schedule_flush()
 
-		return Config._config[name]
+			return Config._config[name]
 
 	@staticmethod
 	def set (name: str, value: any) -> None:
 		"""
-		Sets a config value by name.
+		Sets a config value by name. The change is written to the config file shortly afterwards, together with any other
+		changes made in the meantime.
 		:param name: The config value to set.
 		:param value: The value to write.
 		:return: None
 		"""
-		if Config._config is None:
-			Config.reload_config()
-		Config._config[name] = value
-		with open(Config._config_location, "w") as config_file:
-			json.dump(Config._config, config_file)
+		with Config._lock:
+			if Config._config is None:
+				Config.reload_config()
+
+			old_value = Config._config.get(name, Config._default_config.get(name))
+			if old_value == value:
+				return
+			Config._config[name] = value
+			Config._schedule_flush(name)
+
+		Config._notify_subscribers([(name, old_value, value)])
+
+	@staticmethod
+	def subscribe (subscriber: Callable[[str, Any, Any], Any]) -> None:
+		"""
+		Add a function to be called whenever a config value changes, whether it was set by this program or changed in
+		the config file
+		:param subscriber: A function taking the name of the value, the old value, and the new value
+		:return: None
+		"""
+		with Config._lock:
+			Config._subscribers = Config._subscribers + (subscriber,)
+
+	@staticmethod
+	def _notify_subscribers (changes: list[tuple[str, Any, Any]]) -> None:
+		for name, old_value, new_value in changes:
+			for subscriber in Config._subscribers:
+				# noinspection PyBroadException
+				try:
+					subscriber(name, old_value, new_value)
+				except Exception as exception:
+					print(f"Failed to apply change to config value {name}: {exception}")
+
+	@staticmethod
+	def _schedule_flush (name: Optional[str] = None) -> None:
+		"""
+		Write the config file shortly, unless a write is already pending
+		:param name: The name of the value which was set, which is kept over the file's value if the file is reloaded
+		before it's written. None for defaults filled in, which the file's value should replace.
+		:return: None
+		"""
+		if Config._read_only:
+			return
+		if name is not None:
+			Config._unsaved_names.add(name)
+		if Config._flush_timer is None:
+			Config._flush_timer = threading.Timer(Config._flush_delay_secs, Config.flush)
+			Config._flush_timer.daemon = True
+			Config._flush_timer.start()
+
+	@staticmethod
+	def flush (force: bool = False) -> None:
+		"""
+		Write any unsaved changes to the config file straight away. The file is replaced in one step, so it is never
+		left half written.
+		:param force: Set to true to write the file even if nothing has changed
+		:return: None
+		"""
+		with Config._lock:
+			if Config._flush_timer is not None:
+				Config._flush_timer.cancel()
+				Config._flush_timer = None
+			elif not force or Config._read_only:
+				return
+
+			Config._unsaved_names = set()
+			temp_location = f"{Config._config_location}.tmp"
+			with open(temp_location, "w") as config_file:
+				json.dump(Config._config, config_file)
+				config_file.flush()
+				os.fsync(config_file.fileno())
+			os.replace(temp_location, Config._config_location)
+			Config._file_signature = Config._get_file_signature()
+
+	@staticmethod
+	def start_watcher () -> None:
+		"""
+		Start checking the config file for changes made outside this program (e.g. by editing it), and load them when
+		they are found
+		:return: None
+		"""
+		def watch () -> None:
+			while True:
+				time.sleep(Config.get("config_poll_secs"))
+				with Config._lock:
+					changed = Config._get_file_signature() not in (Config._file_signature, None)
+				if changed:
+					# noinspection PyBroadException
+					try:
+						Config.reload_config()
+						print("Reloaded config file")
+					except Exception as exception:  # e.g. the file is being written and isn't valid JSON yet
+						print(f"Failed to reload config file: {exception}")
+
+		threading.Thread(target = watch, daemon = True).start()
+
+
+atexit.register(Config.flush)
@@ -1,3 +1,11 @@
 
 class IdAlreadyUsedException (Exception):
 	pass
+
+
+class JobCancelledException (Exception):
+	pass
+
+
+class QuotaExceededException (Exception):
+	pass
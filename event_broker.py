@@ -0,0 +1,83 @@
+import threading
+from typing import Any, Optional
+
+
+class EventSubscription:
+	def __init__ (self):
+		"""
+		Events waiting to be sent to one subscriber. Only the latest event with each key is kept, so a subscriber which
+		reads events less often than they are published gets one combined update instead of every step.
+		"""
+		self._pending: dict[tuple[str, str], Any] = {}
+		self._condition = threading.Condition()
+
+	def put (self, event_type: str, key: str, data: Any) -> None:
+		"""
+		Add an event, replacing any event waiting to be sent with the same type and key
+		:param event_type: The type of the event
+		:param key: What the event is about (e.g. a job id), events about different things are sent separately
+		:param data: The data of the event
+		:return: None
+		"""
+		with self._condition:
+			self._pending.pop((event_type, key), None)  # Move it to the end, so events stay in order
+			self._pending[(event_type, key)] = data
+			self._condition.notify()
+
+	def get (self, timeout: float) -> list[tuple[str, Any]]:
+		"""
+		Wait for events, then take all the events waiting to be sent
+		:param timeout: The most time to wait for an event, in seconds
+		:return: A list of the type and data of each event, which is empty if none were published before the timeout
+		"""
+		with self._condition:
+			self._condition.wait_for(lambda: len(self._pending) != 0, timeout)
+			events = [(event_type, data) for (event_type, _), data in self._pending.items()]
+			self._pending.clear()
+			return events
+
+
+class EventBroker:
+	def __init__ (self, max_subscriptions: int):
+		"""
+		Passes events to everyone subscribed, such as browsers listening for changes to jobs
+		:param max_subscriptions: The most subscriptions which can be open at once. Each browser listening for events
+		keeps one of the web server's threads busy, so this needs to leave threads free for other requests.
+		"""
+		self._subscriptions: set[EventSubscription] = set()
+		self._max_subscriptions = max_subscriptions
+		self._lock = threading.Lock()
+
+	def publish (self, event_type: str, key: str, data: Any) -> None:
+		"""
+		Send an event to every subscriber
+		:param event_type: The type of the event
+		:param key: What the event is about (e.g. a job id), only the latest event about each thing is kept
+		:param data: The data of the event
+		:return: None
+		"""
+		with self._lock:
+			subscriptions = list(self._subscriptions)
+		for subscription in subscriptions:
+			subscription.put(event_type, key, data)
+
+	def subscribe (self) -> Optional[EventSubscription]:
+		"""
+		Start receiving events, until unsubscribe is called
+		:return: The subscription, or None if as many subscriptions as allowed are already open
+		"""
+		with self._lock:
+			if len(self._subscriptions) >= self._max_subscriptions:
+				return None
+			subscription = EventSubscription()
+			self._subscriptions.add(subscription)
+			return subscription
+
+	def unsubscribe (self, subscription: EventSubscription) -> None:
+		"""
+		Stop receiving events
+		:param subscription: The subscription given by subscribe
+		:return: None
+		"""
+		with self._lock:
+			self._subscriptions.discard(subscription)
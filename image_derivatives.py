@@ -0,0 +1,107 @@
+import os
+import pathlib
+import subprocess
+import tempfile
+import threading
+from typing import Iterable
+
+from config import Config
+
+# The sizes of smaller copies of images which can be made, by name. Images are scaled down to fit within the size,
+# keeping their aspect ratio.
+sizes: dict[str, tuple[int, int]] = {
+	"card":    (640, 360),
+	"preview": (1280, 720)
+}
+
+
+def _get_derivatives_directory (image_location: str) -> pathlib.Path:
+	return pathlib.Path(image_location).parent.joinpath("derivatives")
+
+
+def get_derivative_location (image_location: str, size: str) -> str:
+	"""
+	Get the location of a smaller copy of an image. The name includes the source image's modification time and size, so
+	copies of an older version of the image are never used.
+	:param image_location: The path to the original image
+	:param size: The name of the size
+	:return: The path of the smaller copy, which might not have been made yet
+	"""
+	stat = os.stat(image_location)
+	return str(_get_derivatives_directory(image_location).joinpath(
+		f"{pathlib.Path(image_location).stem}.{size}.{stat.st_mtime_ns:x}-{stat.st_size:x}.jpg"))
+
+
+# Only one thread makes or removes the copies of each image at a time, by the image's absolute path
+_image_locks: dict[str, threading.RLock] = {}
+_image_locks_lock = threading.Lock()
+
+
+def _get_image_lock (image_location: str) -> threading.RLock:
+	with _image_locks_lock:
+		return _image_locks.setdefault(os.path.abspath(image_location), threading.RLock())
+
+
+def remove_derivatives (image_location: str, keep: Iterable[str] = ()) -> None:
+	"""
+	Delete all the smaller copies of an image
+	:param image_location: The path to the original image
+	:param keep: The paths of copies not to delete
+	:return: None
+	"""
+	keep = {os.path.abspath(location) for location in keep}
+	with _get_image_lock(image_location):
+		for derivative in _get_derivatives_directory(image_location).glob(f"{pathlib.Path(image_location).stem}.*.jpg"):
+			if os.path.abspath(derivative) not in keep:
+				derivative.unlink(missing_ok = True)
+
+
+def create_derivatives (image_location: str) -> None:
+	"""
+	Make a smaller copy of an image in every size with one ffmpeg run, replacing copies of older versions of the image
+	:param image_location: The path to the original image
+	:return: None
+	"""
+	with _get_image_lock(image_location):
+		directory = _get_derivatives_directory(image_location)
+		directory.mkdir(parents = True, exist_ok = True)
+		locations = {name: get_derivative_location(image_location, name) for name in sizes}
+
+		# Write to temporary files with unique names first, so a half-written copy is never served
+		temp_locations = {}
+		for name in sizes:
+			file_descriptor, temp_locations[name] = tempfile.mkstemp(
+				prefix = f"{pathlib.Path(image_location).stem}.{name}.", suffix = ".tmp", dir = directory)
+			os.close(file_descriptor)
+
+		command = [Config.get("ffmpeg_location"), "-y", "-v", "error", "-i", image_location,
+				   "-filter_complex", f"[0:v]split={len(sizes)}" + "".join(f"[{name}]" for name in sizes) + ";" +
+				   ";".join(f"[{name}]scale={width}:{height}:force_original_aspect_ratio=decrease[{name}_scaled]"
+							for name, (width, height) in sizes.items())]
+		for name in sizes:
+			command += ["-map", f"[{name}_scaled]", "-q:v", "3", "-f", "mjpeg", temp_locations[name]]
+
+		try:
+			subprocess.run(command, check = True, stdin = subprocess.DEVNULL)
+			for name in sizes:
+				os.replace(temp_locations[name], locations[name])
+		finally:
+			for temp_location in temp_locations.values():
+				pathlib.Path(temp_location).unlink(missing_ok = True)
+
+		# Only remove the copies of older versions once the new ones are in place
+		remove_derivatives(image_location, keep = locations.values())
+
+
+def get_derivative (image_location: str, size: str) -> str:
+	"""
+	Get a smaller copy of an image, making it first if it hasn't been made yet or the image has changed
+	:param image_location: The path to the original image
+	:param size: The name of the size
+	:return: The path of the smaller copy
+	"""
+	with _get_image_lock(image_location):
+		location = get_derivative_location(image_location, size)
+		if not os.path.exists(location):
+			create_derivatives(image_location)
+	return location
@@ -1,12 +1,213 @@
+import json
+import os
 import random
+import threading
+import time
+import urllib.parse
+from typing import Optional
 
 import requests
 from lxml import etree
 
+from config import Config
+
 headers = {
 	"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
 }
 
+# Shared by every request, so connections to the site are reused
+session = requests.Session()
+session.headers.update(headers)
+
+
+def _is_jpeg (url: str) -> bool:
+	return url.endswith((".jpg", ".jpeg", ".jpe", ".jif", ".jfif", ".jfi"))
+
+
+class WallpaperCatalogue:
+	def __init__ (self, location: str, category_url: str, ttl_hours: float):
+		"""
+		A local index of the images in a category on besthdwallpaper.com which are suitable for videos (not over 18,
+		at least 3840x2160, landscape, and available as a 3840x2160 jpeg), along with the link to download each one.
+		Pages of the category are added to the index as they are needed, and fetched again once they are older than the
+		TTL.
+		:param location: The path of the file to save the index to
+		:param category_url: The URL of the first page of the category, without the page number
+		:param ttl_hours: How long a page of the index is used before it is fetched again
+		"""
+		self._location = location
+		self._category_url = category_url
+		self._ttl_seconds = ttl_hours * 60 * 60
+
+		self._lock = threading.Lock()
+		# Only one refresh runs at a time
+		self._refresh_lock = threading.Lock()
+
+		try:
+			with open(location, "r") as index_file:
+				index = json.load(index_file)
+		except (FileNotFoundError, json.JSONDecodeError):
+			index = {}
+
+		# An index made with a different category can't be used
+		if index.get("category_url") != category_url:
+			index = {"category_url": category_url, "page_count": 0, "page_count_fetched_at": 0, "pages": {}}
+		self._index = index
+
+	def _save (self) -> None:
+		with self._lock:
+			contents = json.dumps(self._index)
+		with open(f"{self._location}.tmp", "w") as index_file:
+			index_file.write(contents)
+		os.replace(f"{self._location}.tmp", self._location)
+
+	def _is_stale (self, fetched_at: float) -> bool:
+		return time.time() - fetched_at > self._ttl_seconds
+
+	def _get_page (self, page_number: int, etag: Optional[str] = None) -> Optional[requests.Response]:
+		"""
+		Fetch a page of the category
+		:param page_number: The number of the page
+		:param etag: The ETag the page had when it was last fetched, so it's only sent again if it has changed
+		:return: The response, or None if the page hasn't changed since it had the given ETag
+		"""
+		response = session.get(f"{self._category_url}/{page_number}?isJson=true", timeout = 30,
+							   headers = {"If-None-Match": etag} if etag is not None else None)
+		if response.status_code == 304:
+			return None
+		response.raise_for_status()
+		return response
+
+	def _resolve_image_url (self, image_info: dict[str, any]) -> Optional[str]:
+		"""
+		Get the link to the 3840x2160 jpeg of an image from its details page
+		:param image_info: The image's entry in a page of the category
+		:return: The link, or None if the image doesn't have a 3840x2160 jpeg
+		"""
+		image_details = session.get(urllib.parse.urljoin(self._category_url, image_info["detailPageUrl"]),
+									timeout = 30)
+
+		# noinspection PyProtectedMember
+		elements: list[etree._Element] = etree.HTML(image_details.text).xpath('//a[text()=" 3840x2160 "]')
+		if len(elements) != 0 and _is_jpeg(elements[0].attrib["href"]):
+			return elements[0].attrib["href"]
+		return None
+
+	def _refresh_page (self, page_number: int) -> None:
+		"""
+		Fetch a page of the category, and replace its entry in the index with the suitable images on it. If the page
+		hasn't changed since it was last fetched, its entry is kept and only marked as up to date.
+		:param page_number: The number of the page
+		:return: None
+		"""
+		with self._lock:
+			old_page = self._index["pages"].get(str(page_number))
+		response = self._get_page(page_number, old_page.get("etag") if old_page is not None else None)
+		if response is None:
+			with self._lock:
+				old_page["fetched_at"] = time.time()
+			return
+
+		page_data: list[dict[str, any]] = response.json()["data"]
+
+		image_urls = []
+		for image_info in page_data:
+			# Check if image meets conditions
+			# noinspection PyChainedComparisons
+			if not image_info["isOver18"] and \
+					image_info["imWidth"] >= 3840 and \
+					image_info["imHeight"] >= 2160 and \
+					image_info["imWidth"] >= image_info["imHeight"]:
+				image_url = self._resolve_image_url(image_info)
+				if image_url is not None:
+					image_urls.append(image_url)
+
+		with self._lock:
+			self._index["pages"][str(page_number)] = {"fetched_at": time.time(), "images": image_urls,
+													  "etag": response.headers.get("ETag")}
+
+	def refresh (self, page_limit: int = 1) -> None:
+		"""
+		Bring the index more up to date, by fetching pages which aren't in the index yet or are older than the TTL
+		:param page_limit: The most pages to fetch
+		:return: None
+		"""
+		with self._refresh_lock:
+			if self._is_stale(self._index["page_count_fetched_at"]):
+				with self._lock:
+					etag = self._index.get("page_count_etag")
+				response = self._get_page(1, etag)
+				with self._lock:
+					# The first page hasn't changed, so neither has the amount of pages
+					if response is not None:
+						self._index["page_count"] = response.json()["psf"]["pageCount"]
+						self._index["page_count_etag"] = response.headers.get("ETag")
+					self._index["page_count_fetched_at"] = time.time()
+					page_count = self._index["page_count"]
+					# Forget pages which no longer exist
+					self._index["pages"] = {number: page for number, page in self._index["pages"].items()
+											if int(number) <= page_count}
+
+			with self._lock:
+				outdated_pages = [number for number in range(1, self._index["page_count"] + 1)
+								  if str(number) not in self._index["pages"] or
+								  self._is_stale(self._index["pages"][str(number)]["fetched_at"])]
+
+			for page_number in random.sample(outdated_pages, min(page_limit, len(outdated_pages))):
+				self._refresh_page(page_number)
+
+			self._save()
+
+	def _needs_refresh (self) -> bool:
+		with self._lock:
+			return self._is_stale(self._index["page_count_fetched_at"]) or \
+				len(self._index["pages"]) < self._index["page_count"] or \
+				any(self._is_stale(page["fetched_at"]) for page in self._index["pages"].values())
+
+	def _refresh_in_background (self) -> None:
+		def refresh () -> None:
+			try:
+				self.refresh()
+			except Exception as exception:
+				print(f"Failed to refresh wallpaper catalogue: {exception}")
+
+		if not self._refresh_lock.locked() and self._needs_refresh():
+			threading.Thread(target = refresh, daemon = True).start()
+
+	def get_random_image_url (self) -> str:
+		"""
+		Pick a random suitable image from the index, fetching more of the category first if the index has none. The
+		index is refreshed in the background afterwards if it's out of date.
+		:return: The link to download the image from
+		"""
+		# Fetch pages until one has a suitable image
+		for _ in range(20):
+			with self._lock:
+				image_urls = [image_url for page in self._index["pages"].values() for image_url in page["images"]]
+			if len(image_urls) != 0:
+				break
+			self.refresh()
+		else:
+			raise RuntimeError("Couldn't find any suitable wallpapers")
+
+		self._refresh_in_background()
+		return random.choice(image_urls)
+
+	def remove_image_url (self, image_url: str) -> None:
+		"""
+		Remove an image from the index, e.g. because it couldn't be downloaded
+		:param image_url: The link of the image
+		:return: None
+		"""
+		with self._lock:
+			for page in self._index["pages"].values():
+				if image_url in page["images"]:
+					page["images"].remove(image_url)
+
+
+catalogue = WallpaperCatalogue(Config.get("wallpaper_index_file"), Config.get("wallpaper_category_url"),
+							   Config.get("wallpaper_ttl_hours"))
+
 
 def get_random_image_from_web (output_location: str) -> None:
 	"""
@@ -14,53 +215,22 @@ def get_random_image_from_web (output_location: str) -> None:
 	:param output_location: The path to save the downloaded image to
 	:return: None
 	"""
-	# Get page information
-	page_info: dict[str, any] = requests.get \
-		("https://www.besthdwallpaper.com/anime-wallpapers-ct_en-US-51/1?isJson=true",
-		 headers = headers).json()["psf"]
+	# Loop until we successfully get an image
+	for _ in range(5):
+		image_url = catalogue.get_random_image_url()
 
-	last_page = page_info["pageCount"]
+		response = session.get(image_url, timeout = 60)
+		if response.status_code == 404:  # The image has been removed from the site
+			catalogue.remove_image_url(image_url)
+			continue
+		response.raise_for_status()
 
-	# Loop until we successfully get an image
-	got_image = False
-
-	while not got_image:
-		# Pick a random page
-		page_number = random.randint(1, last_page)
-
-		# Download page JSON
-		page_data: list[dict[str, any]] = requests.get \
-			(f"https://www.besthdwallpaper.com/anime-wallpapers-ct_en-US-51/{page_number}?isJson=true",
-			 headers = headers).json()["data"]
-
-		# Pick random image
-		image_info: dict[str, any] = random.choice(page_data)
-
-		# Check if image meets conditions
-		# noinspection PyChainedComparisons
-		if not image_info["isOver18"] and \
-				image_info["imWidth"] >= 3840 and \
-				image_info["imHeight"] >= 2160 and \
-				image_info["imWidth"] >= image_info["imHeight"]:
-			# Get image details page
-			image_details = requests.get(f"https://www.besthdwallpaper.com{image_info['detailPageUrl']}",
-										 headers = headers)
-
-			# Get link to image
-			# noinspection PyProtectedMember
-			elements: list[etree._Element] = etree.HTML(image_details.text).xpath('//a[text()=" 3840x2160 "]')
-			if len(elements) != 0:
-				image_url: str = elements[0].attrib["href"]
-
-				# Check if image is a jpeg
-				if image_url.endswith(".jpg") or image_url.endswith(".jpeg") or image_url.endswith(".jpe") or \
-						image_url.endswith(".jif") or image_url.endswith(".jfif") or image_url.endswith(".jfi"):
-					# Download file
-					with open(output_location, "wb") as output_file:
-						output_file.write(requests.get(image_url, headers = headers).content)
-
-					# Finish loop
-					got_image = True
+		# Download file
+		with open(output_location, "wb") as output_file:
+			output_file.write(response.content)
+		return
+
+	raise RuntimeError("Couldn't download a wallpaper")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+import os
+import pathlib
+import shutil
+import threading
+import uuid
+from typing import Callable, Any
+
+
+class ImagePool:
+	def __init__ (self, location: str, size: int, fetch_image: Callable[[str], Any]):
+		"""
+		Creates a pool of images which are downloaded in the background, so a new image can be given to a job straight
+		away instead of waiting for one to download
+		:param location: The directory to keep the downloaded images in
+		:param size: The amount of images to keep ready
+		:param fetch_image: A function which downloads a new image to the given path
+		"""
+		self._location = pathlib.Path(location)
+		self._size = size
+		self._fetch_image = fetch_image
+
+		# Set whenever an image is claimed, so the filler knows to replace it
+		self._image_claimed = threading.Event()
+
+		self._location.mkdir(parents = True, exist_ok = True)
+
+		# Remove downloads which didn't finish and claims which didn't complete last time
+		for leftover in self._location.glob("*.part"):
+			leftover.unlink(missing_ok = True)
+
+	def _get_images (self) -> list[pathlib.Path]:
+		return list(self._location.glob("*.jpg"))
+
+	def start_filler (self) -> None:
+		"""
+		Start downloading images in the background, keeping the pool full
+		:return: None
+		"""
+		threading.Thread(target = self._filler_worker, daemon = True).start()
+
+	def _filler_worker (self) -> None:
+		retry_delay = 5
+		while True:
+			if len(self._get_images()) >= self._size:
+				# Wait until an image is claimed, checking occasionally in case images were removed some other way
+				self._image_claimed.wait(60)
+				self._image_claimed.clear()
+				continue
+
+			# Download to a temporary name, so half-downloaded images are never claimed
+			temp_location = self._location.joinpath(f"{uuid.uuid4().hex}.jpg.part")
+			try:
+				self._fetch_image(str(temp_location))
+				os.replace(temp_location, temp_location.with_suffix(""))
+				retry_delay = 5
+			except Exception as exception:
+				temp_location.unlink(missing_ok = True)
+				print(f"Failed to download image for the image pool: {exception}")
+
+				# Wait longer after each failure, so a site which is down isn't hammered
+				self._image_claimed.wait(retry_delay)
+				retry_delay = min(retry_delay * 2, 300)
+
+	def claim (self, output_location: str) -> bool:
+		"""
+		Take an image from the pool
+		:param output_location: The path to move the image to
+		:return: True if an image was claimed, false if the pool is empty
+		"""
+		for image in self._get_images():
+			# Renaming is atomic, so only one caller can claim each image
+			claimed_location = self._location.joinpath(f"{image.stem}.claimed.part")
+			try:
+				os.replace(image, claimed_location)
+			except FileNotFoundError:  # Claimed by someone else first
+				continue
+
+			shutil.move(claimed_location, output_location)
+			self._image_claimed.set()
+			return True
+
+		return False
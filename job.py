@@ -1,13 +1,14 @@
 import pathlib
 import random
 import string
-from datetime import datetime, timedelta
-from typing import Optional
-
-import google.oauth2.credentials
-import googleapiclient.discovery
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Callable, Any, Collection
 
+import image_derivatives
 import video_generation
+import youtube_api
 
 from enum import Enum, auto
 
@@ -15,14 +16,48 @@ from config import Config
 
 
 class Job:
+	# Defaults for attributes added after older save states were written
+	priority: int = 0
+	publish_slot: Optional[datetime] = None
+	created_at: float = 0.0
+	render_engine: Optional[str] = None
+	variant_factors: tuple[float, ...] = ()
+	# The YouTube link and speedup factor the audio file was made with, so it isn't made again if they haven't changed
+	audio_source: Optional[tuple[str, float]] = None
+	# The id of the video on YouTube once it has been uploaded
+	youtube_video_id: Optional[str] = None
+	# The session of an upload which hasn't finished, so it can be continued instead of starting again
+	upload_session: Optional[str] = None
+	# The stage the job failed in, either "audio", "video" or "upload", or None if it hasn't failed
+	failed_stage: Optional[str] = None
+	# How long the browser which rendered the video took to start (None if it was kept from an earlier job), and how much
+	# memory it was using once it finished
+	chrome_startup_secs: Optional[float] = None
+	chrome_rss_mb: Optional[int] = None
+	# Set while variants are being rendered in the background, and why rendering them failed if it did
+	rendering_variants: bool = False
+	variant_failure_info: Optional[str] = None
+
+	# Attributes which change too often to be worth saving when they change
+	transient_attributes = frozenset({"progress_percentage", "rendering_variants"})
+
+	# Functions called with (job, attribute name, old value, new value) whenever a public attribute changes
+	_observers: tuple[Callable[["Job", str, Any, Any], Any], ...] = ()
+
 	def __init__ (self, *,
-			yt_url: str = "", speedup_factor: float = 1.8225, song_title: str = "", song_artist: str = ""):
+			yt_url: str = "", speedup_factor: float = 1.8225, song_title: str = "", song_artist: str = "",
+			priority: int = 0, publish_slot: Optional[datetime] = None, render_engine: Optional[str] = None):
 		"""
 		Creates a new job with a randomly generated ID, and a default status of Waiting.
 		:param yt_url: The YouTube video to get audio from
 		:param speedup_factor: The speedup factor for the audio
 		:param song_title: The title of the song
 		:param song_artist: The artist of the song
+		:param priority: Jobs with a higher priority are run first
+		:param publish_slot: The time this job's video is meant to be published, jobs with an earlier publish slot are
+		run first
+		:param render_engine: The engine to render the video with, either "vizzy" or "ffmpeg", or None to use the engine
+		set in the config file
 		"""
 		self.id = "".join(random.choices(string.ascii_lowercase, k = 10))
 		self.status = JobStatus.Waiting
@@ -32,6 +67,42 @@ class Job:
 		self.song_artist = song_artist
 		self.progress_percentage = "0%"
 		self.failure_info: Optional[str] = None
+		self.priority = priority
+		self.publish_slot = publish_slot
+		self.created_at = time.time()
+		self.render_engine = render_engine
+
+	def __setattr__ (self, name: str, value: any) -> None:
+		old_value = self.__dict__.get(name, getattr(type(self), name, None))
+		super().__setattr__(name, value)
+
+		if not name.startswith("_") and old_value != value:
+			for observer in self._observers:
+				observer(self, name, old_value, value)
+
+	def __getstate__ (self) -> dict[str, any]:
+		# Observers belong to this process, and shouldn't be saved or sent to other processes. Variants being rendered
+		# aren't continued after a restart, so that isn't saved either.
+		state = self.__dict__.copy()
+		state.pop("_observers", None)
+		state.pop("rendering_variants", None)
+		return state
+
+	def add_observer (self, observer: Callable[["Job", str, Any, Any], Any]) -> None:
+		"""
+		Add a function to be called whenever a public attribute of this job changes
+		:param observer: A function taking the job, the name of the attribute, the old value, and the new value
+		:return: None
+		"""
+		self._observers = self._observers + (observer,)
+
+	def remove_observer (self, observer: Callable[["Job", str, Any, Any], Any]) -> None:
+		"""
+		Remove a function added with add_observer
+		:param observer: The function to remove
+		:return: None
+		"""
+		self._observers = tuple(existing for existing in self._observers if existing != observer)
 
 	def get_audio_location (self) -> str:
 		"""
@@ -51,16 +122,67 @@ class Job:
 		"""
 		return str(pathlib.Path.cwd().joinpath("data").joinpath(f"{self.id}.mp4"))
 
+	def get_variant_location (self, speedup_factor: float, preview: bool = False) -> str:
+		"""
+		:param speedup_factor: The speedup factor of the variant
+		:param preview: True to get the location of the variant's preview instead of the full variant
+		:return: The absolute path to where the audio file of a variant should be located for this job
+		"""
+		variant_type = "preview" if preview else "variant"
+		return str(pathlib.Path.cwd().joinpath("data").joinpath(f"{self.id}.{variant_type}-{speedup_factor:g}.mp3"))
+
 	def cleanup_files (self) -> None:
 		"""
 		Deletes all the files for this job, and sets its status to deleted
 		:return: None
 		"""
 		pathlib.Path(self.get_audio_location()).unlink(missing_ok = True)  # Unlink = remove file
+		image_derivatives.remove_derivatives(self.get_image_location())
 		pathlib.Path(self.get_image_location()).unlink(missing_ok = True)
 		pathlib.Path(self.get_video_location()).unlink(missing_ok = True)
+		self._cleanup_variants()
 		self.status = JobStatus.Deleted
 
+	def _cleanup_variants (self) -> None:
+		for speedup_factor in self.variant_factors:
+			pathlib.Path(self.get_variant_location(speedup_factor)).unlink(missing_ok = True)
+			pathlib.Path(self.get_variant_location(speedup_factor, preview = True)).unlink(missing_ok = True)
+		self.variant_factors = ()
+
+	def render_variants (self, speedup_factors: list[float], preview_start: float) -> None:
+		"""
+		Renders the audio with several speedup factors, with a short preview of each, so one can be picked with
+		pick_variant. Any variants rendered before are replaced.
+		:param speedup_factors: The speedup factors to try
+		:param preview_start: The time in the original song the previews start from, in seconds
+		:return: None
+		"""
+		self._cleanup_variants()
+		video_generation.generate_audio_variants(
+			yt_url = self.yt_url,
+			speedup_factors = speedup_factors,
+			output_locations = [self.get_variant_location(factor) for factor in speedup_factors],
+			preview_locations = [self.get_variant_location(factor, preview = True) for factor in speedup_factors],
+			preview_start = preview_start,
+			preview_length = Config.get("variant_preview_secs"))
+		self.variant_factors = tuple(speedup_factors)
+
+	def pick_variant (self, speedup_factor: float) -> bool:
+		"""
+		Use a variant rendered by render_variants as the job's audio, setting the job's speedup factor to match. The
+		other variants are deleted.
+		:param speedup_factor: The speedup factor of the variant to use
+		:return: True if the variant exists, false otherwise
+		"""
+		if speedup_factor not in self.variant_factors:
+			return False
+
+		pathlib.Path(self.get_variant_location(speedup_factor)).replace(self.get_audio_location())
+		self.speedup_factor = speedup_factor
+		self.audio_source = (self.yt_url, speedup_factor)
+		self._cleanup_variants()
+		return True
+
 	def check_ready (self) -> bool:
 		"""
 		Check if a job is ready to be run. To be ready, a YouTube link, speedup factor, song title, artist, and image
@@ -75,85 +197,167 @@ class Job:
 		Runs the job, returning once the video is done generating
 		:return: None
 		"""
+		self.run_audio_stage()
+		self.run_video_stage()
+
+	def run_audio_stage (self) -> None:
+		"""
+		Runs the audio stage of the job, returning once the audio is done generating
+		:return: None
+		"""
 		self.status = JobStatus.AudioProcessing
+
+		# Skip making the audio if it was already made with the same settings (e.g. by picking a variant)
+		if self.audio_source == (self.yt_url, self.speedup_factor) and pathlib.Path(self.get_audio_location()).exists():
+			return
+
 		video_generation.generate_audio(yt_url = self.yt_url,
 										output_location = self.get_audio_location(),
 										speedup_factor = self.speedup_factor)
+		self.audio_source = (self.yt_url, self.speedup_factor)
 
+	def run_video_stage (self) -> None:
+		"""
+		Runs the video stage of the job, returning once the video is done generating. The audio stage must have been run
+		first.
+		:return: None
+		"""
 		self.status = JobStatus.VideoProcessing
-		video_generation.generate_video(audio_location = self.get_audio_location(),
-										image_location = self.get_image_location(),
-										save_location = self.get_video_location(),
-										song_title = self.song_title,
-										song_artist = self.song_artist,
-										progress_callback = self._set_progress)
+
+		# Use the engine chosen for this job, or the default engine if one wasn't chosen
+		video_options = {
+			"audio_location":    self.get_audio_location(),
+			"image_location":    self.get_image_location(),
+			"save_location":     self.get_video_location(),
+			"song_title":        self.song_title,
+			"song_artist":       self.song_artist,
+			"progress_callback": self._set_progress
+		}
+		if (self.render_engine or Config.get("render_engine")) == "ffmpeg":
+			video_generation.generate_video_ffmpeg(**video_options)
+		else:
+			video_generation.generate_video(**video_options, browser_stats_callback = self._set_browser_stats)
 
 		self.status = JobStatus.Done
 
-	def set_youtube_info (self) -> bool:
+	def run_upload_stage (self, should_stop: Callable[[], bool] = None) -> None:
 		"""
-		Sets the video name, description, and publish time of the video on YouTube
+		Uploads the video to YouTube with its title, description, and publish time, returning once it's uploaded. The
+		video stage must have been run first.
+		:param should_stop: A function which returns true if the upload should be cancelled
 		:return: None
 		"""
-		credentials = google.oauth2.credentials.Credentials(**Config.get("credentials"))
-		youtube = googleapiclient.discovery.build("youtube", "v3", credentials = credentials)
+		self.status = JobStatus.Uploading
 
-		video_id_request = youtube.search().list(
-			part = "snippet",
-			forMine = True,
-			maxResults = 1,
-			q = f'"{self.id}"',
-			type = "video"
-		)
+		if self.publish_slot is None:
+			self.publish_slot = take_publish_date()
 
-		video_id_response: dict = video_id_request.execute()
+		# The publish slot is in local time, YouTube needs UTC
+		publish_date = self.publish_slot.astimezone(timezone.utc).replace(tzinfo = None)
+		body = {
+			"snippet": {
+				"categoryId":  Config.get("upload_category_id"),
+				"description": Config.get("description_format").format(title = self.song_title,
+																		artist = self.song_artist,
+																		yt_url = self.yt_url),
+				"title":       Config.get("title_format").format(title = self.song_title, artist = self.song_artist)
+			},
+			"status":  {
+				"privacyStatus":           "private",
+				"publishAt":               f"{publish_date.isoformat()}Z",
+				"selfDeclaredMadeForKids": False
+			}
+		}
 
-		video_id: str = video_id_response["items"][0]["id"]["videoId"]
+		def on_progress (upload_session: str, uploaded_bytes: int, total_bytes: int) -> None:
+			self.upload_session = upload_session
+			self._set_progress(f"{uploaded_bytes * 100 // total_bytes}%")
 
-		next_publish_date = datetime.fromisoformat(Config.get("next_publish_date"))
+		self.youtube_video_id = youtube_api.get_client().upload_video(self.get_video_location(), body,
+																	   self.upload_session, on_progress, should_stop)
+		self.upload_session = None
 
-		get_details_request = youtube.videos().list(
-			part = "status,snippet",
-			id = video_id
-		)
-
-		video_details = get_details_request.execute()
-
-		set_details_request = youtube.videos().update(
-			part = "status,snippet",
-			body = {
-				"id":      video_id,
-				"snippet": {
-					"categoryId":      video_details["items"][0]["snippet"]["categoryId"],
-					"description":     Config.get("description_format").format(title = self.song_title,
-																			   artist = self.song_artist,
-																			   yt_url = self.yt_url),
-					"tags":            video_details["items"][0]["snippet"]["tags"],
-					"title":           Config.get("title_format").format(title = self.song_title,
-																		 artist = self.song_artist)
-				},
-				"status":  {
-					"embeddable":              video_details["items"][0]["status"]["embeddable"],
-					"license":                 video_details["items"][0]["status"]["license"],
-					"privacyStatus":           "private",
-					"publicStatsViewable":     video_details["items"][0]["status"]["publicStatsViewable"],
-					"publishAt":               f"{next_publish_date.isoformat()}Z",
-					"selfDeclaredMadeForKids": video_details["items"][0]["status"]["selfDeclaredMadeForKids"],
-				}
-			}
-		)
+		self.status = JobStatus.Uploaded
+
+	def set_youtube_info (self) -> bool:
+		"""
+		Sets the video name, description, and publish time of the video on YouTube
+		:return: True if the video was found and updated, false otherwise
+		"""
+		youtube = youtube_api.get_client()
+
+		video_ids = youtube.find_uploads([self.id])
+		if self.id not in video_ids:
+			return False
+		video_details = youtube.get_videos([video_ids[self.id]])
 
-		set_details_request.execute()
+		with publish_date_lock:
+			next_publish_date = datetime.fromisoformat(Config.get("next_publish_date"))
 
-		next_publish_date += timedelta(hours = Config.get("publish_interval_hours"))
-		Config.set("next_publish_date", next_publish_date.isoformat(timespec = "seconds"))
+			results = youtube.update_videos([self.get_youtube_update(video_details[video_ids[self.id]],
+																	 next_publish_date)])
+			if results[video_ids[self.id]] is not None:
+				return False
+
+			next_publish_date += timedelta(hours = Config.get("publish_interval_hours"))
+			Config.set("next_publish_date", next_publish_date.isoformat(timespec = "seconds"))
 
 		self.status = JobStatus.Uploaded
 		return True
 
+	def get_youtube_update (self, video_details: dict[str, Any], publish_date: datetime) -> dict[str, Any]:
+		"""
+		Get the new details of this job's video on YouTube
+		:param video_details: The current snippet and status of the video, from videos.list
+		:param publish_date: The time to publish the video at, in UTC
+		:return: The body of a videos.update request
+		"""
+		return {
+			"id":      video_details["id"],
+			"snippet": {
+				"categoryId":  video_details["snippet"]["categoryId"],
+				"description": Config.get("description_format").format(title = self.song_title,
+																		artist = self.song_artist,
+																		yt_url = self.yt_url),
+				"tags":        video_details["snippet"].get("tags", []),
+				"title":       Config.get("title_format").format(title = self.song_title,
+																 artist = self.song_artist)
+			},
+			"status":  {
+				"embeddable":              video_details["status"]["embeddable"],
+				"license":                 video_details["status"]["license"],
+				"privacyStatus":           "private",
+				"publicStatsViewable":     video_details["status"]["publicStatsViewable"],
+				"publishAt":               f"{publish_date.isoformat()}Z",
+				"selfDeclaredMadeForKids": video_details["status"]["selfDeclaredMadeForKids"],
+			}
+		}
+
+	def to_dict (self, fields: Optional[Collection[str]] = None) -> dict[str, Any]:
+		"""
+		Get the details of this job as plain JSON-compatible values, for the API
+		:param fields: The names of the fields to include, or None to include every field in api_fields
+		:return: A dictionary of field names to values
+		"""
+		values = {}
+		for field in (api_fields if fields is None else fields):
+			value = getattr(self, field)
+			if isinstance(value, JobStatus):
+				value = value.name
+			elif isinstance(value, datetime):
+				value = value.isoformat()
+			elif isinstance(value, tuple):
+				value = list(value)
+			values[field] = value
+		return values
+
 	def _set_progress(self, progress: str) -> None:
 		self.progress_percentage = progress
 
+	def _set_browser_stats (self, startup_secs: Optional[float], memory: Optional[int]) -> None:
+		self.chrome_startup_secs = round(startup_secs, 2) if startup_secs is not None else None
+		self.chrome_rss_mb = memory // (1024 * 1024) if memory is not None else None
+
 	def __str__ (self):
 		return f"{self.id} ({self.song_title})"
 
@@ -173,3 +377,27 @@ class JobStatus(Enum):
 	Uploaded = auto()
 	Deleted = auto()
 	Failed = auto()
+	Uploading = auto()
+
+
+# Stops two jobs being given the same publish date
+publish_date_lock = threading.RLock()
+
+
+def take_publish_date () -> datetime:
+	"""
+	Get the next free publish date, and move the next free date on by the publish interval
+	:return: The publish date, in local time
+	"""
+	with publish_date_lock:
+		next_publish_date = datetime.fromisoformat(Config.get("next_publish_date"))
+		Config.set("next_publish_date", (next_publish_date + timedelta(hours = Config.get("publish_interval_hours")))
+				   .isoformat(timespec = "seconds"))
+	# The config file's publish dates are in UTC
+	return next_publish_date.replace(tzinfo = timezone.utc).astimezone().replace(tzinfo = None)
+
+
+# The fields of a job which are given by the API
+api_fields = ("id", "status", "yt_url", "speedup_factor", "song_title", "song_artist", "progress_percentage",
+			  "failure_info", "priority", "publish_slot", "created_at", "render_engine", "variant_factors",
+			  "chrome_startup_secs", "chrome_rss_mb", "rendering_variants", "variant_failure_info")
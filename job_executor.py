@@ -0,0 +1,303 @@
+import multiprocessing
+import os
+import signal
+import subprocess
+import threading
+from multiprocessing.connection import Connection
+from typing import Any
+
+import video_generation
+from config import Config
+from custom_exceptions import JobCancelledException
+from job import Job
+
+
+def _run_job_stage (job: Job, stage: str) -> None:
+	"""
+	Runs a stage of a job in the current process
+	:param job: The job to run the stage of
+	:param stage: The name of the stage, either "audio" or "video"
+	:return: None
+	"""
+	if stage == "audio":
+		job.run_audio_stage()
+	else:
+		job.run_video_stage()
+
+
+class ThreadExecutor:
+	"""
+	Runs job stages in the thread which requested them. Running stages can't be cancelled.
+	"""
+
+	def prepare (self, stage: str) -> None:
+		"""
+		Get ready to run a stage in the current thread, before its first job
+		:param stage: The name of the stage the thread runs, either "audio" or "video"
+		:return: None
+		"""
+		_prepare_stage(stage)
+
+	def run_stage (self, job: Job, stage: str) -> None:
+		"""
+		Runs a stage of a job, returning once it's finished
+		:param job: The job to run the stage of
+		:param stage: The name of the stage, either "audio" or "video"
+		:return: None
+		"""
+		_run_job_stage(job, stage)
+
+	def release (self, stage: str) -> None:
+		"""
+		Free anything kept for the current thread, when it stops running stages
+		:param stage: The name of the stage the thread ran, either "audio", "video" or "upload"
+		:return: None
+		"""
+		_release_stage(stage)
+
+	def cancel (self, job_id: str) -> bool:
+		"""
+		Cancel the running stage of a job
+		:param job_id: The id of the job to cancel
+		:return: Always false, as stages run in threads can't be stopped
+		"""
+		return False
+
+
+def _prepare_stage (stage: str) -> None:
+	"""
+	Gets the current process ready to run a stage, so work which can be shared between jobs starts before the first job
+	:param stage: The name of the stage, either "audio" or "video"
+	:return: None
+	"""
+	if stage == "video":
+		video_generation.prepare_video_stage()
+
+
+def _release_stage (stage: str) -> None:
+	"""
+	Frees what _prepare_stage got ready in the current process, once a worker stops running the stage
+	:param stage: The name of the stage, either "audio", "video" or "upload"
+	:return: None
+	"""
+	if stage == "video":
+		video_generation.release_video_stage()
+
+
+def _worker_process (connection: Connection) -> None:
+	"""
+	Entry point of the child processes started by ProcessExecutor. Runs stages sent by the parent until the pipe is
+	closed, sending every change to the job back to the parent
+	:param connection: The pipe to receive stages from and send messages to the parent through
+	:return: None
+	"""
+	# Put this process in its own process group, so the whole tree (browser, ffmpeg, etc.) can be killed at once
+	if os.name != "nt":
+		os.setpgrp()
+
+	# Only the main process writes to the config file, but changes it makes are picked up here
+	Config.set_read_only()
+	Config.start_watcher()
+
+	def send_change (_, name: str, old_value: Any, new_value: Any) -> None:
+		connection.send(("set", (name, new_value)))
+
+	while True:
+		try:
+			message_type, value = connection.recv()
+		except EOFError:  # The parent closed the pipe
+			break
+
+		if message_type == "prepare":
+			_prepare_stage(value)
+		elif message_type == "release":
+			_release_stage(value)
+		elif message_type == "run":
+			job, stage = value
+			job.add_observer(send_change)
+			try:
+				_run_job_stage(job, stage)
+				connection.send(("done", None))
+			except Exception as exception:
+				connection.send(("error", str(exception)))
+			finally:
+				job.remove_observer(send_change)
+
+	connection.close()
+
+
+def _kill_process_tree (process: multiprocessing.Process) -> None:
+	"""
+	Kill a process, and all the processes it started
+	:param process: The process to kill
+	:return: None
+	"""
+	try:
+		if os.name == "nt":
+			subprocess.call(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+							stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+		else:
+			os.killpg(process.pid, signal.SIGKILL)
+	except OSError:
+		pass
+
+	# In case the child hadn't created its process group yet
+	process.kill()
+
+
+class ProcessExecutor:
+	"""
+	Runs job stages in child processes, so a stuck or crashing stage can't affect the web server, and can be killed to
+	cancel it. Each worker thread gets its own long-lived child process, so anything it keeps between jobs (such as
+	browser sessions) survives from one job to the next. Changes to the job, such as its status and progress, are sent
+	back to the job in this process through a pipe.
+	"""
+
+	def __init__ (self):
+		# Use spawn on every platform, forking a process with running threads isn't safe
+		self._context = multiprocessing.get_context("spawn")
+		# The stage, child process and pipe of each worker thread, by thread id. Thread ids can be reused once a thread
+		# has stopped, so the stage is kept to make sure a thread never gets a process prepared for a different stage.
+		self._workers: dict[int, tuple[str, multiprocessing.Process, Connection]] = {}
+		# The child process running each job
+		self._processes: dict[str, multiprocessing.Process] = {}
+		self._cancelled_ids: set[str] = set()
+		self._lock = threading.Lock()
+
+	def _get_worker (self, stage: str) -> tuple[multiprocessing.Process, Connection]:
+		"""
+		Get the child process of the current thread, starting a new one if it doesn't have one, it has exited, or it was
+		prepared for a different stage
+		:param stage: The name of the stage the thread runs, so a new process can get ready for it
+		:return: The process, and the pipe to communicate with it
+		"""
+		thread_id = threading.get_ident()
+		with self._lock:
+			worker = self._workers.get(thread_id)
+			if worker is not None and worker[0] == stage and worker[1].is_alive():
+				return worker[1], worker[2]
+			self._workers.pop(thread_id, None)
+
+		# Stop a process left by an earlier thread with the same id, closing its pipe makes it exit
+		if worker is not None:
+			worker[2].close()
+			worker[1].join()
+
+		parent_connection, child_connection = self._context.Pipe()
+		process = self._context.Process(target = _worker_process, args = (child_connection,), daemon = True)
+		process.start()
+		child_connection.close()
+
+		parent_connection.send(("prepare", stage))
+		with self._lock:
+			self._workers[thread_id] = (stage, process, parent_connection)
+		return process, parent_connection
+
+	def _discard_worker (self) -> None:
+		"""
+		Forget the child process of the current thread after it has exited, so a new one is started for the next stage
+		:return: None
+		"""
+		with self._lock:
+			_, process, connection = self._workers.pop(threading.get_ident())
+		connection.close()
+		process.join()
+
+	def prepare (self, stage: str) -> None:
+		"""
+		Start the child process for the current thread, so it can get ready before its first job
+		:param stage: The name of the stage the thread runs, either "audio" or "video"
+		:return: None
+		"""
+		self._get_worker(stage)
+
+	def run_stage (self, job: Job, stage: str) -> None:
+		"""
+		Runs a stage of a job in the current thread's child process, returning once it's finished
+		:param job: The job to run the stage of
+		:param stage: The name of the stage, either "audio" or "video"
+		:return: None
+		"""
+		process, connection = self._get_worker(stage)
+
+		with self._lock:
+			self._processes[job.id] = process
+
+		finished = False
+		error = None
+		try:
+			connection.send(("run", (job, stage)))
+			while not finished:
+				try:
+					message_type, value = connection.recv()
+				except EOFError:  # The child exited without reporting back
+					break
+
+				if message_type == "set":
+					setattr(job, *value)
+				elif message_type == "done":
+					finished = True
+				elif message_type == "error":
+					error = value
+					finished = True
+		except OSError:  # The child was killed before the stage could be sent
+			pass
+		finally:
+			with self._lock:
+				del self._processes[job.id]
+				cancelled = job.id in self._cancelled_ids
+				self._cancelled_ids.discard(job.id)
+
+		if not finished:
+			self._discard_worker()
+
+		if cancelled:
+			raise JobCancelledException("Job cancelled")
+		elif error is not None:
+			raise RuntimeError(error)
+		elif not finished:
+			raise RuntimeError(f"Job process exited unexpectedly with code {process.exitcode}")
+
+	def release (self, stage: str) -> None:
+		"""
+		Stop the child process of the current thread, when the thread stops running stages
+		:param stage: The name of the stage the thread ran, either "audio", "video" or "upload"
+		:return: None
+		"""
+		with self._lock:
+			worker = self._workers.get(threading.get_ident())
+		if worker is not None:
+			# Let the child close what it kept ready for the stage before it exits
+			try:
+				worker[2].send(("release", stage))
+			except OSError:  # The child has already exited
+				pass
+			self._discard_worker()
+
+	def cancel (self, job_id: str) -> bool:
+		"""
+		Cancel the running stage of a job, killing its process and every process it started. A new process is started
+		for the next job.
+		:param job_id: The id of the job to cancel
+		:return: True if the job had a running stage, false otherwise
+		"""
+		with self._lock:
+			if job_id not in self._processes:
+				return False
+			self._cancelled_ids.add(job_id)
+			_kill_process_tree(self._processes[job_id])
+			return True
+
+
+def create_executor (name: str) -> ThreadExecutor | ProcessExecutor:
+	"""
+	Create a job executor given its name
+	:param name: Either "thread" or "process"
+	:return: The new executor
+	"""
+	if name == "process":
+		return ProcessExecutor()
+	elif name == "thread":
+		return ThreadExecutor()
+	else:
+		raise ValueError(f"Unknown executor {name}")
@@ -0,0 +1,162 @@
+import argparse
+import csv
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional, Callable, Any
+
+import requests
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
+
+from config import Config
+
+# Only quick, flat extraction is needed, the audio is downloaded later when the job runs
+_ytdl_options = {
+	"quiet":         True,
+	"no_warnings":   True,
+	"skip_download": True,
+	"extract_flat":  "in_playlist"
+}
+
+# Titles in the form "Artist - Title", with anything in brackets at the end removed (e.g. "(Official Video)")
+_artist_title_pattern = re.compile(r"^\s*(?P<artist>.+?)\s+[-–—]\s+(?P<title>.+?)(?:\s*[(\[][^)\]]*[)\]])*\s*$")
+
+
+class IngestItem (NamedTuple):
+	yt_url: str
+	song_title: str = ""
+	song_artist: str = ""
+
+
+class IngestResult (NamedTuple):
+	# The ids of the jobs which were created
+	job_ids: list[str]
+	# The link and reason for each song which a job couldn't be made for
+	failures: list[tuple[str, str]]
+
+
+def read_csv (text: str) -> list[IngestItem]:
+	"""
+	Read songs from a CSV file, with a link, title and artist on each row. A header row naming the url, title and
+	artist columns is optional.
+	:param text: The contents of the CSV file
+	:return: The songs in the file
+	"""
+	rows = [row for row in csv.reader(io.StringIO(text)) if len(row) != 0 and row[0].strip() != ""]
+	if len(rows) == 0:
+		return []
+
+	columns = {"url": 0, "title": 1, "artist": 2}
+	header = [cell.strip().lower() for cell in rows[0]]
+	if "url" in header:
+		columns = {name: header.index(name) if name in header else None for name in columns}
+		rows = rows[1:]
+
+	def get_cell (row: list[str], name: str) -> str:
+		column = columns[name]
+		return row[column].strip() if column is not None and column < len(row) else ""
+
+	return [IngestItem(get_cell(row, "url"), get_cell(row, "title"), get_cell(row, "artist")) for row in rows]
+
+
+def read_playlist (playlist_url: str) -> list[IngestItem]:
+	"""
+	Get the songs in a YouTube playlist, without fetching the details of each video
+	:param playlist_url: The link to the playlist
+	:return: The songs in the playlist, with only the link to each one
+	"""
+	with YoutubeDL(_ytdl_options) as ytdl:
+		info = ytdl.extract_info(playlist_url, download = False, process = True)
+
+	return [IngestItem(entry.get("webpage_url") or entry["url"]) for entry in info.get("entries", [])
+			if entry is not None]
+
+
+def _guess_title_and_artist (info: dict[str, Any]) -> tuple[str, str]:
+	# Music uploads have the track and artist set
+	if info.get("track") and (info.get("artist") or info.get("artists")):
+		return info["track"], info.get("artist") or ", ".join(info["artists"])
+
+	title = info.get("title") or ""
+	match = _artist_title_pattern.match(title)
+	if match is not None:
+		return match.group("title"), match.group("artist")
+
+	# Otherwise the channel is most likely the artist, e.g. "Artist - Topic" channels
+	channel = (info.get("channel") or info.get("uploader") or "").removesuffix(" - Topic")
+	return title, channel
+
+
+def fill_in_item (item: IngestItem) -> IngestItem:
+	"""
+	Check that a song's video is available, and fill in its title and artist from the video if they weren't given
+	:param item: The song
+	:return: The song, with the title and artist filled in
+	:raises DownloadError: If the video isn't available
+	"""
+	with YoutubeDL(_ytdl_options) as ytdl:
+		# Processing isn't needed, as only the details of the video are used, not its formats
+		info = ytdl.extract_info(item.yt_url, download = False, process = False)
+
+	if info.get("_type", "video") != "video":
+		raise DownloadError(f"{item.yt_url} is not a single video")
+	if info.get("availability") in ("private", "premium_only", "subscriber_only", "needs_auth"):
+		raise DownloadError(f"{item.yt_url} is {info['availability']}")
+
+	title, artist = _guess_title_and_artist(info)
+	return IngestItem(info.get("webpage_url") or item.yt_url, item.song_title or title, item.song_artist or artist)
+
+
+def ingest (items: list[IngestItem], add_jobs: Callable[[list[IngestItem]], list[str]],
+			set_image: Optional[Callable[[str], Any]] = None) -> IngestResult:
+	"""
+	Make a job for each song, after checking the songs' videos and filling in their details in parallel
+	:param items: The songs to make jobs for
+	:param add_jobs: A function which makes a job for each song at once, and returns their ids
+	:param set_image: A function which gives the job with the given id an image, called in parallel for each new job
+	:return: The ids of the jobs which were made, and the songs which jobs couldn't be made for
+	"""
+	def try_fill_in_item (item: IngestItem) -> tuple[IngestItem, Optional[str]]:
+		try:
+			return fill_in_item(item), None
+		except DownloadError as exception:
+			return item, str(exception)
+
+	with ThreadPoolExecutor(Config.get("ingest_thread_count")) as executor:
+		results = list(executor.map(try_fill_in_item, items))
+
+		failures = [(item.yt_url, error) for item, error in results if error is not None]
+		job_ids = add_jobs([item for item, error in results if error is None])
+
+		if set_image is not None:
+			# Wait for every image, so the jobs are ready once this returns
+			list(executor.map(set_image, job_ids))
+
+	return IngestResult(job_ids, failures)
+
+
+def main () -> None:
+	parser = argparse.ArgumentParser(description = "Make jobs for every song in a YouTube playlist or CSV file, using "
+												   "a running Nightnightcore Automaton server")
+	parser.add_argument("source", help = "A link to a YouTube playlist, or the path of a CSV file of url,title,artist")
+	parser.add_argument("--server", default = "http://localhost:8080", help = "The address of the server")
+	arguments = parser.parse_args()
+
+	if arguments.source.startswith(("http://", "https://")):
+		body = {"playlist": arguments.source}
+	else:
+		with open(arguments.source, "r", newline = "", encoding = "utf-8") as csv_file:
+			body = {"csv": csv_file.read()}
+
+	response = requests.post(f"{arguments.server.rstrip('/')}/api/v1/ingest", json = body)
+	response.raise_for_status()
+	result = response.json()
+
+	print(f"Created {len(result['created'])} jobs")
+	for failure in result["failed"]:
+		print(f"Skipped {failure['url']}: {failure['error']}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,177 @@
+import os
+import pathlib
+import threading
+from typing import Callable, Optional, TextIO, TypeVar
+
+import jsonpickle
+
+from job import Job, JobStatus
+
+T = TypeVar("T")
+
+def write_file_atomic (location: str, contents: str) -> None:
+	"""
+	Write a file so that it is either completely written or not changed at all, even if the program crashes part way
+	:param location: The path of the file to write
+	:param contents: The text to write to the file
+	:return: None
+	"""
+	temp_location = f"{location}.tmp"
+	with open(temp_location, "w") as temp_file:
+		temp_file.write(contents)
+		temp_file.flush()
+		os.fsync(temp_file.fileno())
+	os.replace(temp_location, location)
+
+
+class JobJournal:
+	def __init__ (self, location: str):
+		"""
+		Creates a journal of changes to jobs, which is appended to as changes happen, so the latest state can be
+		recovered by replaying it on top of the last snapshot.
+		:param location: The path of the journal file
+		"""
+		self._location = location
+		# While a snapshot is being written the journal it replaces is moved here, so it's kept until the snapshot is
+		# safely written
+		self._old_location = f"{location}.old"
+		self._file: Optional[TextIO] = None
+		self._lock = threading.Lock()
+		# Only one snapshot is written at a time
+		self._compact_lock = threading.Lock()
+
+		# The size of the entries written since the last snapshot, in bytes
+		self._size = sum(os.path.getsize(path) for path in (self._location, self._old_location) if os.path.exists(path))
+
+	def append (self, entry_type: str, job_id: str, **data: any) -> None:
+		"""
+		Add an entry to the end of the journal
+		:param entry_type: One of "created", "field", "status", "queued", "dequeued" or "deleted"
+		:param job_id: The id of the job the entry is for
+		:param data: Any extra data for the entry, "job" for created entries, "name" and "value" for field entries, and
+		"value" for status entries
+		:return: None
+		"""
+		self.append_many([(entry_type, job_id, data)])
+
+	def append_many (self, entries: list[tuple[str, str, dict[str, any]]]) -> None:
+		"""
+		Add several entries to the end of the journal with a single write
+		:param entries: The type, job id, and extra data of each entry, as they would be given to append
+		:return: None
+		"""
+		lines = "".join(jsonpickle.encode({"type": entry_type, "id": job_id, **data}) + "\n"
+						for entry_type, job_id, data in entries)
+		with self._lock:
+			if self._file is None:
+				self._file = open(self._location, "a")
+			self._file.write(lines)
+			self._file.flush()
+			self._size += len(lines)
+
+	def get_size (self) -> int:
+		"""
+		:return: Roughly how much has been written to the journal since the last snapshot, in bytes
+		"""
+		with self._lock:
+			return self._size
+
+	def sync (self) -> None:
+		"""
+		Make sure every entry written so far has reached the disk
+		:return: None
+		"""
+		with self._lock:
+			if self._file is not None:
+				os.fsync(self._file.fileno())
+
+	def replay (self, jobs: dict[str, Job], queue: list[str]) -> int:
+		"""
+		Apply the entries in the journal to a snapshot of the jobs and queue
+		:param jobs: The jobs from the last snapshot, which will be modified
+		:param queue: The ids of the queued jobs from the last snapshot, which will be modified
+		:return: The amount of entries replayed
+		"""
+		count = 0
+		# A journal left by a snapshot which wasn't finished comes before the current one
+		for location in (self._old_location, self._location):
+			if pathlib.Path(location).exists():
+				count += self._replay_file(location, jobs, queue)
+		return count
+
+	@staticmethod
+	def _replay_file (location: str, jobs: dict[str, Job], queue: list[str]) -> int:
+		count = 0
+		with open(location, "rb+") as journal_file:
+			# The end of the last complete entry, in bytes
+			end_offset = 0
+			for line in journal_file:
+				if not line.endswith(b"\n"):
+					# A partly written entry, the program must have stopped while writing it. It's cut off, otherwise the
+					# next entry appended would be joined onto it and lost as well.
+					journal_file.truncate(end_offset)
+					print(f"Removed a partly written entry from the end of {location}")
+					break
+				end_offset += len(line)
+
+				try:
+					entry: dict[str, any] = jsonpickle.decode(line.decode("utf-8"))
+				except ValueError:
+					print(f"Skipped an unreadable entry in {location}")
+					continue
+
+				entry_type, job_id = entry["type"], entry["id"]
+
+				if entry_type == "created":
+					jobs[job_id] = entry["job"]
+				elif job_id not in jobs:
+					pass
+				elif entry_type == "field":
+					setattr(jobs[job_id], entry["name"], entry["value"])
+				elif entry_type == "status":
+					jobs[job_id].status = entry["value"]
+					if entry["value"] != JobStatus.Queued and job_id in queue:
+						queue.remove(job_id)
+				elif entry_type == "queued":
+					if job_id not in queue:
+						queue.append(job_id)
+				elif entry_type == "dequeued":
+					if job_id in queue:
+						queue.remove(job_id)
+				elif entry_type == "deleted":
+					del jobs[job_id]
+					if job_id in queue:
+						queue.remove(job_id)
+
+				count += 1
+		return count
+
+	def compact (self, capture: Callable[[], T], write_snapshot: Callable[[T], None]) -> None:
+		"""
+		Replace the journal with a snapshot. The state is captured and a new journal started without any entries being
+		added in between, then the snapshot is written while entries are added to the new journal. The old journal is
+		kept until the snapshot has been written, so nothing is lost if the program stops part way.
+		:param capture: A function which copies the current state of every job, quickly enough to be done while entries
+		can't be added
+		:param write_snapshot: A function which writes a snapshot, given the state returned by capture
+		:return: None
+		"""
+		with self._compact_lock:
+			with self._lock:
+				state = capture()
+
+				if self._file is not None:
+					self._file.close()
+					self._file = None
+				if pathlib.Path(self._location).exists():
+					if pathlib.Path(self._old_location).exists():
+						# An earlier snapshot wasn't finished, so its journal is still needed
+						with open(self._location, "r") as journal_file, open(self._old_location, "a") as old_file:
+							old_file.write(journal_file.read())
+						os.remove(self._location)
+					else:
+						os.replace(self._location, self._old_location)
+				self._size = 0
+
+			write_snapshot(state)
+			pathlib.Path(self._old_location).unlink(missing_ok = True)
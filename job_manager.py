@@ -1,11 +1,16 @@
 import atexit
-import pathlib
-from typing import NamedTuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
 
-import jsonpickle
-
-from job import Job, JobStatus
+import youtube_api
+from autoscaler import Autoscaler
+from job import Job, JobStatus, publish_date_lock
+from job_executor import create_executor
 from job_queue import JobQueue
+# JobManagerSave used to be defined here, so it needs to be importable from here to load older save files
+from job_store import JobStore, MemoryJobStore, SqliteJobStore, JobManagerSave
 from config import Config
 from custom_exceptions import IdAlreadyUsedException
 
@@ -17,41 +22,68 @@ class JobManager:
 		:param load_state: Set to true to load state from disk
 		"""
 
-		# Load state from disk, if it exists
-		if load_state and pathlib.Path(Config.get("savestate_file")).exists():
-			with open(Config.get("savestate_file"), "r") as save_file:
-				save_state: JobManagerSave = jsonpickle.decode(save_file.read())
+		# Store for all the jobs. Changes are only saved as they happen outside of debug mode, as state isn't saved
+		# automatically when debugging.
+		if Config.get("job_store") == "sqlite":
+			self.jobs: JobStore = SqliteJobStore(Config.get("sqlite_file"), Config.get("savestate_file"),
+												 Config.get("journal_file"), persist = not debug)
+		else:
+			self.jobs: JobStore = MemoryJobStore(Config.get("savestate_file"), Config.get("journal_file"),
+												 persist = not debug,
+												 journal_max_bytes = Config.get("journal_max_mb") * 1024 * 1024)
+
+		# Create a job queue to manage job rendering
+		self._job_queue = JobQueue(audio_thread_count = Config.get("audio_thread_count"),
+								   video_thread_count = Config.get("video_thread_count"),
+								   handoff_queue_size = Config.get("handoff_queue_size"),
+								   executor = create_executor(Config.get("executor")),
+								   upload_thread_count = Config.get("upload_thread_count"),
+								   auto_upload = Config.get("auto_upload"))
 
-			# Dict to store all the jobs
-			self.jobs: dict[str, Job] = save_state.jobs
+		# Variants are rendered in the background, one job at a time, so the page asking for them isn't kept waiting
+		self._variant_executor = ThreadPoolExecutor(1, thread_name_prefix = "Variants")
+		self._variant_lock = threading.Lock()
 
-			# Create a job queue
-			self._job_queue = JobQueue(Config.get("thread_count"))
+		# Changes the amount of threads for each stage to suit the load, when enabled in the config file
+		self.autoscaler = Autoscaler(self._job_queue)
+
+		# Apply changes to the config file while running
+		Config.subscribe(self._on_config_changed)
+
+		# Load state from disk, if it exists
+		if load_state:
+			queue_ids = self.jobs.load()
 
 			# Search for in-progress jobs and add to the start of the queue
-			for job in self.jobs.values():
-				if job.status in (JobStatus.AudioProcessing, JobStatus.VideoProcessing):
-					job.status = JobStatus.Waiting
-					self.queue_job(job.id)
+			for job in self.jobs.get_with_status(JobStatus.AudioProcessing, JobStatus.VideoProcessing).values():
+				job.status = JobStatus.Waiting
+				self.queue_job(job.id)
+
+			# Continue uploads which hadn't finished
+			for job in self.jobs.get_with_status(JobStatus.Uploading).values():
+				self.upload_job(job.id)
 
 			# Queue the remaining jobs
-			for job_id in save_state.queue:
+			for job_id in queue_ids:
 				self.jobs[job_id].status = JobStatus.Waiting
 				self.queue_job(job_id)
 
-		# Load a blank state
-		else:
-			# Dict to store all the jobs
-			self.jobs: dict[str, Job] = {}
-			# Create a job queue to manage job rendering
-			self._job_queue = JobQueue(Config.get("thread_count"))
-
 		# Start the processing threads
 		if not debug:
+			# Save the loaded state straight away, so only changes from this run need saving later
+			self.save_state()
+
 			self._job_queue.start_threads()
+			self.autoscaler.start()
 
 			atexit.register(self._exit_handler)
 
+	def _on_config_changed (self, name: str, old_value: any, new_value: any) -> None:
+		if name in ("audio_thread_count", "video_thread_count", "upload_thread_count"):
+			self._job_queue.set_worker_count(name.removesuffix("_thread_count"), new_value)
+		elif name == "auto_upload":
+			self._job_queue.set_auto_upload(new_value)
+
 	def _exit_handler (self):
 		# When using the debug server don't autosave state
 		self.save_state()
@@ -63,11 +95,25 @@ class JobManager:
 		:return: The id of the job that was added
 		"""
 		if new_job.id not in self.jobs:
-			self.jobs[new_job.id] = new_job
+			self.jobs.add(new_job)
 			return new_job.id
 		else:
 			raise IdAlreadyUsedException(f"Job ID {new_job.id} already used")
 
+	def add_jobs (self, new_jobs: list[Job]) -> list[str]:
+		"""
+		Add several new jobs to this job manager at once
+		:param new_jobs: The jobs to be added
+		:return: The ids of the jobs that were added
+		"""
+		job_ids = [job.id for job in new_jobs]
+		for job_id in job_ids:
+			if job_id in self.jobs or job_ids.count(job_id) > 1:
+				raise IdAlreadyUsedException(f"Job ID {job_id} already used")
+
+		self.jobs.add_many(new_jobs)
+		return job_ids
+
 	def delete_job (self, job_id: str) -> bool:
 		"""
 		Delete a job and its files
@@ -77,7 +123,7 @@ class JobManager:
 		if job_id in self.jobs:
 			self.jobs[job_id].cleanup_files()
 			self.dequeue_job(job_id)
-			del self.jobs[job_id]
+			self.jobs.remove(job_id)
 			return True
 		else:
 			return False
@@ -88,13 +134,51 @@ class JobManager:
 		:param job_id: The id of the job to dequeue
 		:return: True if the job was in the queue, false otherwise
 		"""
-		if job_id in self._job_queue.get_queue_ids():
-			self._job_queue.delete_job(self.jobs[job_id])
+		if job_id in self.jobs and self._job_queue.delete_job(self.jobs[job_id]):
+			self.jobs.record_dequeued(job_id)
 			self.jobs[job_id].status = JobStatus.Waiting
 			return True
 		else:
 			return False
 
+	def cancel_job (self, job_id: str) -> bool:
+		"""
+		Cancel a job, removing it from the queue if it is queued, or stopping it if it is processing
+		:param job_id: The id of the job to cancel
+		:return: True if the job was queued or processing, false otherwise
+		"""
+		if job_id not in self.jobs:
+			return False
+		return self.dequeue_job(job_id) or self._job_queue.cancel_job(self.jobs[job_id])
+
+	def set_job_priority (self, job_id: str, priority: int) -> bool:
+		"""
+		Set the priority of a job, moving it to its new place in the queue if it is queued
+		:param job_id: The id of the job to set the priority of
+		:param priority: The new priority, jobs with a higher priority are run first
+		:return: True if the job exists, false otherwise
+		"""
+		if job_id in self.jobs:
+			self.jobs[job_id].priority = priority
+			self._job_queue.reprioritise_job(self.jobs[job_id])
+			return True
+		else:
+			return False
+
+	def set_job_publish_slot (self, job_id: str, publish_slot: Optional[datetime]) -> bool:
+		"""
+		Set the publish slot of a job, moving it to its new place in the queue if it is queued
+		:param job_id: The id of the job to set the publish slot of
+		:param publish_slot: The time the job's video is meant to be published, or None if it doesn't have one
+		:return: True if the job exists, false otherwise
+		"""
+		if job_id in self.jobs:
+			self.jobs[job_id].publish_slot = publish_slot
+			self._job_queue.reprioritise_job(self.jobs[job_id])
+			return True
+		else:
+			return False
+
 	def get_jobs_with_status (self, *statuses: JobStatus) -> dict[str, Job]:
 		"""
 		Get all jobs with given status
@@ -102,9 +186,20 @@ class JobManager:
 		:return: A dictionary containing only the jobs with the given statuses
 		"""
 		if len(statuses) != 0:
-			return {job_id: job for job_id, job in self.jobs.items() if job.status in statuses}
+			return self.jobs.get_with_status(*statuses)
 		else:
-			return self.jobs
+			return dict(self.jobs)
+
+	def get_jobs_page (self, statuses: tuple[JobStatus, ...], after: Optional[str] = None,
+					   page_size: Optional[int] = None) -> tuple[list[Job], Optional[str]]:
+		"""
+		Get a page of jobs with the given statuses, in the order they were created
+		:param statuses: The job statuses to get jobs with. If no statuses are specified, includes all jobs
+		:param after: The cursor of the previous page, or None to get the first page
+		:param page_size: The most jobs in the page, or None to use the size defined by the config file
+		:return: A list of jobs in the page, and the cursor of the next page, or None if this is the last page
+		"""
+		return self.jobs.get_page(statuses, after, page_size if page_size is not None else Config.get("jobs_page_size"))
 
 	def get_queue (self) -> list[Job]:
 		"""
@@ -112,8 +207,8 @@ class JobManager:
 		This is a copy of the queue, modifying it will not modify the queue
 		:return: A list of all jobs in the queue
 		"""
-		in_progress = [job for job in self.jobs.values() if job.status in
-					   (JobStatus.AudioProcessing, JobStatus.VideoProcessing)]
+		in_progress = list(self.get_jobs_with_status(JobStatus.AudioProcessing, JobStatus.VideoProcessing,
+													 JobStatus.Uploading).values())
 		return in_progress + [self.jobs[job_id] for job_id in self._job_queue.get_queue_ids()]
 
 	def queue_job (self, job_id: str) -> bool:
@@ -122,48 +217,125 @@ class JobManager:
 		:param job_id: The id of the job to queue
 		:return: True if the job was queued, false otherwise
 		"""
-		if job_id in self.jobs:
-			return self._job_queue.queue_job(self.jobs[job_id])
+		if job_id in self.jobs and self._job_queue.queue_job(self.jobs[job_id]):
+			self.jobs.record_queued(job_id)
+			return True
 		else:
 			return False
 
+	def upload_job (self, job_id: str) -> bool:
+		"""
+		Upload a job's video to YouTube, given its id
+		:param job_id: The id of the job to upload
+		:return: True if the job was added to the upload queue, false otherwise
+		"""
+		return job_id in self.jobs and self._job_queue.queue_upload(self.jobs[job_id])
+
+	def render_variants (self, job_id: str, speedup_factors: list[float], preview_start: float) -> bool:
+		"""
+		Start rendering a job's audio with several speedup factors in the background, so one can be picked. The job's
+		rendering_variants is set until they're finished, and variant_failure_info is set if rendering them fails.
+		:param job_id: The id of the job
+		:param speedup_factors: The speedup factors to try
+		:param preview_start: The time in the original song the previews start from, in seconds
+		:return: True if rendering was started, false if the job doesn't exist or its variants are already being rendered
+		"""
+		if job_id not in self.jobs:
+			return False
+		job = self.jobs[job_id]
+
+		with self._variant_lock:
+			if job.rendering_variants:
+				return False
+			job.rendering_variants = True
+		job.variant_failure_info = None
+
+		self._variant_executor.submit(self._render_variants, job, speedup_factors, preview_start)
+		return True
+
+	@staticmethod
+	def _render_variants (job: Job, speedup_factors: list[float], preview_start: float) -> None:
+		try:
+			job.render_variants(speedup_factors, preview_start)
+		except Exception as exception:
+			print(f"Failed to render variants for job {job.id}: {exception}")
+			job.variant_failure_info = str(exception)
+		finally:
+			job.rendering_variants = False
+
 	def queue_all_ready_waiting (self) -> int:
 		"""
 		Add all jobs which are both ready, and have a status of waiting, to the queue
 		:return: The amount of jobs queued
 		"""
 		count = 0
-		for job_id, job in self.jobs.items():
-			if job.status == JobStatus.Waiting and job.check_ready():
+		for job_id, job in self.jobs.get_with_status(JobStatus.Waiting).items():
+			if job.check_ready():
 				if self._job_queue.queue_job(job):
+					self.jobs.record_queued(job_id)
 					count += 1
 		return count
 
+	def set_youtube_info_all (self) -> bool:
+		"""
+		Set the YouTube details of every done job's video, giving them publish times one after another. The videos are
+		found and updated with as few API requests as possible.
+		:return: True if every done job's video was found and updated, false otherwise
+		"""
+		jobs = sorted(self.get_jobs_with_status(JobStatus.Done).values(), key = lambda job: job.created_at)
+		if len(jobs) == 0:
+			return True
+
+		youtube = youtube_api.get_client()
+		video_ids = youtube.find_uploads([job.id for job in jobs])
+		video_details = youtube.get_videos(list(video_ids.values()))
+
+		jobs_with_videos = [job for job in jobs if job.id in video_ids and video_ids[job.id] in video_details]
+		with publish_date_lock:
+			next_publish_date = datetime.fromisoformat(Config.get("next_publish_date"))
+			publish_interval = timedelta(hours = Config.get("publish_interval_hours"))
+
+			results = youtube.update_videos([job.get_youtube_update(video_details[video_ids[job.id]],
+																	 next_publish_date + publish_interval * index)
+											 for index, job in enumerate(jobs_with_videos)])
+
+			last_published = None
+			for index, job in enumerate(jobs_with_videos):
+				if results.get(video_ids[job.id], Exception()) is None:
+					job.status = JobStatus.Uploaded
+					last_published = index
+				else:
+					print(f"Failed to set YouTube info for {job}: {results.get(video_ids[job.id])}")
+
+			# Continue after the last video which was given a publish time
+			if last_published is not None:
+				next_publish_date += publish_interval * (last_published + 1)
+				Config.set("next_publish_date", next_publish_date.isoformat(timespec = "seconds"))
+
+		return len(jobs_with_videos) == len(jobs) and all(job.status == JobStatus.Uploaded for job in jobs)
+
 	def save_state (self) -> None:
 		"""
-		Save the current state of this job manager to a file. The location of the file is defined by the config file
+		Save the current state of this job manager. The location it is saved to is defined by the config file
 		:return:
 		"""
-		save_state = JobManagerSave(jobs = self.jobs, queue = self._job_queue.get_queue_ids())
-		with open(Config.get("savestate_file"), "w") as save_file:
-			save_file.write(jsonpickle.encode(save_state))
-		print(f"Saved state to {Config.get('savestate_file')}")
+		self.jobs.save(self._job_queue.get_queue_ids)
+		if Config.get("job_store") == "sqlite":
+			print(f"Saved state to {Config.get('sqlite_file')}")
+		else:
+			print(f"Saved state to {Config.get('savestate_file')}")
 
 	def get_counts (self) -> dict[str, int]:
 		"""
 		Return a dictionary containing counts of each type of job. The categories are
 		:return:
 		"""
-		return {"total":      len(self.jobs),
-				"waiting":    len(self.get_jobs_with_status(JobStatus.Waiting)),
-				"queued":     len(self.get_jobs_with_status(JobStatus.Queued)),
-				"processing": len(self.get_jobs_with_status(JobStatus.AudioProcessing,
-															JobStatus.VideoProcessing)),
-				"done":       len(self.get_jobs_with_status(JobStatus.Done)),
-				"uploaded":   len(self.get_jobs_with_status(JobStatus.Uploaded)),
-				"failed":     len(self.get_jobs_with_status(JobStatus.Failed, JobStatus.Deleted))}
-
-
-class JobManagerSave(NamedTuple):
-	jobs: dict[str, Job]
-	queue: list[str]
+		counts = self.jobs.count_by_status()
+		return {"total":      sum(counts.values()),
+				"waiting":    counts[JobStatus.Waiting],
+				"queued":     counts[JobStatus.Queued],
+				"processing": counts[JobStatus.AudioProcessing] + counts[JobStatus.VideoProcessing] +
+							  counts[JobStatus.Uploading],
+				"done":       counts[JobStatus.Done],
+				"uploaded":   counts[JobStatus.Uploaded],
+				"failed":     counts[JobStatus.Failed] + counts[JobStatus.Deleted]}
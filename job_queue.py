@@ -1,55 +1,283 @@
+import pathlib
 import queue
 import threading
+import time
 from collections import deque
 from collections.abc import Collection
+from typing import NamedTuple, Optional
 
+from custom_exceptions import JobCancelledException
 from job import JobStatus, Job
+from job_executor import ThreadExecutor, ProcessExecutor
+from job_scheduler import JobScheduler
+
+
+class StageStats (NamedTuple):
+	# The amount of threads the stage should have
+	workers: int
+	# The amount of threads currently running the stage for a job
+	busy: int
+	# The amount of jobs in the queue which still need to go through the stage
+	waiting: int
+	# The average time the stage took for recent jobs, or None if it hasn't been run yet
+	mean_secs: Optional[float]
 
 
 class JobQueue:
-	def __init__ (self, thread_count: int = 1, starting_queue: Collection[Job] = None):
+	def __init__ (self, audio_thread_count: int = 1, video_thread_count: int = 1, handoff_queue_size: int = 1,
+			executor: ThreadExecutor | ProcessExecutor = None, starting_queue: Collection[Job] = None,
+			upload_thread_count: int = 1, auto_upload: bool = False):
 		"""
-		Creates a new job queue, which manages the execution of jobs
-		:param thread_count: The amount of threads to create (default 1)
+		Creates a new job queue, which manages the execution of jobs. Jobs are run as a pipeline of two stages, audio and
+		video, each with its own pool of threads, so the audio for the next job can be generated while the video for the
+		current job is rendering. Finished videos can then be uploaded by a third pool of threads.
+		:param audio_thread_count: The amount of threads to create for the audio stage (default 1)
+		:param video_thread_count: The amount of threads to create for the video stage (default 1)
+		:param handoff_queue_size: The maximum amount of jobs which can have finished the audio stage while waiting for
+		a video thread (default 1)
+		:param executor: The executor to run job stages with (default runs them in the worker threads)
 		:param starting_queue: A collection of items to insert into the queue
+		:param upload_thread_count: The amount of threads to create for the upload stage (default 1)
+		:param auto_upload: Set to true to upload every video once it's rendered
 		"""
-		self._queue: queue.Queue[Job] = queue.Queue()
+		self._queue = JobScheduler()
+
+		self._executor = executor if executor is not None else ThreadExecutor()
+
+		# Ids of jobs which have been cancelled while between stages
+		self._cancelled_ids: set[str] = set()
+		# Ids of jobs with an audio or video stage running in the executor
+		self._running_ids: set[str] = set()
+		self._cancelled_lock = threading.Lock()
+
+		# Jobs which have finished the audio stage, waiting for the video stage. This is bounded so the audio stage can
+		# only get a limited amount of jobs ahead of the video stage.
+		self._handoff_queue: queue.Queue[Job] = queue.Queue(maxsize = handoff_queue_size)
+
+		# Jobs waiting to be uploaded. Uploads don't hold up rendering, so this isn't bounded.
+		self._upload_queue: queue.Queue[Job] = queue.Queue()
+		# Ids of jobs in the upload queue or being uploaded, so a job isn't uploaded twice
+		self._upload_ids: set[str] = set()
+		self._auto_upload = auto_upload
 
 		if starting_queue is not None:
 			for job in starting_queue:
 				self._queue.put(job)
 
-		# Initialise the given amount of threads
-		self._threads = [threading.Thread(target = self._thread_worker, args = [x], daemon = True)
-						 for x in range(thread_count)]
-
-	def _thread_worker (self, thread_number: int) -> None:
-		print(f"Thread {thread_number} started")
-		while True:
-			# Get next available job
-			current_job = self._queue.get()
-			print(f"Thread {thread_number}: got job {current_job.id} ({current_job.song_title})")
-
-			# Skip jobs that cause exceptions, and note what the exception is
-			try:
-				current_job.run_job()
-				print(f"Thread {thread_number}: Job {current_job.id} ({current_job.song_title}) succeeded")
-			except Exception as exception:
-				print(f"Thread {thread_number}: Job {current_job.id} ({current_job.song_title}) failed")
-				current_job.status = JobStatus.Failed
-				current_job.failure_info = str(exception)
-
-			# Mark job as done
-			self._queue.task_done()
-			print(f"Thread {thread_number}: Job {current_job.id} ({current_job.song_title}) done")
+		# The amount of threads each stage should have, and the threads it has by number. The counts can be changed
+		# while jobs are running.
+		self._worker_counts = {"audio": audio_thread_count, "video": video_thread_count, "upload": upload_thread_count}
+		self._workers: dict[str, dict[int, threading.Thread]] = {stage: {} for stage in self._worker_counts}
+		self._workers_lock = threading.Lock()
+		self._started = False
+
+		# The amount of threads running each stage, and how long the stage took for the last few jobs
+		self._busy_counts = {stage: 0 for stage in self._worker_counts}
+		self._stage_times: dict[str, deque[float]] = {stage: deque(maxlen = 20) for stage in self._worker_counts}
+
+	def _run_stage (self, thread_name: str, job: Job, stage: str) -> bool:
+		"""
+		Runs a stage of a job, marking the job as failed if the stage raises an exception
+		:param thread_name: The name of the thread running the stage, for logging
+		:param job: The job to run the stage of
+		:param stage: The name of the stage, either "audio", "video" or "upload"
+		:return: True if the stage succeeded, false otherwise
+		"""
+		with self._workers_lock:
+			self._busy_counts[stage] += 1
+		start_time = time.monotonic()
+
+		# Skip jobs that cause exceptions, and note what the exception is
+		try:
+			with self._cancelled_lock:
+				if job.id in self._cancelled_ids:
+					self._cancelled_ids.remove(job.id)
+					raise JobCancelledException("Job cancelled")
+				if stage != "upload":
+					self._running_ids.add(job.id)
+
+			if stage == "upload":
+				# Uploads wait on the network, so they are run in the thread, where they can be stopped between chunks
+				job.run_upload_stage(should_stop = lambda: self._take_cancelled(job.id))
+			else:
+				self._executor.run_stage(job, stage)
+			print(f"{thread_name}: Job {job.id} ({job.song_title}) {stage} stage succeeded")
+			with self._workers_lock:
+				self._stage_times[stage].append(time.monotonic() - start_time)
+			return True
+		except Exception as exception:
+			print(f"{thread_name}: Job {job.id} ({job.song_title}) {stage} stage failed")
+			job.status = JobStatus.Failed
+			job.failure_info = str(exception)
+			job.failed_stage = stage
+			return False
+		finally:
+			with self._cancelled_lock:
+				self._running_ids.discard(job.id)
+			with self._workers_lock:
+				self._busy_counts[stage] -= 1
+
+	def _take_cancelled (self, job_id: str) -> bool:
+		"""
+		Check if a job has been cancelled, so it can be stopped
+		:param job_id: The id of the job
+		:return: True if the job was cancelled, in which case it is no longer marked as cancelled
+		"""
+		with self._cancelled_lock:
+			if job_id in self._cancelled_ids:
+				self._cancelled_ids.remove(job_id)
+				return True
+			return False
+
+	def _start_workers (self) -> None:
+		"""
+		Start threads for each stage until it has as many as it should
+		:return: None
+		"""
+		targets = {"audio": self._audio_thread_worker, "video": self._video_thread_worker,
+				   "upload": self._upload_thread_worker}
+		with self._workers_lock:
+			for stage, count in self._worker_counts.items():
+				for thread_number in range(count):
+					if thread_number not in self._workers[stage]:
+						thread = threading.Thread(target = targets[stage], args = [thread_number], daemon = True)
+						self._workers[stage][thread_number] = thread
+						thread.start()
+
+	def _retire_worker (self, stage: str, thread_number: int) -> bool:
+		"""
+		Check if a thread should stop because its stage has been given fewer threads, between jobs
+		:param stage: The stage the thread runs
+		:param thread_number: The number of the thread
+		:return: True if the thread should stop, in which case it's no longer counted as one of the stage's threads
+		"""
+		with self._workers_lock:
+			if thread_number >= self._worker_counts[stage]:
+				del self._workers[stage][thread_number]
+				return True
+			return False
+
+	def _audio_thread_worker (self, thread_number: int) -> None:
+		thread_name = f"Audio thread {thread_number}"
+		print(f"{thread_name} started")
+		try:
+			while not self._retire_worker("audio", thread_number):
+				# Get next available job, checking occasionally if this thread should stop
+				current_job = self._queue.get(timeout = 1)
+				if current_job is None:
+					continue
+				print(f"{thread_name}: got job {current_job.id} ({current_job.song_title})")
+
+				# Pass the job on to the video stage, waiting if the video stage is too far behind
+				if self._run_stage(thread_name, current_job, "audio"):
+					self._handoff_queue.put(current_job)
+		finally:
+			# Stop anything kept for this thread between jobs (e.g. its child process)
+			self._executor.release("audio")
+			print(f"{thread_name} stopped")
+
+	def _video_thread_worker (self, thread_number: int) -> None:
+		thread_name = f"Video thread {thread_number}"
+		print(f"{thread_name} started")
+
+		# Let the executor get ready for videos (e.g. open a browser) while waiting for the first job
+		try:
+			self._executor.prepare("video")
+		except Exception as exception:
+			print(f"{thread_name}: Failed to prepare for videos: {exception}")
+		try:
+			while not self._retire_worker("video", thread_number):
+				# Get next job which has finished the audio stage
+				try:
+					current_job = self._handoff_queue.get(timeout = 1)
+				except queue.Empty:
+					continue
+				print(f"{thread_name}: got job {current_job.id} ({current_job.song_title})")
+
+				if self._run_stage(thread_name, current_job, "video") and self._auto_upload:
+					self.queue_upload(current_job)
+
+				# Mark job as done
+				self._handoff_queue.task_done()
+				print(f"{thread_name}: Job {current_job.id} ({current_job.song_title}) done")
+		finally:
+			self._executor.release("video")
+			print(f"{thread_name} stopped")
+
+	def _upload_thread_worker (self, thread_number: int) -> None:
+		thread_name = f"Upload thread {thread_number}"
+		print(f"{thread_name} started")
+		try:
+			while not self._retire_worker("upload", thread_number):
+				try:
+					current_job = self._upload_queue.get(timeout = 1)
+				except queue.Empty:
+					continue
+				print(f"{thread_name}: got job {current_job.id} ({current_job.song_title})")
+
+				self._run_stage(thread_name, current_job, "upload")
+				with self._cancelled_lock:
+					self._upload_ids.discard(current_job.id)
+		finally:
+			# Uploads run in this thread, but release anyway in case the executor kept something for it
+			self._executor.release("upload")
+			print(f"{thread_name} stopped")
 
 	def start_threads (self) -> None:
 		"""
 		Start processing jobs
 		:return: None
 		"""
-		for thread in self._threads:
-			thread.start()
+		self._started = True
+		self._start_workers()
+
+	def set_worker_count (self, stage: str, count: int) -> None:
+		"""
+		Change the amount of threads a stage has while jobs are running. Extra threads are started straight away, and
+		threads which are no longer needed stop once they have finished their current job.
+		:param stage: The name of the stage, either "audio", "video" or "upload"
+		:param count: The new amount of threads
+		:return: None
+		"""
+		with self._workers_lock:
+			self._worker_counts[stage] = count
+		if self._started:
+			self._start_workers()
+
+	def get_worker_counts (self) -> dict[str, int]:
+		"""
+		:return: The amount of threads each stage should have, by stage name
+		"""
+		with self._workers_lock:
+			return dict(self._worker_counts)
+
+	def get_stage_stats (self) -> dict[str, StageStats]:
+		"""
+		Get how busy each stage is, for deciding how many threads each stage needs
+		:return: The stats of each stage, by stage name
+		"""
+		with self._workers_lock:
+			busy_counts = dict(self._busy_counts)
+			worker_counts = dict(self._worker_counts)
+			mean_times = {stage: sum(times) / len(times) if len(times) != 0 else None
+						  for stage, times in self._stage_times.items()}
+
+		# Every job waiting for or running the audio stage still needs the video stage too
+		waiting_audio = len(self._queue)
+		waiting = {"audio": waiting_audio,
+				   "video": waiting_audio + busy_counts["audio"] + self._handoff_queue.qsize(),
+				   "upload": self._upload_queue.qsize()}
+
+		return {stage: StageStats(worker_counts[stage], busy_counts[stage], waiting[stage], mean_times[stage])
+				for stage in worker_counts}
+
+	def set_auto_upload (self, auto_upload: bool) -> None:
+		"""
+		Choose whether videos are uploaded once they're rendered
+		:param auto_upload: Set to true to upload every video once it's rendered
+		:return: None
+		"""
+		self._auto_upload = auto_upload
 
 	def get_queue_ids (self) -> list[str]:
 		"""
@@ -57,7 +285,7 @@ class JobQueue:
 		:return: A list containing the ids of all jobs in the queue, from first to last
 		(not including currently processing jobs)
 		"""
-		return [job.id for job in self._queue.queue]
+		return [job.id for job in self._queue.get_jobs()]
 
 	def queue_job (self, new_job: Job) -> bool:
 		"""
@@ -69,15 +297,71 @@ class JobQueue:
 		if new_job.status in (JobStatus.Waiting, JobStatus.Failed) and new_job.check_ready():
 			new_job.status = JobStatus.Queued
 			new_job.failure_info = None
+			new_job.failed_stage = None
+			with self._cancelled_lock:
+				self._cancelled_ids.discard(new_job.id)
 			self._queue.put(new_job)
 			return True
 		else:
 			return False
 
-	def delete_job (self, job: Job) -> None:
+	def queue_upload (self, job: Job) -> bool:
+		"""
+		Add a job to the upload queue
+		:param job: The job to upload, must have finished rendering, or have failed or been stopped while uploading
+		:return: True if the job was added to the upload queue, false otherwise
+		"""
+		# A job which failed while rendering might have a video left from an earlier render, which mustn't be uploaded
+		if job.status == JobStatus.Failed and job.failed_stage != "upload":
+			return False
+		if job.status not in (JobStatus.Done, JobStatus.Failed, JobStatus.Uploading) or \
+				not pathlib.Path(job.get_video_location()).exists():
+			return False
+
+		with self._cancelled_lock:
+			if job.id in self._upload_ids:
+				return False
+			self._upload_ids.add(job.id)
+			self._cancelled_ids.discard(job.id)
+
+		job.failure_info = None
+		job.failed_stage = None
+		self._upload_queue.put(job)
+		return True
+
+	def delete_job (self, job: Job) -> bool:
 		"""
 		Remove a job from the queue
 		:param job: The job to remove
-		:return: None
+		:return: True if the job was in the queue, false otherwise
+		"""
+		return self._queue.remove(job.id)
+
+	def reprioritise_job (self, job: Job) -> bool:
 		"""
-		self._queue.queue.remove(job)
+		Move a job to its new place in the queue after its priority or publish slot has been changed
+		:param job: The job to move
+		:return: True if the job was in the queue, false otherwise
+		"""
+		return self._queue.reprioritise(job)
+
+	def cancel_job (self, job: Job) -> bool:
+		"""
+		Cancel a job which is currently processing. A running stage is killed if the executor can stop it, uploads are
+		stopped after their current chunk, and jobs between stages are stopped before their next stage. Jobs which are
+		still in the queue should be removed with delete_job instead.
+		:param job: The job to cancel
+		:return: True if the job will be stopped, false if it isn't processing or its running stage can't be stopped
+		"""
+		if job.status not in (JobStatus.AudioProcessing, JobStatus.VideoProcessing, JobStatus.Uploading):
+			return False
+
+		if job.status != JobStatus.Uploading and self._executor.cancel(job.id):
+			return True
+
+		with self._cancelled_lock:
+			# The thread executor can't stop a stage part way through
+			if job.id in self._running_ids:
+				return False
+			self._cancelled_ids.add(job.id)
+		return True
@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from typing import Optional
+
+from job import Job
+
+
+class JobScheduler:
+	def __init__ (self):
+		"""
+		Creates a new job scheduler, a thread-safe priority queue of jobs which also keeps an index of the jobs in it by
+		id, so jobs can be removed or reprioritised without searching the whole queue.
+		Jobs with a higher priority are run first, then jobs with an earlier publish slot, then jobs which were added
+		first.
+		"""
+		# Heap of [priority key, insertion count, job] entries. Removed entries have their job set to None and are
+		# skipped when they reach the top of the heap.
+		self._heap: list[list] = []
+		# The live heap entry for each job id in the scheduler
+		self._entries: dict[str, list] = {}
+		self._removed_count = 0
+		self._counter = itertools.count()
+		self._condition = threading.Condition()
+
+		# Cached sorted copy of the queue, cleared whenever the queue changes
+		self._snapshot: Optional[tuple[Job, ...]] = None
+
+	@staticmethod
+	def _get_priority_key (job: Job) -> tuple[int, float]:
+		"""
+		:param job: The job to get the priority key for
+		:return: A tuple which sorts jobs that should be run sooner first
+		"""
+		publish_slot = job.publish_slot.timestamp() if job.publish_slot is not None else math.inf
+		return -job.priority, publish_slot
+
+	def _push (self, job: Job) -> None:
+		entry = [self._get_priority_key(job), next(self._counter), job]
+		self._entries[job.id] = entry
+		heapq.heappush(self._heap, entry)
+
+	def _remove (self, job_id: str) -> bool:
+		entry = self._entries.pop(job_id, None)
+		if entry is None:
+			return False
+
+		entry[-1] = None
+		self._removed_count += 1
+
+		# Rebuild the heap once most of it is removed entries, so it doesn't grow forever
+		if self._removed_count > len(self._heap) // 2:
+			self._heap = [entry for entry in self._heap if entry[-1] is not None]
+			heapq.heapify(self._heap)
+			self._removed_count = 0
+		return True
+
+	def put (self, job: Job) -> None:
+		"""
+		Add a job to the scheduler, replacing it if it is already in the scheduler
+		:param job: The job to add
+		:return: None
+		"""
+		with self._condition:
+			self._remove(job.id)
+			self._push(job)
+			self._snapshot = None
+			self._condition.notify()
+
+	def get (self, timeout: Optional[float] = None) -> Optional[Job]:
+		"""
+		Remove and return the job which should be run next, waiting until one is available
+		:param timeout: The most time to wait for a job in seconds, or None to wait forever
+		:return: The next job, or None if there wasn't one before the timeout
+		"""
+		deadline = time.monotonic() + timeout if timeout is not None else None
+		with self._condition:
+			while True:
+				while len(self._heap) != 0:
+					entry = heapq.heappop(self._heap)
+					if entry[-1] is not None:
+						del self._entries[entry[-1].id]
+						self._snapshot = None
+						return entry[-1]
+					self._removed_count -= 1
+
+				if deadline is None:
+					self._condition.wait()
+				elif not self._condition.wait(deadline - time.monotonic()):
+					return None
+
+	def remove (self, job_id: str) -> bool:
+		"""
+		Remove a job from the scheduler
+		:param job_id: The id of the job to remove
+		:return: True if the job was in the scheduler, false otherwise
+		"""
+		with self._condition:
+			if self._remove(job_id):
+				self._snapshot = None
+				return True
+			else:
+				return False
+
+	def reprioritise (self, job: Job) -> bool:
+		"""
+		Move a job to its new position after its priority or publish slot has changed
+		:param job: The job to move
+		:return: True if the job was in the scheduler, false otherwise
+		"""
+		with self._condition:
+			if self._remove(job.id):
+				self._push(job)
+				self._snapshot = None
+				return True
+			else:
+				return False
+
+	def __contains__ (self, job_id: str) -> bool:
+		with self._condition:
+			return job_id in self._entries
+
+	def __len__ (self) -> int:
+		with self._condition:
+			return len(self._entries)
+
+	def get_jobs (self) -> tuple[Job, ...]:
+		"""
+		Get a snapshot of the jobs in the scheduler
+		:return: A tuple containing every job in the scheduler, in the order they will be run
+		"""
+		with self._condition:
+			if self._snapshot is None:
+				self._snapshot = tuple(entry[-1] for entry in sorted(self._entries.values()))
+			return self._snapshot
@@ -0,0 +1,472 @@
+import abc
+import copy
+import itertools
+import pathlib
+import sqlite3
+import threading
+from collections.abc import Mapping, Iterator
+from typing import NamedTuple, Optional, Callable, Any
+
+import jsonpickle
+
+from job import Job, JobStatus
+from job_journal import JobJournal, write_file_atomic
+
+
+class JobManagerSave(NamedTuple):
+	jobs: dict[str, Job]
+	queue: list[str]
+
+
+class JobStore (Mapping[str, Job], abc.ABC):
+	"""
+	Base class for the storage backends of a JobManager. A job store is a read-only mapping of job ids to jobs, which
+	saves changes to the jobs in it as they happen.
+	"""
+
+	# Functions called with (job, attribute name, old value, new value) after a job in the store has changed
+	_listeners: tuple[Callable[[Job, str, Any, Any], Any], ...] = ()
+
+	def add_listener (self, listener: Callable[[Job, str, Any, Any], Any]) -> None:
+		"""
+		Add a function to be called whenever a public attribute of a job in the store changes, after the store has
+		recorded the change
+		:param listener: A function taking the job, the name of the attribute, the old value, and the new value
+		:return: None
+		"""
+		self._listeners = self._listeners + (listener,)
+
+	def _notify_listeners (self, job: Job, name: str, old_value: Any, new_value: Any) -> None:
+		for listener in self._listeners:
+			listener(job, name, old_value, new_value)
+
+	@abc.abstractmethod
+	def load (self) -> list[str]:
+		"""
+		Load the saved jobs
+		:return: The ids of the jobs which were queued when they were saved, from first to last
+		"""
+
+	@abc.abstractmethod
+	def save (self, get_queue_ids: Callable[[], list[str]]) -> None:
+		"""
+		Make sure everything in the store has been saved
+		:param get_queue_ids: A function which returns the ids of the jobs currently queued, from first to last. It's
+		called while changes to the store are held back, so the queue matches the saved jobs.
+		:return: None
+		"""
+
+	@abc.abstractmethod
+	def add (self, job: Job) -> None:
+		"""
+		Add a new job to the store
+		:param job: The job to add, which must have an id not already in the store
+		:return: None
+		"""
+
+	def add_many (self, jobs: list[Job]) -> None:
+		"""
+		Add several new jobs to the store at once, which is faster than adding them one at a time
+		:param jobs: The jobs to add, which must all have ids not already in the store
+		:return: None
+		"""
+		for job in jobs:
+			self.add(job)
+
+	@abc.abstractmethod
+	def remove (self, job_id: str) -> None:
+		"""
+		Remove a job from the store
+		:param job_id: The id of the job to remove
+		:return: None
+		"""
+
+	@abc.abstractmethod
+	def record_queued (self, job_id: str) -> None:
+		"""
+		Record that a job was added to the queue
+		:param job_id: The id of the job
+		:return: None
+		"""
+
+	@abc.abstractmethod
+	def record_dequeued (self, job_id: str) -> None:
+		"""
+		Record that a job was removed from the queue without being run
+		:param job_id: The id of the job
+		:return: None
+		"""
+
+	@abc.abstractmethod
+	def get_with_status (self, *statuses: JobStatus) -> dict[str, Job]:
+		"""
+		Get all jobs with the given statuses
+		:param statuses: One or more job statuses to get jobs with
+		:return: A dictionary of the jobs with the given statuses, in the order they were added
+		"""
+
+	@abc.abstractmethod
+	def get_page (self, statuses: tuple[JobStatus, ...], after: Optional[str], limit: int) \
+			-> tuple[list[Job], Optional[str]]:
+		"""
+		Get a page of jobs, in the order they were added
+		:param statuses: The statuses of jobs to include, or an empty tuple to include all jobs
+		:param after: The cursor returned with the previous page, or None to get the first page
+		:param limit: The maximum amount of jobs in the page
+		:return: The jobs in the page, and the cursor for the next page, or None if this is the last page
+		:raises ValueError: If the cursor isn't one returned by this store
+		"""
+
+	@abc.abstractmethod
+	def count_by_status (self) -> dict[JobStatus, int]:
+		"""
+		:return: The amount of jobs with each status
+		"""
+
+
+class MemoryJobStore (JobStore):
+	def __init__ (self, snapshot_location: str, journal_location: str, persist: bool = True,
+			journal_max_bytes: int = 8 * 1024 * 1024):
+		"""
+		Creates a job store which keeps every job in memory. Changes are appended to a journal as they happen, and
+		compacted into a snapshot when saved once the journal has grown large enough.
+		:param snapshot_location: The path of the snapshot file
+		:param journal_location: The path of the journal file
+		:param persist: Set to false to only save changes when save is called
+		:param journal_max_bytes: How large the journal can get before saving replaces it with a snapshot
+		"""
+		self._jobs: dict[str, Job] = {}
+		# Index of jobs by their status, kept up to date as job statuses change
+		self._status_index: dict[JobStatus, dict[str, Job]] = {status: {} for status in JobStatus}
+		# The order jobs were added in, so jobs from different statuses can be listed in a consistent order
+		self._job_order: dict[str, int] = {}
+		self._job_counter = itertools.count()
+		self._lock = threading.RLock()
+
+		self._snapshot_location = snapshot_location
+		self._journal = JobJournal(journal_location)
+		self._persist = persist
+		self._journal_max_bytes = journal_max_bytes
+
+	def __getitem__ (self, job_id: str) -> Job:
+		return self._jobs[job_id]
+
+	def __iter__ (self) -> Iterator[str]:
+		with self._lock:
+			return iter(list(self._jobs))
+
+	def __len__ (self) -> int:
+		return len(self._jobs)
+
+	def _append_to_journal (self, entry_type: str, job_id: str, **data: any) -> None:
+		if self._persist:
+			self._journal.append(entry_type, job_id, **data)
+
+	def _index_job (self, job: Job) -> None:
+		with self._lock:
+			self._jobs[job.id] = job
+			self._status_index[job.status][job.id] = job
+			self._job_order[job.id] = next(self._job_counter)
+		job.add_observer(self._on_job_changed)
+
+	def _on_job_changed (self, job: Job, name: str, old_value: any, new_value: any) -> None:
+		if name == "status":
+			with self._lock:
+				self._status_index[old_value].pop(job.id, None)
+				self._status_index[new_value][job.id] = job
+			self._append_to_journal("status", job.id, value = new_value)
+		elif name not in Job.transient_attributes:
+			self._append_to_journal("field", job.id, name = name, value = new_value)
+
+		self._notify_listeners(job, name, old_value, new_value)
+
+	def load (self) -> list[str]:
+		if pathlib.Path(self._snapshot_location).exists():
+			with open(self._snapshot_location, "r") as save_file:
+				save_state: JobManagerSave = jsonpickle.decode(save_file.read())
+		else:
+			save_state = JobManagerSave(jobs = {}, queue = [])
+
+		# Apply the changes made since the last save
+		replayed_count = self._journal.replay(save_state.jobs, save_state.queue)
+		print(f"Replayed {replayed_count} changes to {self._snapshot_location}")
+
+		for job in save_state.jobs.values():
+			self._index_job(job)
+		return save_state.queue
+
+	def save (self, get_queue_ids: Callable[[], list[str]]) -> None:
+		# A snapshot takes longer the more jobs there are, so one is only written once the journal is large enough to
+		# slow down loading. Until then the journal alone keeps every change.
+		if self._persist and self._journal.get_size() < self._journal_max_bytes:
+			self._journal.sync()
+			return
+
+		def capture () -> JobManagerSave:
+			# Copies of the jobs, so they can be encoded while they keep changing
+			with self._lock:
+				jobs = {job_id: copy.copy(job) for job_id, job in self._jobs.items()}
+			return JobManagerSave(jobs = jobs, queue = get_queue_ids())
+
+		def write_snapshot (save_state: JobManagerSave) -> None:
+			write_file_atomic(self._snapshot_location, jsonpickle.encode(save_state))
+
+		self._journal.compact(capture, write_snapshot)
+
+	def add (self, job: Job) -> None:
+		self._index_job(job)
+		self._append_to_journal("created", job.id, job = job)
+
+	def add_many (self, jobs: list[Job]) -> None:
+		for job in jobs:
+			self._index_job(job)
+		if self._persist:
+			self._journal.append_many([("created", job.id, {"job": job}) for job in jobs])
+
+	def remove (self, job_id: str) -> None:
+		with self._lock:
+			job = self._jobs.pop(job_id)
+			del self._status_index[job.status][job_id]
+			del self._job_order[job_id]
+		job.remove_observer(self._on_job_changed)
+		self._append_to_journal("deleted", job_id)
+
+	def record_queued (self, job_id: str) -> None:
+		self._append_to_journal("queued", job_id)
+
+	def record_dequeued (self, job_id: str) -> None:
+		self._append_to_journal("dequeued", job_id)
+
+	def get_with_status (self, *statuses: JobStatus) -> dict[str, Job]:
+		with self._lock:
+			# Jobs are in the order they got their status within each status, so they're sorted back into the order
+			# they were added in
+			jobs = [job for status in set(statuses) for job in self._status_index[status].values()]
+			jobs.sort(key = lambda job: self._job_order[job.id])
+			return {job.id: job for job in jobs}
+
+	def get_page (self, statuses: tuple[JobStatus, ...], after: Optional[str], limit: int) \
+			-> tuple[list[Job], Optional[str]]:
+		with self._lock:
+			jobs = list(self.get_with_status(*statuses).values() if len(statuses) != 0 else self._jobs.values())
+			if after is not None:
+				jobs = [job for job in jobs if self._job_order[job.id] > int(after)]
+
+			if len(jobs) > limit:
+				return jobs[:limit], str(self._job_order[jobs[limit - 1].id])
+			else:
+				return jobs, None
+
+	def count_by_status (self) -> dict[JobStatus, int]:
+		with self._lock:
+			return {status: len(jobs) for status, jobs in self._status_index.items()}
+
+
+class SqliteJobStore (JobStore):
+	def __init__ (self, location: str, snapshot_location: str, journal_location: str, persist: bool = True):
+		"""
+		Creates a job store which keeps jobs in an SQLite database, indexed by status and creation time. Jobs are only
+		loaded into memory when they are used.
+		:param location: The path of the database file
+		:param snapshot_location: The path of a snapshot file written by MemoryJobStore, which is imported if the
+		database is empty
+		:param journal_location: The path of the journal file that goes with the snapshot file
+		:param persist: Set to false to only save changes when save is called
+		"""
+		# Autocommit mode, transactions are only used when not persisting changes straight away
+		self._connection = sqlite3.connect(location, check_same_thread = False, isolation_level = None)
+		self._connection.execute("PRAGMA journal_mode = WAL")
+		self._connection.execute("PRAGMA synchronous = NORMAL")
+		self._connection.executescript("""
+CREATE TABLE IF NOT EXISTS jobs (
+	seq INTEGER PRIMARY KEY AUTOINCREMENT,
+	id TEXT NOT NULL UNIQUE,
+	status TEXT NOT NULL,
+	created_at REAL NOT NULL,
+	data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS queue (
+	seq INTEGER PRIMARY KEY AUTOINCREMENT,
+	id TEXT NOT NULL UNIQUE
+);
+""")
+		self._lock = threading.RLock()
+
+		# Jobs which have been loaded, so every use of a job gets the same object
+		self._cache: dict[str, Job] = {}
+
+		self._snapshot_location = snapshot_location
+		self._journal_location = journal_location
+
+		self._persist = persist
+		if not persist:
+			self._connection.execute("BEGIN")
+
+		self._counts: dict[JobStatus, int] = {status: 0 for status in JobStatus}
+		for status_name, count in self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+			self._counts[JobStatus[status_name]] = count
+
+	def __getitem__ (self, job_id: str) -> Job:
+		with self._lock:
+			if job_id in self._cache:
+				return self._cache[job_id]
+
+			row = self._connection.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+			if row is None:
+				raise KeyError(job_id)
+			return self._load_job(job_id, row[0])
+
+	def __contains__ (self, job_id: object) -> bool:
+		with self._lock:
+			return job_id in self._cache or \
+				self._connection.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is not None
+
+	def __iter__ (self) -> Iterator[str]:
+		with self._lock:
+			return iter([row[0] for row in self._connection.execute("SELECT id FROM jobs ORDER BY seq")])
+
+	def __len__ (self) -> int:
+		with self._lock:
+			return sum(self._counts.values())
+
+	def _load_job (self, job_id: str, data: str) -> Job:
+		"""
+		Get a job from the cache, or decode it and add it to the cache if it isn't loaded yet
+		:param job_id: The id of the job
+		:param data: The encoded job, from the data column
+		:return: The job
+		"""
+		with self._lock:
+			if job_id not in self._cache:
+				job: Job = jsonpickle.decode(data)
+				job.add_observer(self._on_job_changed)
+				self._cache[job_id] = job
+			return self._cache[job_id]
+
+	def _load_jobs (self, query: str, parameters: tuple) -> list[Job]:
+		"""
+		Load the jobs selected by a query
+		:param query: A query selecting the id and data columns of the jobs
+		:param parameters: The parameters of the query
+		:return: The jobs, in the order the query returned them
+		"""
+		with self._lock:
+			return [self._load_job(job_id, data) for job_id, data in self._connection.execute(query, parameters)]
+
+	def _insert_job (self, job: Job) -> None:
+		self._connection.execute("INSERT INTO jobs (id, status, created_at, data) VALUES (?, ?, ?, ?)",
+								 (job.id, job.status.name, job.created_at, jsonpickle.encode(job)))
+		self._counts[job.status] += 1
+
+	def _on_job_changed (self, job: Job, name: str, old_value: any, new_value: any) -> None:
+		if name not in Job.transient_attributes:
+			with self._lock:
+				if name == "status":
+					self._counts[old_value] -= 1
+					self._counts[new_value] += 1
+					if old_value == JobStatus.Queued:
+						self._connection.execute("DELETE FROM queue WHERE id = ?", (job.id,))
+
+				self._connection.execute("UPDATE jobs SET status = ?, data = ? WHERE id = ?",
+										 (job.status.name, jsonpickle.encode(job), job.id))
+
+		self._notify_listeners(job, name, old_value, new_value)
+
+	def load (self) -> list[str]:
+		with self._lock:
+			# Import the jobs from a MemoryJobStore the first time the database is used
+			if len(self) == 0 and (pathlib.Path(self._snapshot_location).exists() or
+								   pathlib.Path(self._journal_location).exists() or
+								   pathlib.Path(f"{self._journal_location}.old").exists()):
+				memory_store = MemoryJobStore(self._snapshot_location, self._journal_location, persist = False)
+				queue_ids = memory_store.load()
+
+				self._connection.execute("SAVEPOINT import")
+				for job in memory_store.values():
+					self._insert_job(job)
+				for job_id in queue_ids:
+					self._connection.execute("INSERT INTO queue (id) VALUES (?)", (job_id,))
+				self._connection.execute("RELEASE import")
+				print(f"Imported {len(self)} jobs from {self._snapshot_location}")
+
+			return [row[0] for row in self._connection.execute("SELECT id FROM queue ORDER BY seq")]
+
+	def save (self, get_queue_ids: Callable[[], list[str]]) -> None:
+		with self._lock:
+			if not self._persist:
+				self._connection.execute("COMMIT")
+				self._connection.execute("BEGIN")
+
+	def add (self, job: Job) -> None:
+		with self._lock:
+			self._insert_job(job)
+			job.add_observer(self._on_job_changed)
+			self._cache[job.id] = job
+
+	def add_many (self, jobs: list[Job]) -> None:
+		# One transaction for all the jobs, instead of one each
+		with self._lock:
+			self._connection.execute("SAVEPOINT add_many")
+			try:
+				for job in jobs:
+					self._insert_job(job)
+			except sqlite3.Error:
+				# None of the jobs are added, so undo the counts of the ones which were
+				self._connection.execute("ROLLBACK TO add_many")
+				self._connection.execute("RELEASE add_many")
+				self._counts = {status: 0 for status in JobStatus}
+				for status_name, count in self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+					self._counts[JobStatus[status_name]] = count
+				raise
+			self._connection.execute("RELEASE add_many")
+
+			for job in jobs:
+				job.add_observer(self._on_job_changed)
+				self._cache[job.id] = job
+
+	def remove (self, job_id: str) -> None:
+		with self._lock:
+			job = self[job_id]
+			job.remove_observer(self._on_job_changed)
+			del self._cache[job_id]
+			self._counts[job.status] -= 1
+			self._connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+			self._connection.execute("DELETE FROM queue WHERE id = ?", (job_id,))
+
+	def record_queued (self, job_id: str) -> None:
+		with self._lock:
+			self._connection.execute("INSERT OR IGNORE INTO queue (id) VALUES (?)", (job_id,))
+
+	def record_dequeued (self, job_id: str) -> None:
+		with self._lock:
+			self._connection.execute("DELETE FROM queue WHERE id = ?", (job_id,))
+
+	def get_with_status (self, *statuses: JobStatus) -> dict[str, Job]:
+		jobs = self._load_jobs(f"SELECT id, data FROM jobs WHERE status IN ({', '.join('?' * len(statuses))}) "
+							   f"ORDER BY seq", tuple(status.name for status in statuses))
+		return {job.id: job for job in jobs}
+
+	def get_page (self, statuses: tuple[JobStatus, ...], after: Optional[str], limit: int) \
+			-> tuple[list[Job], Optional[str]]:
+		conditions = ["seq > ?"]
+		parameters: list[any] = [int(after) if after is not None else 0]
+		if len(statuses) != 0:
+			conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+			parameters.extend(status.name for status in statuses)
+
+		with self._lock:
+			# Get one more row than needed, to find out if there's another page
+			rows = self._connection.execute(f"SELECT seq, id, data FROM jobs WHERE {' AND '.join(conditions)} "
+											f"ORDER BY seq LIMIT ?", (*parameters, limit + 1)).fetchall()
+			jobs = [self._load_job(job_id, data) for _, job_id, data in rows[:limit]]
+
+		if len(rows) > limit:
+			return jobs, str(rows[limit - 1][0])
+		else:
+			return jobs, None
+
+	def count_by_status (self) -> dict[JobStatus, int]:
+		with self._lock:
+			return dict(self._counts)
@@ -1,14 +1,24 @@
+import json
+import os
+import subprocess
 import threading
 import time
+from datetime import datetime
+from typing import Any
 
 import flask
 import jsonpickle
 from flask import Flask, render_template, send_file, request, redirect, url_for
 
 import google_auth_oauthlib.flow
+from yt_dlp.utils import DownloadError
 
+from event_broker import EventBroker
+import image_derivatives
 import image_generation
-from job import Job, JobStatus
+import job_ingest
+from image_pool import ImagePool
+from job import Job, JobStatus, api_fields
 from job_manager import JobManager
 from config import Config
 
@@ -16,8 +26,33 @@ app = Flask(__name__)
 
 debug = app.config["DEBUG"]
 
+# Let the web server in front of the app send files itself, without copying them through Python
+app.config["USE_X_SENDFILE"] = Config.get("x_sendfile")
+
 job_manager = JobManager(True, debug)
 
+# Changes to jobs, sent to browsers so they can update pages without reloading them
+event_broker = EventBroker(Config.get("event_max_streams"))
+
+
+def publish_job_change (job: Job, name: str, old_value: Any, new_value: Any) -> None:
+	if name in ("status", "progress_percentage"):
+		event_broker.publish("job", job.id, {"id":                  job.id,
+											 "status":              job.status.name,
+											 "progress_percentage": job.progress_percentage})
+	if name == "status":
+		event_broker.publish("counts", "", job_manager.get_counts())
+	if name == "rendering_variants" and not new_value:
+		event_broker.publish("variants", job.id, {"id":                 job.id,
+												  "rendering_variants": job.rendering_variants})
+
+
+job_manager.jobs.add_listener(publish_job_change)
+
+# Images downloaded ahead of time, so new jobs get an image straight away
+image_pool = ImagePool(Config.get("image_pool_location"), Config.get("image_pool_size"),
+					   image_generation.get_random_image_from_web)
+
 
 # Start up a thread that saves the state every x minutes
 def save_timer ():
@@ -30,6 +65,8 @@ def save_timer ():
 if not debug:
 	print("Production Mode")
 	threading.Thread(target = save_timer, daemon = True).start()
+	Config.start_watcher()
+	image_pool.start_filler()
 else:
 	print("Debug Mode")
 
@@ -76,6 +113,7 @@ def settings ():
 
 @app.route("/settings/download")
 def download_config ():
+	Config.flush()
 	return send_file("config.json", as_attachment = True)
 
 
@@ -132,6 +170,35 @@ def favicon ():
 	return send_file("./nightnightcore.ico")
 
 
+@app.route("/events")
+def events ():
+	# Each stream holds one of the web server's threads for as long as the page is open, so only a few are allowed. Pages
+	# which can't get one poll for changes instead.
+	subscription = event_broker.subscribe()
+	if subscription is None:
+		return flask.Response("Too many event streams are open", status = 503, headers = {"Retry-After": "60"})
+
+	def event_stream ():
+		try:
+			yield ": connected\n\n"  # Sends the headers straight away, instead of once there is an event
+
+			while True:
+				new_events = subscription.get(timeout = 15)
+				if len(new_events) == 0:
+					yield ": keepalive\n\n"  # Lets the server notice if the browser has gone
+					continue
+
+				for event_type, data in new_events:
+					yield f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+				# Wait before sending more, so changes in the meantime (e.g. progress updates) are combined
+				time.sleep(Config.get("event_interval_secs"))
+		finally:
+			event_broker.unsubscribe(subscription)
+
+	return flask.Response(event_stream(), mimetype = "text/event-stream", headers = {"Cache-Control": "no-cache"})
+
+
 @app.route("/save")
 def save ():
 	job_manager.save_state()
@@ -140,27 +207,68 @@ def save ():
 
 # -- JOBS --
 
+def send_job_file (location: str, as_attachment: bool = False) -> flask.Response:
+	"""
+	Send one of a job's files, with an ETag based on the file's identity so browsers only download it again if it has
+	changed. Range requests are supported, so audio and video can be streamed and seeked.
+	:param location: The path of the file
+	:param as_attachment: True to make the browser download the file instead of showing it
+	:return: The response
+	"""
+	try:
+		stat = os.stat(location)
+	except FileNotFoundError:
+		flask.abort(404)
+
+	return send_file(location, as_attachment = as_attachment, conditional = True, last_modified = stat.st_mtime,
+					 etag = f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}")
+
+
+def set_random_image (job: Job) -> None:
+	"""
+	Give a job a random image, from the image pool if it has one ready, otherwise by downloading one
+	:param job: The job to give an image to
+	:return: None
+	"""
+	try:
+		if not image_pool.claim(job.get_image_location()):
+			image_generation.get_random_image_from_web(job.get_image_location())
+		image_derivatives.create_derivatives(job.get_image_location())
+	except Exception as exception:
+		print(exception)
+
+
+def get_statuses_from_types (job_types: list[str]) -> list[JobStatus]:
+	"""
+	Get the job statuses matching the job types used to filter lists of jobs
+	:param job_types: Any of "waiting", "queued", "processing", "done", "uploaded", and "failed"
+	:return: The statuses of jobs of those types
+	"""
+	job_statues: list[JobStatus] = []
+	for job_type in job_types:
+		if job_type == "waiting":
+			job_statues.append(JobStatus.Waiting)
+		elif job_type == "queued":
+			job_statues.append(JobStatus.Queued)
+		elif job_type == "processing":
+			job_statues.extend((JobStatus.AudioProcessing, JobStatus.VideoProcessing, JobStatus.Uploading))
+		elif job_type == "done":
+			job_statues.append(JobStatus.Done)
+		elif job_type == "uploaded":
+			job_statues.append(JobStatus.Uploaded)
+		elif job_type == "failed":
+			job_statues.extend((JobStatus.Failed, JobStatus.Deleted))
+	return job_statues
+
+
 @app.route("/jobs")
 def list_jobs ():
-	job_statues: list[JobStatus] = []
 	request_terms: list[str] = []
 	if "types" in request.args:
 		request_terms = request.args["types"].split(",")
 		if request_terms == [""]:
 			request_terms = []
-		for job_type in request_terms:
-			if job_type == "waiting":
-				job_statues.append(JobStatus.Waiting)
-			elif job_type == "queued":
-				job_statues.append(JobStatus.Queued)
-			elif job_type == "processing":
-				job_statues.extend((JobStatus.AudioProcessing, JobStatus.VideoProcessing))
-			elif job_type == "done":
-				job_statues.append(JobStatus.Done)
-			elif job_type == "uploaded":
-				job_statues.append(JobStatus.Uploaded)
-			elif job_type == "failed":
-				job_statues.extend((JobStatus.Failed, JobStatus.Deleted))
+	job_statues = get_statuses_from_types(request_terms)
 
 	filter_button_types: dict[str, list[str]] = {}
 	for request_term in ("waiting", "queued", "processing", "done", "uploaded", "failed"):
@@ -171,10 +279,13 @@ def list_jobs ():
 
 	job_counts = job_manager.get_counts()
 
-	jobs = job_manager.get_jobs_with_status(*job_statues)
+	try:
+		jobs, next_page = job_manager.get_jobs_page(tuple(job_statues), request.args.get("after"))
+	except ValueError:
+		flask.abort(400, "Invalid cursor in after")
 
 	return render_template("jobs.html", request_terms = request_terms, job_counts = job_counts, jobs = jobs,
-						   filter_button_types = filter_button_types, JobStatus = JobStatus)
+						   next_page = next_page, filter_button_types = filter_button_types, JobStatus = JobStatus)
 
 
 @app.route("/job/<job_id>", methods = ["GET", "POST"])
@@ -182,38 +293,96 @@ def job_page (job_id: str):
 	job = job_manager.jobs[job_id]
 
 	if request.method == "POST":
+		# Checked before anything is changed, so a bad form leaves the job as it was
+		try:
+			priority = int(request.form["priority"])
+			publish_slot = datetime.fromisoformat(request.form["publish-slot"]) if request.form["publish-slot"] else None
+		except ValueError:
+			flask.abort(400, "Priority must be a whole number and publish slot must be a date and time")
+
 		job.song_title = request.form["song-title"]
 		job.song_artist = request.form["song-artist"]
 		job.yt_url = request.form["yt-url"]
 		job.speedup_factor = float(request.form["speedup-factor"])
+		job.render_engine = request.form["render-engine"] or None
+		job_manager.set_job_priority(job_id, priority)
+		job_manager.set_job_publish_slot(job_id, publish_slot)
 
 		if request.form["submit-type"] == "new-image":
+			set_random_image(job)
+		elif request.form["submit-type"] == "render-variants":
 			try:
-				image_generation.get_random_image_from_web(job_manager.jobs[job_id].get_image_location())
-			except Exception as exception:
-				print(exception)
+				speedup_factors = [float(factor) for factor in request.form["variant-factors"].split(",")
+								   if factor.strip() != ""]
+				preview_start = float(request.form["preview-start"] or 0)
+			except ValueError:
+				flask.abort(400, "Speedup factors and preview start must be numbers")
+			job_manager.render_variants(job_id, speedup_factors, preview_start)
 
 		if "job-image" in request.files and request.files["job-image"].filename != "":
 			request.files["job-image"].save(job.get_image_location())
+			try:
+				image_derivatives.create_derivatives(job.get_image_location())
+			except Exception as exception:
+				print(exception)
 
 	job_counts = job_manager.get_counts()
 
-	return render_template("job.html", job_counts = job_counts, job = job, JobStatus = JobStatus)
+	return render_template("job.html", job_counts = job_counts, job = job, JobStatus = JobStatus,
+						   default_variant_factors = Config.get("variant_factors"),
+						   has_audio = os.path.exists(job.get_audio_location()),
+						   has_video = os.path.exists(job.get_video_location()))
+
+
+@app.route("/job/<job_id>/card")
+def get_job_card (job_id: str):
+	return render_template("job_card.html", job = job_manager.jobs[job_id], JobStatus = JobStatus)
 
 
 @app.route("/job/<job_id>/image")
 def get_job_image (job_id: str):
-	return send_file(job_manager.jobs[job_id].get_image_location())
+	return send_job_file(job_manager.jobs[job_id].get_image_location())
+
+
+@app.route("/job/<job_id>/image/<size>")
+def get_job_image_size (job_id: str, size: str):
+	if size not in image_derivatives.sizes:
+		flask.abort(404)
+	image_location = job_manager.jobs[job_id].get_image_location()
+	try:
+		return send_job_file(image_derivatives.get_derivative(image_location, size))
+	except (FileNotFoundError, subprocess.CalledProcessError) as exception:
+		# Send the full size image if a smaller copy can't be made, e.g. because ffmpeg is missing. If the job doesn't
+		# have an image this gives a 404.
+		if os.path.exists(image_location):
+			print(f"Failed to make {size} copy of {image_location}: {exception}")
+		return send_job_file(image_location)
 
 
 @app.route("/job/<job_id>/audio")
 def get_job_audio (job_id: str):
-	return send_file(job_manager.jobs[job_id].get_audio_location(), as_attachment = True)
+	# Players on the job page ask for the file inline
+	return send_job_file(job_manager.jobs[job_id].get_audio_location(), as_attachment = "inline" not in request.args)
 
 
 @app.route("/job/<job_id>/video")
 def get_job_video (job_id: str):
-	return send_file(job_manager.jobs[job_id].get_video_location(), as_attachment = True)
+	return send_job_file(job_manager.jobs[job_id].get_video_location(), as_attachment = "inline" not in request.args)
+
+
+@app.route("/job/<job_id>/variant/<float:speedup_factor>/preview")
+def get_job_variant_preview (job_id: str, speedup_factor: float):
+	return send_job_file(job_manager.jobs[job_id].get_variant_location(speedup_factor, preview = True))
+
+
+@app.route("/job/<job_id>/variant/<float:speedup_factor>/pick")
+def pick_job_variant (job_id: str, speedup_factor: float):
+	job = job_manager.jobs[job_id]
+	# The audio can't be replaced while the job is using it
+	if job.status in (JobStatus.Waiting, JobStatus.Failed) and job.pick_variant(speedup_factor):
+		return "true"
+	else:
+		return "false"
 
 
 @app.route("/job/<job_id>/queue")
@@ -224,6 +393,19 @@ def queue_job (job_id: str):
 		return "false"
 
 
+@app.route("/job/<job_id>/priority")
+def get_job_priority (job_id: str):
+	return str(job_manager.jobs[job_id].priority)
+
+
+@app.route("/job/<job_id>/priority/<int(signed=True):priority>")
+def set_job_priority (job_id: str, priority: int):
+	if job_manager.set_job_priority(job_id, priority):
+		return "true"
+	else:
+		return "false"
+
+
 @app.route("/job/queue-all")
 def queue_all_ready ():
 	job_manager.queue_all_ready_waiting()
@@ -238,6 +420,14 @@ def dequeue_job (job_id: str):
 		return "false"
 
 
+@app.route("/job/<job_id>/cancel")
+def cancel_job (job_id: str):
+	if job_manager.cancel_job(job_id):
+		return "true"
+	else:
+		return "false"
+
+
 @app.route("/job/<job_id>/delete")
 def delete_job (job_id: str):
 	if job_manager.delete_job(job_id):
@@ -246,6 +436,14 @@ def delete_job (job_id: str):
 		return "false"
 
 
+@app.route("/job/<job_id>/upload")
+def upload_job (job_id: str):
+	if job_manager.upload_job(job_id):
+		return "true"
+	else:
+		return "false"
+
+
 @app.route("/job/<job_id>/set_youtube_info")
 def set_youtube_info (job_id: str):
 	if job_manager.jobs[job_id].set_youtube_info():
@@ -256,13 +454,7 @@ def set_youtube_info (job_id: str):
 
 @app.route("/job/set_youtube_info_all")
 def set_youtube_info_all ():
-	any_failures = False
-	for job in job_manager.jobs.values():
-		if job.status == JobStatus.Done:
-			if not job.set_youtube_info():
-				any_failures = True
-
-	if not any_failures:
+	if job_manager.set_youtube_info_all():
 		return "true"
 	else:
 		return "false"
@@ -271,10 +463,7 @@ def set_youtube_info_all ():
 @app.route("/new-job")
 def create_job ():
 	job_id = job_manager.add_job(Job())
-	try:
-		image_generation.get_random_image_from_web(job_manager.jobs[job_id].get_image_location())
-	except Exception as exception:
-		print(exception)
+	set_random_image(job_manager.jobs[job_id])
 	return redirect(url_for("job_page", job_id = job_id))
 
 
@@ -286,7 +475,140 @@ def queue_status ():
 
 	queue = job_manager.get_queue()
 
-	return render_template("queue.html", job_counts = job_counts, queue = queue, JobStatus = JobStatus)
+	return render_template("queue.html", job_counts = job_counts, queue = queue, JobStatus = JobStatus,
+						   scaling = job_manager.autoscaler.get_status())
+
+
+# -- API --
+
+# The actions which can be run on many jobs at once through the API, by name. Each takes a job id and returns True if
+# the action succeeded.
+api_job_actions = {
+	"queue":            job_manager.queue_job,
+	"dequeue":          job_manager.dequeue_job,
+	"cancel":           job_manager.cancel_job,
+	"delete":           job_manager.delete_job,
+	"upload":           job_manager.upload_job,
+	"set_youtube_info": lambda job_id: job_id in job_manager.jobs and job_manager.jobs[job_id].set_youtube_info()
+}
+
+
+def api_error (status_code: int, message: str) -> flask.Response:
+	response = flask.jsonify({"error": message})
+	response.status_code = status_code
+	return response
+
+
+def get_api_fields () -> list[str]:
+	"""
+	Get the job fields asked for with the "fields" parameter of an API request
+	:return: The names of the fields, or every field if the parameter wasn't given
+	"""
+	if "fields" not in request.args:
+		return list(api_fields)
+
+	fields = [field for field in request.args["fields"].split(",") if field != ""]
+	unknown_fields = [field for field in fields if field not in api_fields]
+	if len(unknown_fields) != 0:
+		flask.abort(api_error(400, f"Unknown fields: {', '.join(unknown_fields)}"))
+	return fields
+
+
+def get_api_job_ids () -> list[str]:
+	"""
+	Get the list of job ids in the body of an API request, e.g. {"ids": ["abcdefghij", "klmnopqrst"]}
+	:return: The job ids
+	"""
+	body = request.get_json(silent = True)
+	if not isinstance(body, dict) or not isinstance(body.get("ids"), list) or \
+			not all(isinstance(job_id, str) for job_id in body["ids"]):
+		flask.abort(api_error(400, "Expected a JSON body with a list of job ids in \"ids\""))
+	return body["ids"]
+
+
+@app.route("/api/v1/counts")
+def api_get_counts ():
+	return flask.jsonify(job_manager.get_counts())
+
+
+@app.route("/api/v1/jobs")
+def api_list_jobs ():
+	fields = get_api_fields()
+	job_statuses = get_statuses_from_types([job_type for job_type in request.args.get("types", "").split(",")
+											if job_type != ""])
+
+	# Specific jobs, e.g. the jobs shown on a page which is polling for changes
+	if "ids" in request.args:
+		job_ids = [job_id for job_id in request.args["ids"].split(",") if job_id in job_manager.jobs]
+		return flask.jsonify({"jobs": [job_manager.jobs[job_id].to_dict(fields) for job_id in job_ids], "next": None})
+
+	page_size = request.args.get("limit", Config.get("jobs_page_size"), type = int)
+	if not 1 <= page_size <= 500:
+		return api_error(400, "limit must be between 1 and 500")
+
+	try:
+		jobs, next_page = job_manager.get_jobs_page(tuple(job_statuses), request.args.get("after"), page_size)
+	except ValueError:
+		return api_error(400, "Invalid cursor in after")
+
+	return flask.jsonify({"jobs": [job.to_dict(fields) for job in jobs], "next": next_page})
+
+
+@app.route("/api/v1/jobs/<job_id>")
+def api_get_job (job_id: str):
+	fields = get_api_fields()
+	if job_id not in job_manager.jobs:
+		return api_error(404, f"No job with id {job_id}")
+	return flask.jsonify(job_manager.jobs[job_id].to_dict(fields))
+
+
+@app.route("/api/v1/jobs/<action>", methods = ["POST"])
+def api_run_job_action (action: str):
+	if action not in api_job_actions:
+		return api_error(404, f"Unknown action {action}")
+
+	results: dict[str, bool | dict[str, str]] = {}
+	for job_id in get_api_job_ids():
+		# One job failing (e.g. running out of YouTube quota) is reported with that job, without stopping the rest
+		try:
+			results[job_id] = api_job_actions[action](job_id)
+		except Exception as exception:
+			results[job_id] = {"error": str(exception)}
+	return flask.jsonify({"results": results})
+
+
+@app.route("/api/v1/jobs/priority/<int(signed=True):priority>", methods = ["POST"])
+def api_set_job_priority (priority: int):
+	return flask.jsonify({"results": {job_id: job_manager.set_job_priority(job_id, priority)
+									  for job_id in get_api_job_ids()}})
+
+
+@app.route("/api/v1/ingest", methods = ["POST"])
+def api_ingest_jobs ():
+	body = request.get_json(silent = True)
+	if isinstance(body, dict) and isinstance(body.get("playlist"), str):
+		try:
+			items = job_ingest.read_playlist(body["playlist"])
+		except DownloadError as exception:
+			return api_error(400, f"Couldn't read playlist: {exception}")
+	elif isinstance(body, dict) and isinstance(body.get("csv"), str):
+		items = job_ingest.read_csv(body["csv"])
+	else:
+		return api_error(400, "Expected a JSON body with a playlist link in \"playlist\" or CSV text in \"csv\"")
+
+	def add_jobs (new_items: list[job_ingest.IngestItem]) -> list[str]:
+		return job_manager.add_jobs([Job(yt_url = item.yt_url, song_title = item.song_title,
+										 song_artist = item.song_artist) for item in new_items])
+
+	result = job_ingest.ingest(items, add_jobs, lambda job_id: set_random_image(job_manager.jobs[job_id]))
+	return flask.jsonify({"created": result.job_ids,
+						  "failed":  [{"url": url, "error": error} for url, error in result.failures]})
+
+
+@app.route("/api/v1/queue")
+def api_get_queue ():
+	fields = get_api_fields()
+	return flask.jsonify({"jobs": [job.to_dict(fields) for job in job_manager.get_queue()]})
 
 
 # -- JAVASCRIPT FILES --
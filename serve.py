@@ -0,0 +1,10 @@
+import waitress
+
+from config import Config
+
+if __name__ == "__main__":
+	# Imported here, so child processes started by the process executor don't start the app again
+	from main import app
+
+	# Pages listening for changes each keep a thread busy, so more threads are needed than waitress has by default
+	waitress.serve(app, port = Config.get("server_port"), threads = Config.get("server_threads"))
@@ -39,6 +39,29 @@ function job_dequeue (clicked, job_id) {
 		show_checkmark_icon, [clicked.children[0]]);
 }
 
+function job_cancel (clicked, job_id) {
+	fetch("{{ url_for('cancel_job', job_id = 'JOB_ID') }}".replace("JOB_ID", job_id))
+		.then(response => response.json())
+		.then(response => {
+			if (response === true) {
+				show_checkmark_icon(clicked.children[0]);
+			} else {
+				alert("This job can't be cancelled while its current stage is running. Set executor to \"process\" in " +
+					"the config file to allow running stages to be stopped.");
+			}
+		});
+}
+
+function job_pick_variant (clicked, job_id, speedup_factor) {
+	fetch_then_if_true("{{ url_for('pick_job_variant', job_id = 'JOB_ID', speedup_factor = 1.5) }}"
+		.replace("JOB_ID", job_id).replace("1.5", speedup_factor), () => location.reload(), []);
+}
+
+function job_upload (clicked, job_id) {
+	fetch_then_if_true("{{ url_for('upload_job', job_id = 'JOB_ID') }}".replace("JOB_ID", job_id),
+		show_checkmark_icon, [clicked.children[0]]);
+}
+
 function job_delete (clicked, job_id) {
 	fetch_then_if_true("{{ url_for('delete_job', job_id = 'JOB_ID') }}".replace("JOB_ID", job_id),
 		show_checkmark_icon, [clicked.children[0]]);
@@ -68,6 +91,95 @@ function update_image(source, image_id) {
 	reader.readAsDataURL(selectedFile)
 }
 
+function replace_job_card (job_id) {
+	fetch("{{ url_for('get_job_card', job_id = 'JOB_ID') }}".replace("JOB_ID", job_id))
+		.then(response => response.ok ? response.text() : null)
+		.then(html => {
+			if (html === null) {  // The job has been removed
+				return;
+			}
+
+			const template = document.createElement("template");
+			template.innerHTML = html;
+			template.content.querySelectorAll("script").forEach(script => script.remove());
+			const new_card = template.content.querySelector("[data-job-card]");
+			const new_badge = new_card.querySelector("[data-job-badge]");
+
+			document.querySelectorAll(`[data-job-card="${job_id}"]`).forEach(card => {
+				card.replaceWith(new_card.cloneNode(true));
+			});
+			// Badges outside a card, e.g. on the job's page
+			document.querySelectorAll(`[data-job-badge="${job_id}"]`).forEach(badge => {
+				if (badge.closest("[data-job-card]") === null) {
+					badge.replaceWith(new_badge.cloneNode(true));
+				}
+			});
+		});
+}
+
+function update_job (job) {
+	const badges = document.querySelectorAll(`[data-job-badge="${job.id}"]`);
+	if (badges.length === 0) {
+		return;
+	}
+
+	if (Array.from(badges).every(badge => badge.dataset.jobStatus === job.status)) {
+		// Only the progress has changed
+		badges.forEach(badge => badge.querySelectorAll("[data-job-progress]").forEach(progress => {
+			progress.textContent = job.progress_percentage;
+		}));
+	} else {
+		replace_job_card(job.id);
+	}
+}
+
+function update_variants (job) {
+	// Show the finished variants, or why they failed, on the page of the job they were rendered for. The page is loaded
+	// again rather than reloaded, as it might be showing the result of submitting the form.
+	if (!job.rendering_variants && document.querySelector(`[data-job-variants="${job.id}"]`) !== null) {
+		location.replace(location.href);
+	}
+}
+
+function update_counts (counts) {
+	document.querySelectorAll("[data-job-count='total']").forEach(count => count.textContent = counts.total);
+	document.querySelectorAll("[data-job-count='queue']").forEach(count => {
+		count.textContent = counts.queued + counts.processing;
+	});
+}
+
+// Used when the server has no event streams left, so the page asks for changes every few seconds instead
+function poll_for_changes () {
+	const job_ids = new Set(Array.from(document.querySelectorAll("[data-job-badge]"), badge => badge.dataset.jobBadge));
+	if (job_ids.size !== 0) {
+		const url = new URL("{{ url_for('api_list_jobs') }}", location.href);
+		url.searchParams.set("ids", Array.from(job_ids).join(","));
+		url.searchParams.set("fields", "id,status,progress_percentage,rendering_variants");
+		fetch(url)
+			.then(response => response.json())
+			.then(response => response.jobs.forEach(job => {
+				update_job(job);
+				update_variants(job);
+			}));
+	}
+	fetch("{{ url_for('api_get_counts') }}")
+		.then(response => response.json())
+		.then(update_counts);
+}
+
+// Keep the page up to date as jobs change, instead of having to reload it
+const job_events = new EventSource("{{ url_for('events') }}");
+
+job_events.addEventListener("job", event => update_job(JSON.parse(event.data)));
+job_events.addEventListener("counts", event => update_counts(JSON.parse(event.data)));
+job_events.addEventListener("variants", event => update_variants(JSON.parse(event.data)));
+job_events.addEventListener("error", () => {
+	// The browser reconnects by itself after a dropped connection, but gives up if the server refused the stream
+	if (job_events.readyState === EventSource.CLOSED) {
+		setInterval(poll_for_changes, 5000);
+	}
+});
+
 const forms = document.querySelectorAll('.needs-validation');
 
 Array.from(forms).forEach(form => {
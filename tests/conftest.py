@@ -0,0 +1,42 @@
+import http.server
+import os
+import sys
+import tempfile
+import threading
+from typing import Any, Callable
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+# Keep the config file and everything it points to out of the working directory. This has to happen before the modules
+# which read the config when they are imported are imported by the tests.
+_config_directory = tempfile.mkdtemp(prefix = "nnc_tests_")
+Config.set_config_location(os.path.join(_config_directory, "config.json"))
+Config.set("wallpaper_index_file", os.path.join(_config_directory, "wallpaper_index.json"))
+Config.flush()
+
+
+@pytest.fixture
+def serve () -> Callable[[type[http.server.BaseHTTPRequestHandler], Any], str]:
+	"""
+	Start stand-in HTTP servers on localhost, which are stopped after the test
+	:return: A function taking a request handler class and the state it should use (available to the handler as
+	self.server.state), which returns the root URL of the server, without a trailing slash
+	"""
+	servers: list[http.server.ThreadingHTTPServer] = []
+
+	def start (handler_class: type[http.server.BaseHTTPRequestHandler], state: Any) -> str:
+		server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+		server.state = state
+		threading.Thread(target = server.serve_forever, daemon = True).start()
+		servers.append(server)
+		return f"http://127.0.0.1:{server.server_address[1]}"
+
+	yield start
+
+	for server in servers:
+		server.shutdown()
+		server.server_close()
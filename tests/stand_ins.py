@@ -0,0 +1,181 @@
+import http.server
+import json
+import re
+import urllib.parse
+from typing import Any, Optional
+
+
+class WallpaperSite:
+	def __init__ (self):
+		"""
+		The state of a stand-in for a category on besthdwallpaper.com, with a single page of images
+		"""
+		# The entry of each image in the category page, by image id
+		self.images: dict[str, dict[str, Any]] = {}
+		# The file type each image's 3840x2160 download link has, by image id
+		self.extensions: dict[str, str] = {}
+		# The ids of images whose download link no longer works
+		self.removed: set[str] = set()
+		# Increased whenever the images change, so clients can tell when the page is the same
+		self.version = 0
+		# Set to make every request fail
+		self.down = False
+		# Each request received, as its path and If-None-Match header
+		self.requests: list[tuple[str, Optional[str]]] = []
+
+	def add_image (self, image_id: str, width: int = 3840, height: int = 2160, over_18: bool = False,
+				   extension: str = "jpg") -> None:
+		self.images[image_id] = {"detailPageUrl": f"/details/{image_id}", "imWidth": width, "imHeight": height,
+								 "isOver18": over_18}
+		self.extensions[image_id] = extension
+		self.version += 1
+
+	@property
+	def etag (self) -> str:
+		return f'"{self.version}"'
+
+	@staticmethod
+	def get_image_data (image_id: str) -> bytes:
+		return f"image {image_id}".encode()
+
+
+class WallpaperSiteHandler (http.server.BaseHTTPRequestHandler):
+	server: http.server.ThreadingHTTPServer
+
+	def log_message (self, *args) -> None:
+		pass
+
+	def _send (self, status: int, body: bytes = b"", content_type: str = "text/html", etag: str = None) -> None:
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		if etag is not None:
+			self.send_header("ETag", etag)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET (self) -> None:
+		site: WallpaperSite = self.server.state
+		path = urllib.parse.urlsplit(self.path).path
+		site.requests.append((path, self.headers.get("If-None-Match")))
+
+		if site.down:
+			self._send(500)
+		elif path.startswith("/category/"):
+			if self.headers.get("If-None-Match") == site.etag:
+				self._send(304, etag = site.etag)
+				return
+			page = {"psf": {"pageCount": 1}, "data": list(site.images.values())}
+			self._send(200, json.dumps(page).encode(), "application/json", site.etag)
+		elif path.startswith("/details/"):
+			image_id = path.rsplit("/", 1)[1]
+			root = f"http://127.0.0.1:{self.server.server_address[1]}"
+			link = f'<a href="{root}/images/{image_id}.{site.extensions[image_id]}"> 3840x2160 </a>'
+			self._send(200, f"<html><body>{link}</body></html>".encode())
+		elif path.startswith("/images/"):
+			image_id = path.rsplit("/", 1)[1].split(".")[0]
+			if image_id in site.removed:
+				self._send(404)
+			else:
+				self._send(200, site.get_image_data(image_id), "image/jpeg")
+		else:
+			self._send(404)
+
+
+class YouTubeApi:
+	def __init__ (self, video_ids: list[str]):
+		"""
+		The state of a stand-in for the parts of the YouTube Data API used to update and upload videos
+		:param video_ids: The ids of the videos already on the channel
+		"""
+		self.video_ids = set(video_ids)
+		# The ids which videos.update fails for
+		self.forbidden_ids: set[str] = set()
+		# The ids of the videos updated in each batch request
+		self.batches: list[list[str]] = []
+		# The data received and the new video's resource of each upload session, by session id
+		self.sessions: dict[str, dict[str, Any]] = {}
+		# Each chunk received, as its session id and the Content-Range header
+		self.chunks: list[tuple[str, str]] = []
+
+
+class YouTubeApiHandler (http.server.BaseHTTPRequestHandler):
+	server: http.server.ThreadingHTTPServer
+	# The upload client keeps its connection open between chunks
+	protocol_version = "HTTP/1.1"
+
+	def log_message (self, *args) -> None:
+		pass
+
+	def _send (self, status: int, body: bytes = b"", content_type: str = "application/json",
+			   headers: dict[str, str] = None) -> None:
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_POST (self) -> None:
+		api: YouTubeApi = self.server.state
+		body = self.rfile.read(int(self.headers["Content-Length"]))
+		path = urllib.parse.urlsplit(self.path).path
+
+		if path == "/batch":
+			self._send_batch_response(api, body.decode())
+		elif path.startswith("/upload/"):
+			session_id = f"session{len(api.sessions)}"
+			api.sessions[session_id] = {"data": b"", "body": json.loads(body)}
+			root = f"http://127.0.0.1:{self.server.server_address[1]}"
+			self._send(200, headers = {"Location": f"{root}/sessions/{session_id}"})
+		else:
+			self._send(404)
+
+	def _send_batch_response (self, api: YouTubeApi, body: str) -> None:
+		boundary = re.search(r'boundary="?([^";]+)', self.headers["Content-Type"]).group(1)
+		parts = [part for part in body.split(f"--{boundary}") if "Content-ID" in part]
+
+		video_ids = []
+		responses = []
+		for part in parts:
+			content_id = re.search(r"Content-ID: <(.+?)>", part).group(1)
+			resource = json.loads(part[part.index("{"):part.rindex("}") + 1])
+			video_ids.append(resource["id"])
+			if resource["id"] in api.forbidden_ids:
+				status = "403 Forbidden"
+				payload = json.dumps({"error": {"code": 403, "message": "Forbidden"}})
+			elif resource["id"] not in api.video_ids:
+				status = "404 Not Found"
+				payload = json.dumps({"error": {"code": 404, "message": "Video not found"}})
+			else:
+				status = "200 OK"
+				payload = json.dumps(resource)
+			responses.append(f"Content-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+							 f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+							 f"Content-Length: {len(payload)}\r\n\r\n{payload}\r\n")
+		api.batches.append(video_ids)
+
+		response_body = "".join(f"--response\r\n{response}" for response in responses) + "--response--\r\n"
+		self._send(200, response_body.encode(), "multipart/mixed; boundary=response")
+
+	def do_PUT (self) -> None:
+		api: YouTubeApi = self.server.state
+		session_id = urllib.parse.urlsplit(self.path).path.rsplit("/", 1)[1]
+		session = api.sessions[session_id]
+		data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		content_range = self.headers["Content-Range"]
+		api.chunks.append((session_id, content_range))
+
+		# Either "bytes <start>-<end>/<total>" for a chunk, or "bytes */<total>" asking how much has been received
+		match = re.fullmatch(r"bytes (?:\*|(\d+)-\d+)/(\d+|\*)", content_range)
+		if match.group(1) is not None:
+			assert int(match.group(1)) == len(session["data"]), "Chunk doesn't continue from the data received"
+			session["data"] += data
+
+		if match.group(2) != "*" and len(session["data"]) == int(match.group(2)):
+			self._send(200, json.dumps({"id": f"video_{session_id}", **session["body"]}).encode())
+		elif len(session["data"]) != 0:
+			self._send(308, headers = {"Range": f"bytes=0-{len(session['data']) - 1}"})
+		else:
+			self._send(308)
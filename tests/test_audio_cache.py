@@ -0,0 +1,53 @@
+import os
+import threading
+
+from audio_cache import AudioCache
+
+
+def _put (cache: AudioCache, key: str, size: int, mtime: int) -> str:
+	temp_location = cache.get_temp_location(key, "webm")
+	with open(temp_location, "wb") as temp_file:
+		temp_file.write(b"a" * size)
+	location = cache.put(key, temp_location, asr = 48000, segments = [])
+	os.utime(location, (mtime, mtime))
+	return location
+
+
+def test_eviction_removes_least_recently_used (tmp_path):
+	cache = AudioCache(str(tmp_path), 250)
+	_put(cache, "old", 100, 1000)
+	_put(cache, "used", 100, 2000)
+	location, metadata = cache.get("used")
+	assert metadata["asr"] == 48000 and os.path.getsize(location) == 100
+
+	# The least recently used entry makes way for the new one
+	_put(cache, "new", 100, 3000)
+	assert cache.get("old") is None
+	assert cache.get("used") is not None and cache.get("new") is not None
+
+
+def test_eviction_skips_entries_in_use (tmp_path):
+	cache = AudioCache(str(tmp_path), 150)
+	_put(cache, "old", 100, 1000)
+
+	in_use = threading.Event()
+	finished = threading.Event()
+
+	def use_entry () -> None:
+		with cache.lock("old"):
+			in_use.set()
+			finished.wait(10)
+
+	thread = threading.Thread(target = use_entry)
+	thread.start()
+	assert in_use.wait(10)
+
+	# The entry being used is kept, even though the cache is over its budget
+	_put(cache, "new", 100, 2000)
+	assert (tmp_path / "old.webm").exists()
+	finished.set()
+	thread.join()
+
+	# Once it isn't being used, it's removed the next time the cache is evicted
+	_put(cache, "newest", 10, 3000)
+	assert not (tmp_path / "old.webm").exists() and (tmp_path / "new.webm").exists()
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from autoscaler import Autoscaler, HostLoad
+from job_queue import StageStats
+
+idle_host = HostLoad(load_per_cpu = 0.2, free_memory_mb = 8192)
+
+
+@pytest.fixture
+def autoscaler () -> Autoscaler:
+	# Only deciding is tested, which doesn't use the job queue
+	return Autoscaler(None)
+
+
+def test_threads_are_kept_within_limits (autoscaler):
+	decision = autoscaler._decide(idle_host, {"audio": StageStats(0, 0, 0, None), "video": StageStats(2, 2, 0, 10)})
+	assert (decision.stage, decision.old_count, decision.new_count) == ("audio", 0, 1)
+
+	decision = autoscaler._decide(idle_host, {"audio": StageStats(1, 1, 0, 5), "video": StageStats(6, 6, 0, 10)})
+	assert (decision.stage, decision.new_count) == ("video", 4)
+
+
+def test_busiest_stage_grows (autoscaler):
+	decision = autoscaler._decide(idle_host, {"audio": StageStats(1, 1, 4, 5), "video": StageStats(2, 2, 4, 60)})
+	assert (decision.stage, decision.new_count) == ("video", 3)
+
+	# A stage with idle threads doesn't need another one, even with jobs waiting
+	assert autoscaler._decide(idle_host, {"audio": StageStats(2, 1, 4, 5), "video": StageStats(2, 1, 4, 60)}) is None
+
+
+@pytest.mark.parametrize("host, reason", [
+	(HostLoad(load_per_cpu = 1.5, free_memory_mb = 8192), "load 1.50 per CPU"),
+	(HostLoad(load_per_cpu = None, free_memory_mb = 512), "512 MB free")
+])
+def test_overloaded_host_shrinks_least_needed_stage (autoscaler, host, reason):
+	decision = autoscaler._decide(host, {"audio": StageStats(2, 2, 1, 5), "video": StageStats(2, 2, 4, 60)})
+	assert (decision.stage, decision.new_count, decision.reason) == ("audio", 1, reason)
+
+
+def test_idle_stage_shrinks_after_several_checks (autoscaler):
+	stages = {"audio": StageStats(1, 0, 0, 5), "video": StageStats(3, 1, 0, 60)}
+	assert autoscaler._decide(idle_host, stages) is None
+	assert autoscaler._decide(idle_host, stages) is None
+
+	decision = autoscaler._decide(idle_host, stages)
+	assert (decision.stage, decision.new_count, decision.reason) == ("video", 2, "idle")
+
+
+def test_no_change_during_cooldown (autoscaler):
+	autoscaler._last_change = time.monotonic()
+	assert autoscaler._decide(idle_host, {"audio": StageStats(1, 1, 4, 5), "video": StageStats(2, 2, 4, 60)}) is None
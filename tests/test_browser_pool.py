@@ -0,0 +1,72 @@
+from typing import Optional
+
+import pytest
+
+from browser_pool import BrowserSessionPool
+
+
+class FakeSession:
+	def __init__ (self, process_memory: Optional[int], heap_memory: int):
+		self.process_memory = process_memory
+		self.heap_memory = heap_memory
+		self.job_count = 0
+
+	def is_healthy (self) -> bool:
+		return True
+
+	def get_process_memory (self) -> Optional[int]:
+		return self.process_memory
+
+	def get_memory_usage (self) -> int:
+		return self.heap_memory
+
+	def quit (self) -> None:
+		pass
+
+
+@pytest.mark.parametrize("process_memory_mb, heap_memory_mb, replaced", [
+	(1500, 100, True),  # The browser's processes are over the limit, even though the page's heap is small
+	(500, 100, False),
+	(None, 1500, True),  # Only the heap can be measured on this system
+	(None, 500, False)
+])
+def test_recycle_replaces_sessions_over_memory_limit (process_memory_mb, heap_memory_mb, replaced):
+	new_sessions = []
+
+	def create_session () -> FakeSession:
+		new_sessions.append(FakeSession(0, 0))
+		return new_sessions[-1]
+
+	pool = BrowserSessionPool(create_session, lambda session: None, max_jobs = 25, max_memory_mb = 1024)
+	session = FakeSession(process_memory_mb * 1024 * 1024 if process_memory_mb is not None else None,
+						  heap_memory_mb * 1024 * 1024)
+	pool._recycle(session)
+
+	# A session which is kept is reset, rather than a new one started
+	assert len(new_sessions) == (1 if replaced else 0)
+
+
+def test_shrink_closes_idle_sessions ():
+	quit_sessions = []
+
+	class CountedSession (FakeSession):
+		def quit (self) -> None:
+			quit_sessions.append(self)
+
+	pool = BrowserSessionPool(lambda: CountedSession(0, 0), lambda session: None, max_jobs = 25, max_memory_mb = 1024)
+	pool._target_size = 2
+	sessions = [CountedSession(0, 0), CountedSession(0, 0)]
+	for session in sessions:
+		pool._add_idle_session(session)
+
+	# A worker stopped, so one less session is kept ready
+	pool.shrink()
+	assert quit_sessions == [sessions[1]]
+	assert pool._idle_sessions == [sessions[0]]
+
+	# A session recycled once the pool is full enough is closed rather than kept
+	pool._add_idle_session(CountedSession(0, 0))
+	assert len(pool._idle_sessions) == 1 and len(quit_sessions) == 2
+
+	pool.shrink(5)
+	assert pool._target_size == 0 and pool._idle_sessions == []
@@ -0,0 +1,87 @@
+import json
+import os
+
+import pytest
+
+from config import Config
+
+
+@pytest.fixture
+def config_location (tmp_path, monkeypatch) -> str:
+	# Use a config file of its own, putting back the one the other tests use afterwards
+	original_location = Config._config_location
+	monkeypatch.setattr(Config, "_subscribers", ())
+	location = str(tmp_path / "config.json")
+	Config.set_config_location(location)
+	yield location
+	Config.set_config_location(original_location)
+
+
+def _read_file (location: str) -> dict:
+	with open(location, "r") as config_file:
+		return json.load(config_file)
+
+
+def _edit_file (location: str, **values) -> None:
+	config = _read_file(location)
+	config.update(values)
+	with open(location, "w") as config_file:
+		json.dump(config, config_file)
+
+
+def test_missing_file_is_created_with_defaults (config_location):
+	assert _read_file(config_location)["server_port"] == Config._default_config["server_port"]
+
+
+def test_changes_are_written_together (config_location):
+	Config.set("server_port", 9000)
+	Config.set("server_threads", 4)
+	# Nothing is written until the flush, which writes every change at once
+	assert _read_file(config_location)["server_port"] == Config._default_config["server_port"]
+	assert Config._flush_timer is not None
+
+	Config.flush()
+	assert Config._flush_timer is None
+	assert {name: _read_file(config_location)[name] for name in ("server_port", "server_threads")} == \
+		   {"server_port": 9000, "server_threads": 4}
+	assert not os.path.exists(f"{config_location}.tmp")
+
+
+def test_reload_notifies_subscribers (config_location):
+	changes = []
+	Config.subscribe(lambda *change: changes.append(change))
+
+	_edit_file(config_location, server_port = 9000, server_threads = Config.get("server_threads"))
+	Config.reload_config()
+	assert Config.get("server_port") == 9000
+	# Only values which changed are given to subscribers
+	assert changes == [("server_port", Config._default_config["server_port"], 9000)]
+
+	Config.set("server_port", 9001)
+	assert changes[-1] == ("server_port", 9000, 9001)
+
+
+def test_reload_keeps_unsaved_changes (config_location):
+	Config.set("server_threads", 4)
+	# The file is edited before the change is written
+	_edit_file(config_location, server_port = 9000)
+	Config.reload_config()
+
+	assert Config.get("server_threads") == 4 and Config.get("server_port") == 9000
+	Config.flush()
+	saved = _read_file(config_location)
+	assert saved["server_threads"] == 4 and saved["server_port"] == 9000
+
+
+def test_read_only_config_is_not_written (config_location, monkeypatch):
+	monkeypatch.setattr(Config, "_read_only", True)
+	Config.set("server_port", 9000)
+	Config.flush()
+
+	assert Config.get("server_port") == 9000
+	assert _read_file(config_location)["server_port"] == Config._default_config["server_port"]
+
+	# Changes from the file replace ones made in this process
+	_edit_file(config_location, server_port = 9001)
+	Config.reload_config()
+	assert Config.get("server_port") == 9001
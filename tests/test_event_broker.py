@@ -0,0 +1,40 @@
+import threading
+
+from event_broker import EventBroker
+
+
+def test_events_are_coalesced_per_key ():
+	broker = EventBroker(max_subscriptions = 2)
+	subscription = broker.subscribe()
+
+	broker.publish("job", "a", {"progress": "10%"})
+	broker.publish("job", "b", {"progress": "5%"})
+	broker.publish("counts", "", {"Queued": 2})
+	broker.publish("job", "a", {"progress": "20%"})
+
+	# Only the latest event about each job is sent, after the events which haven't changed since
+	assert subscription.get(0) == [("job", {"progress": "5%"}), ("counts", {"Queued": 2}),
+								   ("job", {"progress": "20%"})]
+	assert subscription.get(0) == []
+
+
+def test_get_waits_for_event ():
+	broker = EventBroker(max_subscriptions = 1)
+	subscription = broker.subscribe()
+
+	threading.Timer(0.1, broker.publish, ["job", "a", 1]).start()
+	assert subscription.get(10) == [("job", 1)]
+
+
+def test_subscriptions_are_limited ():
+	broker = EventBroker(max_subscriptions = 2)
+	first, second = broker.subscribe(), broker.subscribe()
+	assert broker.subscribe() is None
+
+	broker.unsubscribe(first)
+	third = broker.subscribe()
+	assert third is not None
+
+	# Events only go to open subscriptions
+	broker.publish("job", "a", 1)
+	assert first.get(0) == [] and second.get(0) == [("job", 1)] and third.get(0) == [("job", 1)]
@@ -0,0 +1,88 @@
+import os
+import struct
+import subprocess
+import threading
+
+import pytest
+
+import image_derivatives
+from config import Config
+
+imageio_ffmpeg = pytest.importorskip("imageio_ffmpeg")
+
+
+@pytest.fixture
+def ffmpeg () -> str:
+	original_location = Config.get("ffmpeg_location")
+	Config.set("ffmpeg_location", imageio_ffmpeg.get_ffmpeg_exe())
+	yield Config.get("ffmpeg_location")
+	Config.set("ffmpeg_location", original_location)
+
+
+def _make_image (ffmpeg: str, location: str, size: str) -> None:
+	subprocess.run([ffmpeg, "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc=size={size}", "-frames:v", "1",
+					location], check = True)
+
+
+def _get_jpeg_size (location: str) -> tuple[int, int]:
+	with open(location, "rb") as image_file:
+		data = image_file.read()
+	# The frame header (a SOF marker) has the height and width of the image
+	index = 2
+	while data[index + 1] not in (0xc0, 0xc1, 0xc2):
+		index += 2 + struct.unpack(">H", data[index + 2:index + 4])[0]
+	height, width = struct.unpack(">HH", data[index + 5:index + 9])
+	return width, height
+
+
+def test_derivatives_fit_each_size (tmp_path, ffmpeg):
+	image_location = str(tmp_path / "job.jpg")
+	_make_image(ffmpeg, image_location, "1920x1200")
+
+	assert _get_jpeg_size(image_derivatives.get_derivative(image_location, "card")) == (576, 360)
+	assert _get_jpeg_size(image_derivatives.get_derivative(image_location, "preview")) == (1152, 720)
+	assert sorted(os.listdir(tmp_path / "derivatives")) == \
+		   sorted(os.path.basename(image_derivatives.get_derivative_location(image_location, size))
+				  for size in image_derivatives.sizes)
+
+
+def test_changed_image_replaces_derivatives (tmp_path, ffmpeg):
+	image_location = str(tmp_path / "job.jpg")
+	_make_image(ffmpeg, image_location, "1920x1080")
+	old_location = image_derivatives.get_derivative(image_location, "card")
+
+	# Made again for the new image, removing the copies of the old one
+	_make_image(ffmpeg, image_location, "800x800")
+	new_location = image_derivatives.get_derivative(image_location, "card")
+	assert new_location != old_location and not os.path.exists(old_location)
+	assert _get_jpeg_size(new_location) == (360, 360)
+	assert len(os.listdir(tmp_path / "derivatives")) == len(image_derivatives.sizes)
+
+
+def test_concurrent_requests_make_derivatives_once (tmp_path, ffmpeg):
+	image_location = str(tmp_path / "job.jpg")
+	_make_image(ffmpeg, image_location, "1920x1080")
+
+	locations = []
+
+	def get_preview () -> None:
+		locations.append(image_derivatives.get_derivative(image_location, "preview"))
+
+	threads = [threading.Thread(target = get_preview) for _ in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert len(set(locations)) == 1 and os.path.exists(locations[0])
+	# No temporary files are left behind
+	assert len(os.listdir(tmp_path / "derivatives")) == len(image_derivatives.sizes)
+
+
+def test_failed_render_leaves_no_files (tmp_path, ffmpeg):
+	image_location = str(tmp_path / "job.jpg")
+	(tmp_path / "job.jpg").write_bytes(b"not an image")
+
+	with pytest.raises(subprocess.CalledProcessError):
+		image_derivatives.create_derivatives(image_location)
+	assert os.listdir(tmp_path / "derivatives") == []
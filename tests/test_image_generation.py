@@ -0,0 +1,90 @@
+import json
+import random
+
+import pytest
+
+import image_generation
+from image_generation import WallpaperCatalogue
+from stand_ins import WallpaperSite, WallpaperSiteHandler
+
+
+@pytest.fixture
+def site () -> WallpaperSite:
+	site = WallpaperSite()
+	site.add_image("landscape")
+	site.add_image("second")
+	site.add_image("adult", over_18 = True)
+	site.add_image("small", width = 1920, height = 1080)
+	site.add_image("portrait", width = 2160, height = 3840)
+	site.add_image("png", extension = "png")
+	return site
+
+
+@pytest.fixture
+def site_root (serve, site) -> str:
+	return serve(WallpaperSiteHandler, site)
+
+
+def _get_index_urls (catalogue: WallpaperCatalogue) -> list[str]:
+	return [image_url for page in catalogue._index["pages"].values() for image_url in page["images"]]
+
+
+def test_refresh_indexes_suitable_images (tmp_path, site_root):
+	index_location = tmp_path / "index.json"
+	catalogue = WallpaperCatalogue(str(index_location), f"{site_root}/category", 1)
+	catalogue.refresh()
+
+	expected_urls = [f"{site_root}/images/landscape.jpg", f"{site_root}/images/second.jpg"]
+	assert _get_index_urls(catalogue) == expected_urls
+
+	# The index is saved, and used again by a new catalogue without fetching anything
+	reloaded = WallpaperCatalogue(str(index_location), f"{site_root}/category", 1)
+	assert not reloaded._needs_refresh()
+	assert [image_url for page in json.loads(index_location.read_text())["pages"].values()
+			for image_url in page["images"]] == expected_urls
+
+
+def test_refresh_revalidates_unchanged_pages (tmp_path, site, site_root):
+	# With no TTL, every refresh fetches the page again
+	catalogue = WallpaperCatalogue(str(tmp_path / "index.json"), f"{site_root}/category", 0)
+	catalogue.refresh()
+	first_fetched_at = catalogue._index["pages"]["1"]["fetched_at"]
+
+	site.requests.clear()
+	catalogue.refresh()
+
+	# The page is only asked for if it has changed, and the images on it aren't looked up again
+	assert site.requests == [("/category/1", site.etag), ("/category/1", site.etag)]
+	assert len(_get_index_urls(catalogue)) == 2
+	assert catalogue._index["pages"]["1"]["fetched_at"] > first_fetched_at
+
+	site.add_image("new")
+	catalogue.refresh()
+	assert f"{site_root}/images/new.jpg" in _get_index_urls(catalogue)
+
+
+def test_download_skips_removed_images (tmp_path, monkeypatch, site, site_root):
+	catalogue = WallpaperCatalogue(str(tmp_path / "index.json"), f"{site_root}/category", 1)
+	monkeypatch.setattr(image_generation, "catalogue", catalogue)
+	# Always pick the first image in the index, which has been removed from the site
+	monkeypatch.setattr(random, "choice", lambda sequence: sequence[0])
+	site.removed.add("landscape")
+
+	output_location = tmp_path / "image.jpg"
+	image_generation.get_random_image_from_web(str(output_location))
+
+	assert output_location.read_bytes() == WallpaperSite.get_image_data("second")
+	assert _get_index_urls(catalogue) == [f"{site_root}/images/second.jpg"]
+
+
+def test_index_is_used_while_site_is_down (tmp_path, site, site_root):
+	catalogue = WallpaperCatalogue(str(tmp_path / "index.json"), f"{site_root}/category", 0)
+	catalogue.refresh()
+
+	# The index is out of date, but still has images to use while it can't be refreshed
+	site.down = True
+	assert catalogue.get_random_image_url() in _get_index_urls(catalogue)
+
+	with pytest.raises(Exception):
+		catalogue.refresh()
+	assert len(_get_index_urls(catalogue)) == 2
@@ -0,0 +1,72 @@
+import threading
+import time
+from typing import Callable
+
+import pytest
+
+import image_generation
+from image_generation import WallpaperCatalogue
+from image_pool import ImagePool
+from stand_ins import WallpaperSite, WallpaperSiteHandler
+
+
+def _wait_for (condition: Callable[[], bool], timeout_secs: float = 10) -> None:
+	deadline = time.monotonic() + timeout_secs
+	while not condition():
+		assert time.monotonic() < deadline, "Timed out"
+		time.sleep(0.05)
+
+
+@pytest.fixture
+def site () -> WallpaperSite:
+	site = WallpaperSite()
+	for number in range(3):
+		site.add_image(f"image{number}")
+	return site
+
+
+def test_pool_refills_after_claim (tmp_path, monkeypatch, serve, site):
+	site_root = serve(WallpaperSiteHandler, site)
+	catalogue = WallpaperCatalogue(str(tmp_path / "index.json"), f"{site_root}/category", 1)
+	monkeypatch.setattr(image_generation, "catalogue", catalogue)
+
+	pool_location = tmp_path / "pool"
+	pool = ImagePool(str(pool_location), 2, image_generation.get_random_image_from_web)
+	pool.start_filler()
+	_wait_for(lambda: len(list(pool_location.glob("*.jpg"))) == 2)
+
+	output_location = tmp_path / "claimed.jpg"
+	assert pool.claim(str(output_location))
+	assert output_location.read_bytes() in [WallpaperSite.get_image_data(f"image{number}") for number in range(3)]
+
+	_wait_for(lambda: len(list(pool_location.glob("*.jpg"))) == 2)
+	assert list(pool_location.glob("*.part")) == []
+
+
+def test_pool_discards_failed_downloads (tmp_path):
+	failures = threading.Semaphore(0)
+	fail = True
+
+	def fetch_image (location: str) -> None:
+		with open(location, "wb") as image_file:
+			image_file.write(b"partial")
+		if fail:
+			failures.release()
+			raise RuntimeError("Site is down")
+		with open(location, "wb") as image_file:
+			image_file.write(b"image")
+
+	pool_location = tmp_path / "pool"
+	pool = ImagePool(str(pool_location), 1, fetch_image)
+	pool.start_filler()
+	assert failures.acquire(timeout = 10)
+
+	# A failed download is never claimed
+	_wait_for(lambda: list(pool_location.iterdir()) == [])
+	assert not pool.claim(str(tmp_path / "claimed.jpg"))
+
+	# Wake the filler from waiting before its next attempt, rather than waiting for it
+	fail = False
+	pool._image_claimed.set()
+	_wait_for(lambda: pool.claim(str(tmp_path / "claimed.jpg")))
+	assert (tmp_path / "claimed.jpg").read_bytes() == b"image"
@@ -0,0 +1,92 @@
+from typing import Any
+
+import pytest
+from yt_dlp.utils import DownloadError
+
+import job_ingest
+from job_ingest import IngestItem
+
+
+class FakeYoutubeDL:
+	# The info extract_info gives for each link
+	infos: dict[str, dict[str, Any]] = {}
+
+	def __init__ (self, options: dict[str, Any]):
+		pass
+
+	def __enter__ (self) -> "FakeYoutubeDL":
+		return self
+
+	def __exit__ (self, *args) -> None:
+		pass
+
+	def extract_info (self, url: str, download: bool = True, process: bool = True) -> dict[str, Any]:
+		if url not in self.infos:
+			raise DownloadError(f"{url} is unavailable")
+		return self.infos[url]
+
+
+@pytest.fixture
+def youtube (monkeypatch) -> dict[str, dict[str, Any]]:
+	infos = {}
+	monkeypatch.setattr(FakeYoutubeDL, "infos", infos)
+	monkeypatch.setattr(job_ingest, "YoutubeDL", FakeYoutubeDL)
+	return infos
+
+
+def test_read_csv_without_header ():
+	text = "https://youtu.be/a,Title A,Artist A\n\n,,\nhttps://youtu.be/b, Title B \nhttps://youtu.be/c\n"
+	assert job_ingest.read_csv(text) == [IngestItem("https://youtu.be/a", "Title A", "Artist A"),
+										 IngestItem("https://youtu.be/b", "Title B", ""),
+										 IngestItem("https://youtu.be/c", "", "")]
+
+
+def test_read_csv_with_header ():
+	text = 'Artist,URL\n"Artist, with comma",https://youtu.be/a\nArtist B,https://youtu.be/b\n'
+	assert job_ingest.read_csv(text) == [IngestItem("https://youtu.be/a", "", "Artist, with comma"),
+										 IngestItem("https://youtu.be/b", "", "Artist B")]
+	assert job_ingest.read_csv("url,title,artist\n") == []
+
+
+def test_read_playlist (youtube):
+	youtube["https://youtube.com/playlist?list=a"] = {"_type": "playlist", "entries": [
+		{"url": "https://youtube.com/watch?v=a"},
+		None,
+		{"url": "a", "webpage_url": "https://youtube.com/watch?v=b"}
+	]}
+	assert job_ingest.read_playlist("https://youtube.com/playlist?list=a") == \
+		   [IngestItem("https://youtube.com/watch?v=a"), IngestItem("https://youtube.com/watch?v=b")]
+
+
+@pytest.mark.parametrize("info, expected", [
+	({"track": "Track", "artists": ["One", "Two"], "title": "One - Track (Official Video)"}, ("Track", "One, Two")),
+	({"title": "Artist – Song [Lyrics] (Official Video)", "channel": "Label"}, ("Song", "Artist")),
+	({"title": "Song", "channel": "Artist - Topic"}, ("Song", "Artist"))
+])
+def test_fill_in_item_guesses_title_and_artist (youtube, info, expected):
+	youtube["https://youtu.be/a"] = {"webpage_url": "https://youtube.com/watch?v=a", **info}
+	assert job_ingest.fill_in_item(IngestItem("https://youtu.be/a")) == \
+		   IngestItem("https://youtube.com/watch?v=a", *expected)
+	# Details given in the CSV file are kept
+	assert job_ingest.fill_in_item(IngestItem("https://youtu.be/a", "Given", "")).song_title == "Given"
+
+
+def test_ingest_reports_unavailable_videos (youtube):
+	youtube["https://youtu.be/a"] = {"title": "Artist - Song"}
+	youtube["https://youtu.be/private"] = {"title": "Private", "availability": "private"}
+	youtube["https://youtu.be/playlist"] = {"_type": "playlist", "title": "Playlist"}
+	added = []
+	images = []
+
+	def add_jobs (items: list[IngestItem]) -> list[str]:
+		added.extend(items)
+		return [f"job{index}" for index in range(len(items))]
+
+	result = job_ingest.ingest([IngestItem(url) for url in ("https://youtu.be/a", "https://youtu.be/private",
+															 "https://youtu.be/playlist", "https://youtu.be/gone")],
+							   add_jobs, images.append)
+
+	assert added == [IngestItem("https://youtu.be/a", "Song", "Artist")]
+	assert result.job_ids == ["job0"] and images == ["job0"]
+	assert [url for url, _ in result.failures] == ["https://youtu.be/private", "https://youtu.be/playlist",
+												   "https://youtu.be/gone"]
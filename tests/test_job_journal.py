@@ -0,0 +1,66 @@
+import pathlib
+
+from job import Job, JobStatus
+from job_store import MemoryJobStore
+
+
+def _open_store (location: pathlib.Path, journal_max_bytes: int = 8 * 1024 * 1024) -> tuple[MemoryJobStore, list[str]]:
+	store = MemoryJobStore(str(location / "jobs.json"), str(location / "jobs.journal"),
+						   journal_max_bytes = journal_max_bytes)
+	return store, store.load()
+
+
+def test_replay_applies_changes (tmp_path):
+	store, _ = _open_store(tmp_path)
+	first, second, removed = Job(song_title = "First"), Job(song_title = "Second"), Job()
+	store.add_many([first, second])
+	store.add(removed)
+	first.status = JobStatus.Queued
+	store.record_queued(first.id)
+	second.song_title = "Renamed"
+	second.progress_percentage = "50%"
+	store.remove(removed.id)
+
+	reloaded, queue = _open_store(tmp_path)
+	assert list(reloaded) == [first.id, second.id]
+	assert reloaded[first.id].status == JobStatus.Queued and queue == [first.id]
+	assert reloaded[second.id].song_title == "Renamed"
+	# Changes which aren't worth saving are left out of the journal
+	assert reloaded[second.id].progress_percentage == "0%"
+
+
+def test_compaction_replaces_journal_with_snapshot (tmp_path):
+	store, _ = _open_store(tmp_path, journal_max_bytes = 0)
+	job = Job(song_title = "Title")
+	store.add(job)
+	job.status = JobStatus.Queued
+	store.save(lambda: [job.id])
+
+	assert (tmp_path / "jobs.json").exists()
+	assert not (tmp_path / "jobs.journal").exists() and not (tmp_path / "jobs.journal.old").exists()
+
+	# Changes after the snapshot go in a new journal on top of it
+	job.song_artist = "Artist"
+	reloaded, queue = _open_store(tmp_path)
+	assert queue == [job.id]
+	assert reloaded[job.id].song_title == "Title" and reloaded[job.id].song_artist == "Artist"
+
+
+def test_torn_entry_is_removed_on_load (tmp_path):
+	store, _ = _open_store(tmp_path)
+	first = Job(song_title = "First")
+	store.add(first)
+	store._journal.sync()
+	# The program stopped part way through writing an entry
+	with open(tmp_path / "jobs.journal", "a") as journal_file:
+		journal_file.write('{"type": "field", "id": "')
+
+	store, _ = _open_store(tmp_path)
+	second = Job(song_title = "Second")
+	store.add(second)
+	store[first.id].song_title = "Renamed"
+
+	reloaded, _ = _open_store(tmp_path)
+	assert list(reloaded) == [first.id, second.id]
+	assert reloaded[first.id].song_title == "Renamed"
+	assert (tmp_path / "jobs.journal").read_text().endswith("\n")
@@ -0,0 +1,34 @@
+import pytest
+
+from job import Job, JobStatus
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def failed_job (tmp_path, monkeypatch) -> Job:
+	# Job files are kept in the data directory of the working directory
+	monkeypatch.chdir(tmp_path)
+	(tmp_path / "data").mkdir()
+
+	job = Job(song_title = "Title", song_artist = "Artist")
+	job.status = JobStatus.Failed
+	(tmp_path / "data" / f"{job.id}.mp4").write_bytes(b"video")
+	return job
+
+
+@pytest.mark.parametrize("failed_stage", ["audio", "video", None])
+def test_queue_upload_rejects_jobs_which_failed_rendering (failed_job, failed_stage):
+	failed_job.failed_stage = failed_stage
+	job_queue = JobQueue(audio_thread_count = 0, video_thread_count = 0, upload_thread_count = 0)
+	assert not job_queue.queue_upload(failed_job)
+
+
+def test_queue_upload_retries_failed_uploads (failed_job):
+	failed_job.failed_stage = "upload"
+	failed_job.failure_info = "Connection reset"
+	job_queue = JobQueue(audio_thread_count = 0, video_thread_count = 0, upload_thread_count = 0)
+
+	assert job_queue.queue_upload(failed_job)
+	assert failed_job.failed_stage is None and failed_job.failure_info is None
+	# The same job can't be waiting to upload twice
+	assert not job_queue.queue_upload(failed_job)
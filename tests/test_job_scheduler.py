@@ -0,0 +1,72 @@
+import threading
+from datetime import datetime
+from typing import Optional
+
+from job import Job
+from job_scheduler import JobScheduler
+
+
+def _make_job (name: str, priority: int = 0, publish_slot: Optional[datetime] = None) -> Job:
+	job = Job(song_title = name, priority = priority, publish_slot = publish_slot)
+	job.id = name
+	return job
+
+
+def _get_all (scheduler: JobScheduler) -> list[str]:
+	job_ids = []
+	while (job := scheduler.get(timeout = 0)) is not None:
+		job_ids.append(job.id)
+	return job_ids
+
+
+def test_jobs_are_run_in_priority_order ():
+	scheduler = JobScheduler()
+	for job in (_make_job("first"), _make_job("later slot", publish_slot = datetime(2026, 2, 1)),
+				_make_job("urgent", priority = 5), _make_job("earlier slot", publish_slot = datetime(2026, 1, 1)),
+				_make_job("second")):
+		scheduler.put(job)
+
+	expected = ["urgent", "earlier slot", "later slot", "first", "second"]
+	assert [job.id for job in scheduler.get_jobs()] == expected
+	assert _get_all(scheduler) == expected
+	assert len(scheduler) == 0
+
+
+def test_reprioritise_moves_job ():
+	scheduler = JobScheduler()
+	jobs = [_make_job(name) for name in ("a", "b", "c")]
+	for job in jobs:
+		scheduler.put(job)
+	assert [job.id for job in scheduler.get_jobs()] == ["a", "b", "c"]
+
+	jobs[2].priority = 1
+	assert scheduler.reprioritise(jobs[2])
+	assert [job.id for job in scheduler.get_jobs()] == ["c", "a", "b"]
+
+	# Only jobs in the scheduler can be moved
+	assert not scheduler.reprioritise(_make_job("d"))
+	assert _get_all(scheduler) == ["c", "a", "b"]
+
+
+def test_remove_skips_job ():
+	scheduler = JobScheduler()
+	for number in range(10):
+		scheduler.put(_make_job(str(number)))
+
+	for number in range(0, 10, 2):
+		assert scheduler.remove(str(number))
+	assert not scheduler.remove("0")
+	assert "0" not in scheduler and "1" in scheduler
+
+	assert _get_all(scheduler) == ["1", "3", "5", "7", "9"]
+	# Removed entries were cleared out of the heap along the way
+	assert scheduler._heap == [] and scheduler._removed_count == 0
+
+
+def test_get_waits_for_job ():
+	scheduler = JobScheduler()
+	assert scheduler.get(timeout = 0.05) is None
+
+	job = _make_job("a")
+	threading.Timer(0.1, scheduler.put, [job]).start()
+	assert scheduler.get(timeout = 10) is job
@@ -0,0 +1,60 @@
+import pytest
+
+from job import Job, JobStatus
+from job_store import JobStore, MemoryJobStore, SqliteJobStore
+
+
+@pytest.fixture(params = ["memory", "sqlite"])
+def store (request, tmp_path) -> JobStore:
+	if request.param == "memory":
+		store = MemoryJobStore(str(tmp_path / "jobs.json"), str(tmp_path / "jobs.journal"))
+	else:
+		store = SqliteJobStore(str(tmp_path / "jobs.db"), str(tmp_path / "jobs.json"), str(tmp_path / "jobs.journal"))
+	store.load()
+	return store
+
+
+def _get_all_pages (store: JobStore, statuses: tuple[JobStatus, ...], limit: int) -> list[list[str]]:
+	pages = []
+	after = None
+	while True:
+		jobs, after = store.get_page(statuses, after, limit)
+		pages.append([job.id for job in jobs])
+		if after is None:
+			return pages
+
+
+@pytest.fixture
+def jobs (store) -> list[Job]:
+	jobs = [Job(song_title = name) for name in "ABCDE"]
+	for job in jobs:
+		job.id = job.song_title
+	store.add_many(jobs)
+	return jobs
+
+
+def test_get_with_status_keeps_order_added (store, jobs):
+	a, b, c, d, e = jobs
+	# Jobs get their status in a different order to the one they were added in
+	for job in (c, a, e, b):
+		job.status = JobStatus.Queued
+	d.status = JobStatus.Done
+
+	assert list(store.get_with_status(JobStatus.Queued)) == ["A", "B", "C", "E"]
+	assert list(store.get_with_status(JobStatus.Done, JobStatus.Queued)) == ["A", "B", "C", "D", "E"]
+	assert store.count_by_status()[JobStatus.Queued] == 4
+
+
+def test_get_page_with_status (store, jobs):
+	a, b, c, d, e = jobs
+	for job in (c, a, e, b):
+		job.status = JobStatus.Queued
+
+	assert _get_all_pages(store, (JobStatus.Queued,), 2) == [["A", "B"], ["C", "E"]]
+	assert _get_all_pages(store, (JobStatus.Queued, JobStatus.Waiting), 3) == [["A", "B", "C"], ["D", "E"]]
+
+
+def test_get_page_of_all_jobs (store, jobs):
+	store.remove("B")
+	assert _get_all_pages(store, (), 2) == [["A", "C"], ["D", "E"]]
+	assert _get_all_pages(store, (), 10) == [["A", "C", "D", "E"]]
@@ -0,0 +1,86 @@
+import os
+import threading
+
+import googleapiclient.errors
+import pytest
+
+from config import Config
+from custom_exceptions import JobCancelledException, QuotaExceededException
+from stand_ins import YouTubeApi, YouTubeApiHandler
+from youtube_api import YouTubeClient, quota_costs
+
+
+@pytest.fixture(autouse = True)
+def quota () -> None:
+	Config.set("youtube_quota_units", 1000000)
+	Config.set("youtube_quota_used", 0)
+	Config.set("youtube_quota_day", "")
+
+
+def test_update_videos_batches_requests (serve):
+	api = YouTubeApi([f"video{number}" for number in range(60)])
+	api.forbidden_ids.add("video5")
+	client = YouTubeClient({"token": "token"}, f"{serve(YouTubeApiHandler, api)}/")
+
+	bodies = [{"id": f"video{number}", "snippet": {"title": f"Video {number}", "categoryId": "10"}}
+			  for number in range(61)]
+	results = client.update_videos(bodies)
+
+	# At most 50 updates are sent in each request
+	assert [len(batch) for batch in api.batches] == [50, 11]
+	assert sum(api.batches, []) == [body["id"] for body in bodies]
+
+	assert isinstance(results["video5"], googleapiclient.errors.HttpError)
+	assert results["video5"].resp.status == 403
+	assert results["video60"].resp.status == 404
+	assert all(results[f"video{number}"] is None for number in range(60) if number != 5)
+	assert Config.get("youtube_quota_used") == quota_costs["videos.update"] * 61
+
+
+def test_upload_video_resumes_session (tmp_path, serve):
+	Config.set("upload_chunk_mb", 1)
+	api = YouTubeApi([])
+	client = YouTubeClient({"token": "token"}, f"{serve(YouTubeApiHandler, api)}/")
+
+	video_location = tmp_path / "video.mp4"
+	video_data = os.urandom(int(2.5 * 1024 * 1024))
+	video_location.write_bytes(video_data)
+	body = {"snippet": {"title": "Video"}, "status": {"privacyStatus": "private"}}
+
+	# Stop after the first chunk, keeping the session to continue from
+	progress: list[tuple[str, int, int]] = []
+	with pytest.raises(JobCancelledException):
+		client.upload_video(str(video_location), body, progress_callback = lambda *args: progress.append(args),
+							should_stop = lambda: len(progress) != 0)
+	session_uri, received, total = progress[-1]
+	assert (received, total) == (1024 * 1024, len(video_data))
+
+	video_id = client.upload_video(str(video_location), body, resumable_uri = session_uri)
+
+	# The upload continued in the same session from where it stopped, without starting a new video
+	assert list(api.sessions) == ["session0"]
+	assert video_id == "video_session0"
+	assert api.sessions["session0"]["data"] == video_data
+	assert api.chunks[1] == ("session0", f"bytes */{len(video_data)}")
+	assert Config.get("youtube_quota_used") == quota_costs["videos.insert"]
+
+
+def test_charge_quota_is_atomic ():
+	Config.set("youtube_quota_units", quota_costs["videos.update"] * 20)
+	charged = []
+
+	def charge () -> None:
+		try:
+			YouTubeClient.charge_quota("videos.update")
+			charged.append(True)
+		except QuotaExceededException:
+			pass
+
+	threads = [threading.Thread(target = charge) for _ in range(100)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert len(charged) == 20
+	assert Config.get("youtube_quota_used") == quota_costs["videos.update"] * 20
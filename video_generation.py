@@ -1,9 +1,15 @@
+import contextlib
 import subprocess
 import os
+import pathlib
+import shutil
+import tempfile
 import threading
 import time
-from typing import Callable, Any
+from collections.abc import Iterator
+from typing import Callable, Any, Optional
 
+import requests
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
@@ -11,31 +17,127 @@ from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.ui import WebDriverWait
 
 from yt_dlp import YoutubeDL
+from yt_dlp.postprocessor import SponsorBlockPP
 
+from audio_cache import AudioCache
+from browser_pool import BrowserSession, BrowserSessionPool
 from config import Config
 
-options = webdriver.ChromeOptions()
-options.binary_location = Config.get("chrome_location")
+# Flags for the headless render profile, which needs no display and leaves out everything a render doesn't use
+_headless_arguments = [
+	"--headless=new",
+	# Render with the CPU, so no GPU is needed
+	"--disable-gpu",
+	"--use-angle=swiftshader",
+	"--enable-unsafe-swiftshader",
+	"--disable-extensions",
+	"--disable-background-networking",
+	"--disable-component-update",
+	"--disable-default-apps",
+	"--disable-sync",
+	"--no-first-run",
+	"--no-default-browser-check",
+	"--mute-audio",
+	# The page is never shown, so stop it being slowed down like a page in the background
+	"--disable-background-timer-throttling",
+	"--disable-backgrounding-occluded-windows",
+	"--disable-renderer-backgrounding",
+	# /dev/shm is often too small for the browser in containers
+	"--disable-dev-shm-usage",
+	"--renderer-process-limit=2",
+	"--window-size=1583,1013"
+]
+
+
+def _get_chrome_options (profile_directory: Optional[str]) -> webdriver.ChromeOptions:
+	"""
+	Get the options to start a browser with, for the profile set in the config file
+	:param profile_directory: The profile directory for the browser to use, or None to let the driver make one
+	:return: The options
+	"""
+	options = webdriver.ChromeOptions()
+	options.binary_location = Config.get("chrome_location")
+
+	if Config.get("chrome_profile") == "headless":
+		for argument in _headless_arguments:
+			options.add_argument(argument)
+		# Cap the memory the page's scripts can use
+		options.add_argument(f"--js-flags=--max-old-space-size={Config.get('chrome_heap_limit_mb')}")
+	if profile_directory is not None:
+		options.add_argument(f"--user-data-dir={profile_directory}")
+
+	return options
 
 # We can't distinguish between dialog boxes created by different programs, so create a lock so only one thread can have
-# a dialog box open at one time
+# a dialog box open at one time. Dialogs aren't opened when file_dialog_mode is "devtools", so the lock isn't needed then.
 ahk_lock = threading.Lock()
 
 
+# Downloaded source audio, so songs which are made again don't need downloading again
+audio_cache = AudioCache(Config.get("audio_cache_location"), Config.get("audio_cache_size_mb") * 1024 * 1024)
+
+
 def generate_audio (*, yt_url: str, speedup_factor: float = 1.8225, output_location: str) -> None:
 	"""
 	Downloads the audio of the linked YouTube video, speeds it up by the given factor using ffmpeg, and then saves it to
-	the given output location
+	the given output location. The downloaded audio is cached, so it is only downloaded again if it has been removed
+	from the cache.
 	:param yt_url: The YouTube video to get audio from
 	:param speedup_factor: The speedup factor, by default 1.8225
 	:param output_location: The location to save the resulting audio file
 	:return: None
 	"""
+	cache_key = AudioCache.get_key(yt_url, "bestaudio") if Config.get("audio_cache_size_mb") > 0 else None
+	if cache_key is None:
+		_download_audio(yt_url, speedup_factor, output_location)
+		return
+
+	# The lock stops the entry being removed from the cache while it's used, and only lets each video be downloaded once
+	# at a time
+	with audio_cache.lock(cache_key):
+		cached = audio_cache.get(cache_key)
+		if cached is None:
+			_download_audio(yt_url, speedup_factor, output_location, cache_key)
+			return
+
+		source_location, metadata = cached
+		subprocess.run([Config.get("ffmpeg_location"), "-y", "-i", source_location, "-filter:a",
+						_get_audio_filters(metadata["asr"], metadata["segments"], speedup_factor), output_location],
+					   check = True)
+
+
+def _download_audio (yt_url: str, speedup_factor: float, output_location: str, cache_key: Optional[str] = None) \
+		-> None:
+	"""
+	Downloads the audio of a video, speeds it up and saves it, adding the downloaded audio to the cache
+	:param yt_url: The YouTube video to get audio from
+	:param speedup_factor: The speedup factor
+	:param output_location: The location to save the resulting audio file
+	:param cache_key: The key to cache the downloaded audio with, or None to not cache it
+	:return: None
+	"""
+	if Config.get("audio_streaming"):
+		with YoutubeDL({"format": "bestaudio"}) as ytdl:
+			info = ytdl.extract_info(yt_url, download = False)
+
+			# Only plain downloads can be streamed, others (e.g. fragmented streams) have to be downloaded first
+			if info.get("protocol") in ("http", "https"):
+				_stream_audio(ytdl, info, speedup_factor, output_location, cache_key)
+				return
+
+	if cache_key is not None:
+		download_location = audio_cache.get_temp_location(cache_key, "webm")
+	else:
+		download_location = f"{output_location}.temp.webm"
+
 	try:
+		# Remove anything left over from a download which didn't finish, so yt-dlp doesn't think it's already downloaded
+		pathlib.Path(download_location).unlink(missing_ok = True)
+
 		# Download audio
 		ytdl_options = {
 			"format":  "bestaudio",
-			"outtmpl": f"{output_location}.temp.webm",
+			"outtmpl": download_location,
 			"sponsorblock-remove": "all"
 		}
 		with YoutubeDL(ytdl_options) as ytdl:
@@ -43,118 +145,487 @@ def generate_audio (*, yt_url: str, speedup_factor: float = 1.8225, output_locat
 
 		# Get sample rate of downloaded audio
 		ffprobe = subprocess.run([Config.get("ffprobe_location"), "-v", "error", "-show_entries", "stream=sample_rate",
-								  "-of", "default=noprint_wrappers=1:nokey=1", f"{output_location}.temp.webm"],
+								  "-of", "default=noprint_wrappers=1:nokey=1", download_location],
 								 stdout = subprocess.PIPE)
+		sample_rate = ffprobe.stdout.decode('utf-8').strip()
 
 		# Speed up the audio and save it
-		subprocess.call([Config.get("ffmpeg_location"), "-y", "-i", f"{output_location}.temp.webm", "-filter:a",
-						 f"asetrate={ffprobe.stdout.decode('utf-8').strip()}*{speedup_factor}", output_location])
+		subprocess.call([Config.get("ffmpeg_location"), "-y", "-i", download_location, "-filter:a",
+						 f"asetrate={sample_rate}*{speedup_factor}", output_location])
+
+		if cache_key is not None:
+			audio_cache.put(cache_key, download_location, asr = int(sample_rate), segments = [])
 	finally:
-		# Delete the temporary file
-		os.remove(f"{output_location}.temp.webm")
+		# Delete the temporary file, if it wasn't moved into the cache
+		pathlib.Path(download_location).unlink(missing_ok = True)
 
 
-def generate_video (*, song_title: str, song_artist: str, audio_location: str, image_location: str,
-		save_location: str, progress_callback: Callable[[str], Any] = lambda _: None) -> None:
+# The size of each request when streaming audio. YouTube slows down downloads which aren't split into requests like this.
+_stream_chunk_size = 10 * 1024 * 1024
+
+
+def _get_sponsor_segments (ytdl: YoutubeDL, info: dict[str, Any]) -> list[tuple[float, float]]:
 	"""
-	Given a set of parameters, generates a music visualiser video using vizzy.io
-	:param song_title: The name of the song that will appear in the video
-	:param song_artist: The name of the artist that will appear in the video
-	:param audio_location: The absolute path to an audio file that will be used as the audio of the video
-	:param image_location: The absolute path to an image that will be used as the background of the video
-	:param save_location: The absolute path the resulting video will be saved to
-	:param progress_callback: A function which will be called with the progress text to update the job's project
+	Gets the parts of a video which SponsorBlock says should be skipped
+	:param ytdl: The YoutubeDL instance the video's info was extracted with
+	:param info: The video's info
+	:return: A list of the start and end times of each segment, in seconds
+	"""
+	_, info = SponsorBlockPP(ytdl).run(info)
+	return [(chapter["start_time"], chapter["end_time"]) for chapter in info.get("sponsorblock_chapters", [])
+			if chapter["type"] == "skip"]
+
+
+def _download_stream (url: str, headers: dict[str, str], write: Callable[[bytes], Any]) -> None:
+	"""
+	Downloads a file in chunks, passing the data to a function as it arrives
+	:param url: The URL of the file
+	:param headers: The headers to send with each request
+	:param write: A function which will be called with each piece of data, in order
 	:return: None
 	"""
-	browser = webdriver.Chrome(options = options)
-	wait = WebDriverWait(browser, 20)
+	position = 0
+	with requests.Session() as session:
+		while True:
+			response = session.get(url, stream = True, timeout = 30,
+								   headers = {**headers, "Range": f"bytes={position}-{position + _stream_chunk_size - 1}"})
+			if response.status_code == 416:  # Range not satisfiable, the last chunk ended exactly at the end of the file
+				break
+			response.raise_for_status()
+
+			received = 0
+			for data in response.iter_content(64 * 1024):
+				write(data)
+				received += len(data)
+			position += received
+
+			# The server sent the whole file, or this was the last chunk
+			if response.status_code != 206 or received < _stream_chunk_size:
+				break
+
+
+def _get_cut_filters (segments: list[tuple[float, float]]) -> list[str]:
+	"""
+	Get the ffmpeg filters to cut parts out of audio
+	:param segments: The start and end times of parts of the audio to cut out
+	:return: A list of filters
+	"""
+	if len(segments) == 0:
+		return []
 
-	browser.set_window_size(1583, 1013)
+	# Cut out sponsored segments, and close up the gaps they leave
+	skipped = "+".join(f"between(t,{start},{end})" for start, end in segments)
+	return [f"aselect='not({skipped})'", "asetpts=N/SR/TB"]
 
-	# Load page with template
-	browser.get(Config.get("template_url"))
 
-	# Wait until page finishes loading
-	wait.until(expected_conditions.invisibility_of_element_located((By.XPATH, '//*[@id="root"]/div[1]/div')))
+def _get_speedup_filters (sample_rate: Optional[int], speedup_factor: float) -> list[str]:
+	"""
+	Get the ffmpeg filters to speed up audio
+	:param sample_rate: The sample rate of the audio, or None if it isn't known
+	:param speedup_factor: The speedup factor
+	:return: A list of filters
+	"""
+	# If the sample rate isn't known, resample to a known one first
+	if sample_rate:
+		return [f"asetrate={sample_rate}*{speedup_factor}"]
+	else:
+		return ["aresample=48000", f"asetrate=48000*{speedup_factor}"]
 
-	# Dismiss cookie banner
-	wait.until(expected_conditions.element_to_be_clickable((By.CLASS_NAME, "cc-nb-reject")))
-	browser.find_element(By.CLASS_NAME, "cc-nb-reject").click()
 
-	# -- VIDEO CUSTOMISATION --
+def _get_audio_filters (sample_rate: Optional[int], segments: list[tuple[float, float]], speedup_factor: float) -> str:
+	"""
+	Get the ffmpeg filters to cut sponsored segments out of audio, then speed it up
+	:param sample_rate: The sample rate of the audio, or None if it isn't known
+	:param segments: The start and end times of parts of the audio to cut out
+	:param speedup_factor: The speedup factor
+	:return: The filters, to be given to -filter:a
+	"""
+	return ",".join(_get_cut_filters(segments) + _get_speedup_filters(sample_rate, speedup_factor))
+
+
+def _stream_audio (ytdl: YoutubeDL, info: dict[str, Any], speedup_factor: float, output_location: str,
+		cache_key: Optional[str] = None) -> None:
+	"""
+	Streams the audio of a video straight into ffmpeg, which speeds it up and saves it, without saving the original audio
+	unless it's being cached
+	:param ytdl: The YoutubeDL instance the video's info was extracted with
+	:param info: The video's info, with the audio format selected
+	:param speedup_factor: The speedup factor
+	:param output_location: The location to save the resulting audio file
+	:param cache_key: The key to cache the downloaded audio with, or None to not cache it
+	:return: None
+	"""
+	segments = _get_sponsor_segments(ytdl, info)
+
+	ffmpeg = subprocess.Popen([Config.get("ffmpeg_location"), "-y", "-i", "pipe:0", "-filter:a",
+							   _get_audio_filters(info.get("asr"), segments, speedup_factor), output_location],
+							  stdin = subprocess.PIPE)
 
-	# Set resolution to 1080p
-	wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="1080"]')))
-	browser.find_element(By.XPATH, '//span[text()="1080"]').click()
+	# Save a copy of the audio as it's downloaded to add to the cache
+	cache_location = audio_cache.get_temp_location(cache_key, info["ext"]) if cache_key is not None else os.devnull
+	downloaded = False
 
-	# Select image
-	wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Image Background"]')))
-	browser.find_element(By.XPATH, '//span[text()="Image Background"]').click()
+	try:
+		with open(cache_location, "wb") as cache_file:
+			def write (data: bytes) -> None:
+				cache_file.write(data)
+				ffmpeg.stdin.write(data)
+
+			_download_stream(info["url"], info.get("http_headers", {}), write)
+		downloaded = True
+		ffmpeg.stdin.close()
+	except BrokenPipeError:  # ffmpeg exited early, its exit code is reported below
+		pass
+	except Exception:
+		ffmpeg.kill()
+		ffmpeg.wait()
+		pathlib.Path(output_location).unlink(missing_ok = True)
+		if cache_key is not None:
+			pathlib.Path(cache_location).unlink(missing_ok = True)
+		raise
+
+	if ffmpeg.wait() != 0 or not downloaded:
+		if cache_key is not None:
+			pathlib.Path(cache_location).unlink(missing_ok = True)
+		raise RuntimeError(f"ffmpeg exited with code {ffmpeg.returncode}")
+
+	if cache_key is not None:
+		audio_cache.put(cache_key, cache_location, asr = info.get("asr"), segments = segments)
+
+
+def _download_source_audio (yt_url: str, download_location: str) -> tuple[Optional[int], list[tuple[float, float]]]:
+	"""
+	Downloads the original audio of a video
+	:param yt_url: The YouTube video to get audio from
+	:param download_location: The location to save the audio
+	:return: The sample rate of the audio if it's known, and the start and end times of its sponsored segments
+	"""
+	# Remove anything left over from a download which didn't finish, so yt-dlp doesn't think it's already downloaded
+	pathlib.Path(download_location).unlink(missing_ok = True)
+
+	with YoutubeDL({"format": "bestaudio", "outtmpl": download_location}) as ytdl:
+		info = ytdl.extract_info(yt_url)
+		return info.get("asr"), _get_sponsor_segments(ytdl, info)
+
+
+@contextlib.contextmanager
+def _source_audio (yt_url: str) -> Iterator[tuple[str, Optional[int], list[tuple[float, float]]]]:
+	"""
+	Gets the original audio of a video, from the cache if it's there, otherwise by downloading it
+	:param yt_url: The YouTube video to get audio from
+	:return: A context manager giving the location of the audio, its sample rate if it's known, and the start and end
+	times of its sponsored segments
+	"""
+	cache_key = AudioCache.get_key(yt_url, "bestaudio") if Config.get("audio_cache_size_mb") > 0 else None
+	if cache_key is None:
+		with tempfile.TemporaryDirectory() as temp_dir:
+			source_location = os.path.join(temp_dir, "source.webm")
+			yield source_location, *_download_source_audio(yt_url, source_location)
+		return
+
+	# Held until the with block finishes, so the entry can't be removed from the cache while it's used
+	with audio_cache.lock(cache_key):
+		cached = audio_cache.get(cache_key)
+		if cached is None:
+			download_location = audio_cache.get_temp_location(cache_key, "webm")
+			try:
+				sample_rate, segments = _download_source_audio(yt_url, download_location)
+				source_location = audio_cache.put(cache_key, download_location, asr = sample_rate, segments = segments)
+				cached = source_location, {"asr": sample_rate, "segments": segments}
+			finally:
+				pathlib.Path(download_location).unlink(missing_ok = True)
+
+		source_location, metadata = cached
+		yield source_location, metadata["asr"], metadata["segments"]
+
+
+def generate_audio_variants (*, yt_url: str, speedup_factors: list[float], output_locations: list[str],
+		preview_locations: list[str], preview_start: float, preview_length: float) -> None:
+	"""
+	Generates several sped up versions of the audio of a video, each with a short preview, decoding the audio only once
+	:param yt_url: The YouTube video to get audio from
+	:param speedup_factors: The speedup factor of each version
+	:param output_locations: The location to save each version, in the same order as the speedup factors
+	:param preview_locations: The location to save the preview of each version, in the same order as the speedup
+	factors
+	:param preview_start: The time in the original audio that the previews start from, in seconds
+	:param preview_length: The length of each preview, in seconds
+	:return: None
+	"""
+	count = len(speedup_factors)
 
-	# Get the source of the image element, so we can tell when it changes later
-	image_src = browser.find_element(By.XPATH, '//img[contains(@src, "firebasestorage")]').get_attribute("src")
+	with _source_audio(yt_url) as (source_location, sample_rate, segments):
+		# Decode the whole audio once, then split it into a branch for each speedup factor
+		full_graph = [f"[0:a]{','.join(_get_cut_filters(segments) + [f'asplit={count}'])}"
+					  f"{''.join(f'[full{index}]' for index in range(count))}"]
+		full_graph += [f"[full{index}]{','.join(_get_speedup_filters(sample_rate, speedup_factor))}[variant{index}]"
+					   for index, speedup_factor in enumerate(speedup_factors)]
 
-	# Fill image
-	browser.find_element(By.XPATH, '//input[@id="image-upload-button"]').send_keys(image_location)
+		# The previews come from a second input which seeks straight to the preview, so only that part is decoded
+		preview_graph = [f"[1:a]asplit={count}{''.join(f'[part{index}]' for index in range(count))}"]
+		preview_graph += [f"[part{index}]{','.join(_get_speedup_filters(sample_rate, speedup_factor))},"
+						  f"atrim=duration={preview_length}[preview{index}]"
+						  for index, speedup_factor in enumerate(speedup_factors)]
 
-	# Wait for image to load
-	wait.until(expected_conditions.invisibility_of_element_located((By.XPATH, f'//img[@src="{image_src}"]')))
+		command = [Config.get("ffmpeg_location"), "-y", "-i", source_location,
+				   "-ss", str(preview_start), "-t", str(preview_length * max(speedup_factors)), "-i", source_location,
+				   "-filter_complex", ";".join(full_graph + preview_graph)]
+		for index in range(count):
+			command += ["-map", f"[variant{index}]", output_locations[index]]
+			command += ["-map", f"[preview{index}]", preview_locations[index]]
 
-	# Select song title
-	wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Song Title"]')))
-	browser.find_element(By.XPATH, '//span[text()="Song Title"]').click()
+		subprocess.run(command, check = True)
 
-	# Fill song title
-	song_title_element = browser.find_element(By.XPATH, '//textarea[text()="Placeholder Title"]')
-	song_title_element.send_keys(Keys.CONTROL + "a")
-	song_title_element.send_keys(Keys.DELETE)
-	song_title_element.send_keys(song_title)
 
-	# Select song artist
-	wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Artist Name"]')))
-	browser.find_element(By.XPATH, '//span[text()="Artist Name"]').click()
+def _load_template (session: BrowserSession) -> None:
+	"""
+	Loads the template in a browser session, and waits for it to finish loading
+	:param session: The session to load the template in
+	:return: None
+	"""
+	session.browser.get(Config.get("template_url"))
 
-	# Fill song artist
-	song_artist_element = browser.find_element(By.XPATH, '//textarea[text()="Placeholder Artist"]')
-	song_artist_element.send_keys(Keys.CONTROL + "a")
-	song_artist_element.send_keys(Keys.DELETE)
-	song_artist_element.send_keys(song_artist)
+	# Wait until page finishes loading
+	session.wait.until(expected_conditions.invisibility_of_element_located(
+		(By.XPATH, '//*[@id="root"]/div[1]/div')))
 
-	# -- SIGN IN --
 
+def _sign_in (session: BrowserSession) -> None:
+	"""
+	Signs in to Vizzy in a browser session which has the template loaded
+	:param session: The session to sign in with
+	:return: None
+	"""
 	# Click sign in button
-	wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Sign in"]')))
-	browser.find_element(By.XPATH, '//span[text()="Sign in"]').click()
+	session.wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Sign in"]')))
+	session.browser.find_element(By.XPATH, '//span[text()="Sign in"]').click()
 
 	# Fill email
-	browser.find_element(By.XPATH, '//input[@name="email"]').send_keys(Config.get("vizzy_email"))
+	session.browser.find_element(By.XPATH, '//input[@name="email"]').send_keys(Config.get("vizzy_email"))
 
 	# Fill password
-	browser.find_element(By.XPATH, '//input[@name="password"]').send_keys(Config.get("vizzy_password"))
+	session.browser.find_element(By.XPATH, '//input[@name="password"]').send_keys(Config.get("vizzy_password"))
 
 	# Click submit button
-	wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Sign In"]')))
-	browser.find_element(By.XPATH, '//span[text()="Sign In"]').click()
+	session.wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Sign In"]')))
+	session.browser.find_element(By.XPATH, '//span[text()="Sign In"]').click()
 
 	# Wait until signed-in
-	wait.until(expected_conditions.invisibility_of_element_located((By.XPATH, '/html/body/div[3]/div[3]/div/div')))
+	session.wait.until(expected_conditions.invisibility_of_element_located(
+		(By.XPATH, '/html/body/div[3]/div[3]/div/div')))
+
+
+def _create_vizzy_session () -> BrowserSession:
+	"""
+	Opens a new browser, loads the template and signs in to Vizzy
+	:return: The new session
+	"""
+	# Headless browsers each get a fresh profile of their own, which is removed when the session is closed
+	profile_directory = tempfile.mkdtemp(prefix = "chrome-profile-") if Config.get("chrome_profile") == "headless" \
+		else None
+
+	start_time = time.monotonic()
+	try:
+		browser = webdriver.Chrome(options = _get_chrome_options(profile_directory))
+	except Exception:
+		if profile_directory is not None:
+			shutil.rmtree(profile_directory, ignore_errors = True)
+		raise
+	session = BrowserSession(browser, profile_directory, time.monotonic() - start_time)
+	browser.set_window_size(1583, 1013)
+
+	_load_template(session)
+
+	# Dismiss cookie banner
+	session.wait.until(expected_conditions.element_to_be_clickable((By.CLASS_NAME, "cc-nb-reject")))
+	browser.find_element(By.CLASS_NAME, "cc-nb-reject").click()
+
+	_sign_in(session)
+	return session
+
+
+def _reset_vizzy_session (session: BrowserSession) -> None:
+	"""
+	Gets a used session ready for another job, by loading a fresh copy of the template
+	:param session: The session to reset
+	:return: None
+	"""
+	_load_template(session)
+
+	# Signing in should be remembered, but sign in again if it wasn't
+	if len(session.browser.find_elements(By.XPATH, '//span[text()="Sign in"]')) != 0:
+		_sign_in(session)
+
+
+# Browsers which are already signed in with the template loaded, ready for the next video
+session_pool = BrowserSessionPool(_create_vizzy_session, _reset_vizzy_session,
+								  max_jobs = Config.get("browser_max_jobs"),
+								  max_memory_mb = Config.get("browser_max_memory_mb"))
+
 
-	# -- AUDIO SELECTION --
+def prepare_video_stage () -> None:
+	"""
+	Called once by each worker which will generate videos, before it generates any, so a browser session can be made
+	ready in the background
+	:return: None
+	"""
+	if Config.get("render_engine") == "vizzy":
+		session_pool.warm()
 
+
+def release_video_stage () -> None:
+	"""
+	Called by each worker which generated videos once it stops, so the browser session kept ready for it is closed
+	:return: None
+	"""
+	session_pool.shrink()
+
+
+def generate_video (*, song_title: str, song_artist: str, audio_location: str, image_location: str,
+		save_location: str, progress_callback: Callable[[str], Any] = lambda _: None,
+		browser_stats_callback: Callable[[Optional[float], Optional[int]], Any] = lambda startup_secs, memory: None) \
+		-> None:
+	"""
+	Given a set of parameters, generates a music visualiser video using vizzy.io
+	:param song_title: The name of the song that will appear in the video
+	:param song_artist: The name of the artist that will appear in the video
+	:param audio_location: The absolute path to an audio file that will be used as the audio of the video
+	:param image_location: The absolute path to an image that will be used as the background of the video
+	:param save_location: The absolute path the resulting video will be saved to
+	:param progress_callback: A function which will be called with the progress text to update the job's project
+	:param browser_stats_callback: A function which will be called once the video is exported, with how long the
+	browser used took to start in seconds (or None if it was already running for an earlier job), and how much memory
+	the browser is using in bytes (or None if it can't be found on this system)
+	:return: None
+	"""
+	with session_pool.session() as session:
+		browser = session.browser
+		wait = session.wait
+
+		# -- VIDEO CUSTOMISATION --
+
+		# Set resolution to 1080p
+		wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="1080"]')))
+		browser.find_element(By.XPATH, '//span[text()="1080"]').click()
+
+		# Select image
+		wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Image Background"]')))
+		browser.find_element(By.XPATH, '//span[text()="Image Background"]').click()
+
+		# Get the source of the image element, so we can tell when it changes later
+		image_src = browser.find_element(By.XPATH, '//img[contains(@src, "firebasestorage")]').get_attribute("src")
+
+		# Fill image
+		browser.find_element(By.XPATH, '//input[@id="image-upload-button"]').send_keys(image_location)
+
+		# Wait for image to load
+		wait.until(expected_conditions.invisibility_of_element_located((By.XPATH, f'//img[@src="{image_src}"]')))
+
+		# Select song title
+		wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Song Title"]')))
+		browser.find_element(By.XPATH, '//span[text()="Song Title"]').click()
+
+		# Fill song title
+		song_title_element = browser.find_element(By.XPATH, '//textarea[text()="Placeholder Title"]')
+		song_title_element.send_keys(Keys.CONTROL + "a")
+		song_title_element.send_keys(Keys.DELETE)
+		song_title_element.send_keys(song_title)
+
+		# Select song artist
+		wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Artist Name"]')))
+		browser.find_element(By.XPATH, '//span[text()="Artist Name"]').click()
+
+		# Fill song artist
+		song_artist_element = browser.find_element(By.XPATH, '//textarea[text()="Placeholder Artist"]')
+		song_artist_element.send_keys(Keys.CONTROL + "a")
+		song_artist_element.send_keys(Keys.DELETE)
+		song_artist_element.send_keys(song_artist)
+
+		# -- AUDIO SELECTION --
+
+		# Headless browsers can't show file dialogs, so they always use the dialog-free mode
+		dialog_free = Config.get("file_dialog_mode") == "devtools" or Config.get("chrome_profile") == "headless"
+		if dialog_free:
+			_choose_audio_devtools(session, audio_location)
+		else:
+			_choose_audio_autohotkey(session, audio_location)
+
+		# Wait until audio finishes processing
+		wait.until(expected_conditions.visibility_of_element_located((By.XPATH, '//h4[text()="Analyzing audio..."]')))
+		wait.until(expected_conditions.invisibility_of_element_located((By.XPATH, '//h4[text()="Analyzing audio..."]')))
+
+		# -- EXPORT --
+
+		# Remove any earlier export, so it isn't mistaken for this one
+		pathlib.Path(save_location).unlink(missing_ok = True)
+
+		if dialog_free:
+			# Download the export into a directory of its own next to where it will be saved, so it can be moved there
+			with tempfile.TemporaryDirectory(dir = pathlib.Path(save_location).parent, prefix = ".export-") \
+					as download_directory:
+				_start_export_devtools(session, download_directory)
+				_wait_for_export(session, lambda: _find_finished_download(download_directory) is not None,
+								 progress_callback)
+				os.replace(_find_finished_download(download_directory), save_location)
+		else:
+			_start_export_autohotkey(session, save_location)
+			_wait_for_export(session, lambda: _is_file_finalised(save_location), progress_callback)
+
+		# Only a browser started for this job cost it the time to start
+		browser_stats_callback(session.startup_secs if session.job_count == 0 else None, session.get_process_memory())
+
+
+def _choose_audio_autohotkey (session: BrowserSession, audio_location: str) -> None:
+	"""
+	Gives the template an audio file through the browser's file dialog, using an AutoHotkey script to fill it in
+	:param session: The session with the template open
+	:param audio_location: The absolute path of the audio file
+	:return: None
+	"""
 	# Only allow one thread to open a dialog box at a time
 	with ahk_lock:
 		# Click on select audio button
-		wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Choose audio"]')))
-		browser.find_element(By.XPATH, '//span[text()="Choose audio"]').click()
+		session.wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Choose audio"]')))
+		session.browser.find_element(By.XPATH, '//span[text()="Choose audio"]').click()
 
 		# Select audio file
 		subprocess.call([Config.get("autohotkey_location"), Config.get("openfile_ahk_script"), audio_location])
 
-	# Wait until audio finishes processing
-	wait.until(expected_conditions.visibility_of_element_located((By.XPATH, '//h4[text()="Analyzing audio..."]')))
-	wait.until(expected_conditions.invisibility_of_element_located((By.XPATH, '//h4[text()="Analyzing audio..."]')))
 
-	# -- EXPORT --
+def _choose_audio_devtools (session: BrowserSession, audio_location: str) -> None:
+	"""
+	Gives the template an audio file without opening a file dialog, by giving the file straight to the page's file input.
+	If the page only makes its file input when the button is clicked, the input is caught before it can open a dialog.
+	:param session: The session with the template open
+	:param audio_location: The absolute path of the audio file
+	:return: None
+	"""
+	browser = session.browser
+
+	# Inputs which only accept other types of file (e.g. images) are left alone
+	file_inputs = [file_input for file_input in browser.find_elements(By.CSS_SELECTOR, 'input[type="file"]')
+				   if "audio" in (file_input.get_attribute("accept") or "audio")]
+	if len(file_inputs) == 0:
+		browser.execute_script(_file_chooser_shim_script)
+
+		# Click on select audio button
+		session.wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Choose audio"]')))
+		browser.find_element(By.XPATH, '//span[text()="Choose audio"]').click()
+
+		file_inputs = [session.wait.until(lambda _: browser.execute_script("return window.fileChooserShim.input;"))]
+
+	# Select audio file
+	file_inputs[0].send_keys(audio_location)
+
+
+def _open_export_settings (session: BrowserSession) -> None:
+	"""
+	Opens the export screen of the template
+	:param session: The session with the template open
+	:return: None
+	"""
+	browser = session.browser
+	wait = session.wait
 
 	# Select File from the menu bar
 	wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//*[@id="file-menu-button"]')))
@@ -174,6 +645,20 @@ var element = arguments[0];
 element.parentNode.removeChild(element);
 """, browser.find_element(By.XPATH, '//*[@id="root"]/div/div/div[1]/div'))
 
+
+def _start_export_autohotkey (session: BrowserSession, save_location: str) -> None:
+	"""
+	Starts exporting the video straight to a file, choosing where to save it through the browser's file dialog using an
+	AutoHotkey script
+	:param session: The session with the template ready to export
+	:param save_location: The absolute path to save the video to
+	:return: None
+	"""
+	browser = session.browser
+	wait = session.wait
+
+	_open_export_settings(session)
+
 	# Show advanced settings
 	wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//p[text()="Show advanced settings"]')))
 	browser.find_element(By.XPATH, '//p[text()="Show advanced settings"]').click()
@@ -191,23 +676,248 @@ element.parentNode.removeChild(element);
 		# Select export location
 		subprocess.call([Config.get("autohotkey_location"), Config.get("savefile_ahk_script"), save_location])
 
-	# Wait for export to start
-	while (progress_text := browser.find_element(By.XPATH, '//*[@id="root"]/div/div/div[2]/div[2]/div[2]/h6').text) \
-			== "0%":
-		progress_callback(progress_text)
-		time.sleep(2)
 
-	# Wait for export to finish
-	while (progress_text := browser.find_element(By.XPATH, '//*[@id="root"]/div/div/div[2]/div[2]/div[2]/h6').text) \
-			!= "0%":
-		progress_callback(progress_text)
-		time.sleep(2)
+def _start_export_devtools (session: BrowserSession, download_directory: str) -> None:
+	"""
+	Starts exporting the video as a download, which the browser saves to a directory without asking where to save it
+	:param session: The session with the template ready to export
+	:param download_directory: The absolute path of an empty directory to download the video to
+	:return: None
+	"""
+	browser = session.browser
+
+	_open_export_settings(session)
+
+	# Each session is its own browser, so this only changes where this session's downloads go
+	browser.execute_cdp_cmd("Browser.setDownloadBehavior", {"behavior": "allow", "downloadPath": download_directory})
+
+	# Start export, leaving the file system option off so the video is downloaded instead of asking for a file
+	session.wait.until(expected_conditions.element_to_be_clickable((By.XPATH, '//span[text()="Start export"]')))
+	browser.find_element(By.XPATH, '//span[text()="Start export"]').click()
+
+
+def _wait_for_export (session: BrowserSession, is_finished: Callable[[], bool],
+		progress_callback: Callable[[str], Any]) -> None:
+	"""
+	Reports the progress of an export as soon as the page changes it, until the exported file is finished
+	:param session: The session which is exporting
+	:param is_finished: A function which returns true once the exported file is finished
+	:param progress_callback: A function which will be called with the progress text
+	:return: None
+	:raises TimeoutError: If the export hasn't finished within export_timeout_mins
+	"""
+	# An export which has stalled would otherwise hold the job and the browser forever. Once the job fails the session
+	# is reset with a fresh copy of the template, which abandons the export.
+	deadline = time.monotonic() + Config.get("export_timeout_mins") * 60
+	browser = session.browser
+	browser.execute_script(_watch_progress_script,
+						   browser.find_element(By.XPATH, '//*[@id="root"]/div/div/div[2]/div[2]/div[2]/h6'))
+	while not is_finished():
+		if time.monotonic() > deadline:
+			raise TimeoutError(f"Export didn't finish within {Config.get('export_timeout_mins')} minutes")
+		for progress_text in browser.execute_async_script(_wait_for_progress_script, 500):
+			progress_callback(progress_text)
+
+
+def _find_finished_download (directory: str) -> Optional[str]:
+	"""
+	Finds a finished download in a directory. While the browser is downloading a file it writes to a .crdownload file,
+	which is renamed once it's finished.
+	:param directory: The directory the browser is downloading to
+	:return: The path of the downloaded file, or None if nothing has finished downloading
+	"""
+	files = list(pathlib.Path(directory).iterdir())
+	if any(file.suffix == ".crdownload" for file in files):
+		return None
+
+	finished = [file for file in files if file.is_file() and file.stat().st_size > 0]
+	return str(finished[0]) if len(finished) != 0 else None
 
-	# Wait a little longer
-	time.sleep(2)
 
-	# Quit
-	browser.quit()
+def _is_file_finalised (location: str) -> bool:
+	"""
+	Checks if a file being written by the browser is finished. While the browser is writing to a file it writes to a
+	.crswap file next to it, which replaces the file once it's finished.
+	:param location: The path of the file
+	:return: True if the file has been written, false otherwise
+	"""
+	path = pathlib.Path(location)
+	try:
+		return path.stat().st_size > 0 and not pathlib.Path(f"{location}.crswap").exists()
+	except FileNotFoundError:
+		return False
+
+
+# Stops the page opening file dialogs, and keeps the file input it would have opened one for so a file can be given to it
+# directly. Pages using the File System Access API are given file handles backed by a file input instead.
+_file_chooser_shim_script = """
+var state = window.fileChooserShim = window.fileChooserShim || {input: null, installed: false};
+state.input = null;
+if (!state.installed) {
+	state.installed = true;
+	var capture = function (input) {
+		// Inputs which were never added to the page need to be in it to be given a file
+		if (!input.isConnected) {
+			input.style.display = "none";
+			document.body.appendChild(input);
+		}
+		state.input = input;
+	};
+	var click = HTMLInputElement.prototype.click;
+	HTMLInputElement.prototype.click = function () {
+		if (this.type === "file") {
+			capture(this);
+		} else {
+			click.call(this);
+		}
+	};
+	var showPicker = HTMLInputElement.prototype.showPicker;
+	HTMLInputElement.prototype.showPicker = function () {
+		if (this.type === "file") {
+			capture(this);
+		} else if (showPicker) {
+			showPicker.call(this);
+		}
+	};
+	window.showOpenFilePicker = function (options) {
+		var input = document.createElement("input");
+		input.type = "file";
+		input.multiple = Boolean(options && options.multiple);
+		return new Promise(function (resolve) {
+			input.addEventListener("change", function () {
+				resolve(Array.from(input.files).map(function (file) {
+					return {kind: "file", name: file.name, getFile: function () { return Promise.resolve(file); }};
+				}));
+			});
+			capture(input);
+		});
+	};
+}
+"""
+
+# Starts recording every change to the progress text given as the first argument
+_watch_progress_script = """
+var element = arguments[0];
+var state = window.exportProgress = {updates: [element.textContent], waiting: null};
+new MutationObserver(function () {
+	state.updates.push(element.textContent);
+	if (state.waiting) {
+		state.waiting();
+	}
+}).observe(element, {childList: true, characterData: true, subtree: true});
+"""
+
+# Returns the progress changes recorded since it was last run, waiting for one up to the given amount of milliseconds
+_wait_for_progress_script = """
+var callback = arguments[arguments.length - 1];
+var state = window.exportProgress;
+function finish () {
+	var updates = state.updates;
+	state.updates = [];
+	state.waiting = null;
+	callback(updates);
+}
+if (state.updates.length !== 0) {
+	finish();
+} else {
+	state.waiting = finish;
+	setTimeout(function () {
+		if (state.waiting === finish) {
+			finish();
+		}
+	}, arguments[0]);
+}
+"""
+
+
+def get_audio_duration (audio_location: str) -> float:
+	"""
+	Gets the duration of an audio file using ffprobe
+	:param audio_location: The path to the audio file
+	:return: The duration of the audio, in seconds
+	"""
+	ffprobe = subprocess.run([Config.get("ffprobe_location"), "-v", "error", "-show_entries", "format=duration",
+							  "-of", "default=noprint_wrappers=1:nokey=1", audio_location],
+							 stdout = subprocess.PIPE, check = True)
+	return float(ffprobe.stdout.decode("utf-8").strip())
+
+
+def generate_video_ffmpeg (*, song_title: str, song_artist: str, audio_location: str, image_location: str,
+		save_location: str, progress_callback: Callable[[str], Any] = lambda _: None) -> None:
+	"""
+	Given a set of parameters, generates a music visualiser video locally using ffmpeg, with the image as the background,
+	a waveform of the audio, and the song title and artist over the top
+	:param song_title: The name of the song that will appear in the video
+	:param song_artist: The name of the artist that will appear in the video
+	:param audio_location: The absolute path to an audio file that will be used as the audio of the video
+	:param image_location: The absolute path to an image that will be used as the background of the video
+	:param save_location: The absolute path the resulting video will be saved to
+	:param progress_callback: A function which will be called with the progress text to update the job's project
+	:return: None
+	"""
+	duration = get_audio_duration(audio_location)
+
+	with tempfile.TemporaryDirectory() as temp_directory:
+		# Read the text from files, so it doesn't need to be escaped inside the filter graph
+		pathlib.Path(temp_directory).joinpath("title.txt").write_text(song_title, encoding = "utf-8")
+		pathlib.Path(temp_directory).joinpath("artist.txt").write_text(song_artist, encoding = "utf-8")
+
+		text_options = f"font='{Config.get('ffmpeg_font')}':fontcolor=white:shadowcolor=black@0.6:shadowx=3:shadowy=3:" \
+					   f"x=(w-text_w)/2"
+
+		filter_graph = ";".join([
+			# Scale and crop the image to fill the frame once, then repeat that frame, rather than decoding and scaling the
+			# full size image for every frame
+			"[0:v]scale=1920:1080:force_original_aspect_ratio=increase,crop=1920:1080,setsar=1,format=yuv420p,"
+			"loop=loop=-1:size=1,fps=30[background]",
+			# Draw the waveform of the audio on a transparent background
+			"[1:a]showwaves=size=1920x300:mode=cline:rate=30:colors=white@0.8,format=yuva420p[waves]",
+			"[background][waves]overlay=x=0:y=H-h-80:shortest=1:format=yuv420,"
+			f"drawtext=textfile=title.txt:expansion=none:fontsize=96:y=h-580:{text_options},"
+			f"drawtext=textfile=artist.txt:expansion=none:fontsize=60:y=h-460:{text_options}[video]"
+		])
+
+		# Render next to the final location and move it into place once it's finished, so a failed or cancelled render
+		# never leaves a partial video where a finished one is expected
+		file_descriptor, temp_location = tempfile.mkstemp(prefix = f"{pathlib.Path(save_location).stem}.",
+														  suffix = ".mp4", dir = pathlib.Path(save_location).parent)
+		os.close(file_descriptor)
+		# ffmpeg is run in the temporary directory, so a relative path to it would be looked up from there
+		ffmpeg_location = os.path.abspath(shutil.which(Config.get("ffmpeg_location")) or Config.get("ffmpeg_location"))
+		try:
+			ffmpeg = subprocess.Popen([ffmpeg_location, "-y", "-loglevel", "error", "-nostats",
+									   "-i", image_location,
+									   "-i", audio_location,
+									   "-filter_complex", filter_graph,
+									   "-map", "[video]", "-map", "1:a",
+									   "-c:v", "libx264", "-preset", Config.get("ffmpeg_preset"), "-crf", "20",
+									   "-pix_fmt", "yuv420p",
+									   "-c:a", "aac", "-b:a", "192k",
+									   "-shortest", "-movflags", "+faststart",
+									   "-progress", "pipe:1", temp_location],
+									  cwd = temp_directory, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+									  text = True)
+
+			# Errors are read while the progress is, otherwise ffmpeg would stop once it had filled the error pipe
+			errors: list[str] = []
+			error_reader = threading.Thread(target = lambda: errors.append(ffmpeg.stderr.read()), daemon = True)
+			error_reader.start()
+
+			# ffmpeg writes its progress as key=value lines, out_time_us is how far through the video it is
+			for line in ffmpeg.stdout:
+				key, _, value = line.strip().partition("=")
+				if key == "out_time_us" and value.isdigit():
+					progress_callback(f"{min(int(value) / (duration * 10_000), 100):.0f}%")
+				elif key == "progress" and value == "end":
+					progress_callback("100%")
+
+			error_reader.join()
+			if ffmpeg.wait() != 0:
+				raise RuntimeError(f"ffmpeg failed to render the video: {''.join(errors).strip()}")
+
+			os.replace(temp_location, save_location)
+		finally:
+			pathlib.Path(temp_location).unlink(missing_ok = True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,272 @@
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Any, Callable
+
+import google.oauth2.credentials
+import google_auth_httplib2
+import googleapiclient.discovery
+import googleapiclient.errors
+import googleapiclient.http
+import httplib2
+
+from config import Config
+from custom_exceptions import QuotaExceededException, JobCancelledException
+
+# The quota cost of each API method used, from https://developers.google.com/youtube/v3/determine_quota_cost
+quota_costs = {
+	"channels.list":      1,
+	"playlistItems.list": 1,
+	"search.list":        100,
+	"videos.list":        1,
+	"videos.update":      50,
+	"videos.insert":      1600
+}
+
+# The most ids videos.list accepts at once, and the most requests sent in each batch
+_batch_size = 50
+
+# Quota resets at midnight Pacific Time, daylight saving time is ignored so during it the day ends an hour late
+_quota_timezone = timezone(timedelta(hours = -8))
+
+# Held while the quota used is checked and updated, so requests charged at the same time can't both fit in what's left
+_quota_lock = threading.Lock()
+
+
+class BandwidthLimiter:
+	def __init__ (self):
+		"""
+		Limits the combined speed of uploads, by making each upload wait after sending data until the limit allows it.
+		The limit is read from the config file each time, so changes to it apply straight away.
+		"""
+		# The time when everything sent so far will have been within the limit
+		self._available_at = 0.0
+		self._lock = threading.Lock()
+
+	def consume (self, byte_count: int) -> None:
+		"""
+		Wait until sending an amount of data is within the limit
+		:param byte_count: The amount of data that was sent, in bytes
+		:return: None
+		"""
+		bytes_per_second = Config.get("upload_limit_kbps") * 1024 / 8
+		if bytes_per_second <= 0:
+			return
+
+		with self._lock:
+			now = time.monotonic()
+			self._available_at = max(self._available_at, now) + byte_count / bytes_per_second
+			wait = self._available_at - now
+		time.sleep(wait)
+
+
+upload_limiter = BandwidthLimiter()
+
+
+class YouTubeClient:
+	def __init__ (self, credentials_info: dict[str, Any], api_root: str = ""):
+		"""
+		Creates a client for the YouTube Data API, which keeps track of how much of the daily quota has been used
+		:param credentials_info: The OAuth credentials saved by the Google login page
+		:param api_root: The root URL of the API, or an empty string to use YouTube's. Set this to use a stand-in API
+		server, e.g. for testing.
+		"""
+		self._credentials = google.oauth2.credentials.Credentials(**credentials_info)
+		client_options = {"api_endpoint": api_root} if api_root != "" else None
+		# The discovery document included with the library is used, so building the client doesn't need a request
+		self._youtube = googleapiclient.discovery.build("youtube", "v3", credentials = self._credentials,
+														client_options = client_options, static_discovery = True)
+		self._api_root = api_root
+		self._batch_uri = f"{api_root or 'https://youtube.googleapis.com/'}batch"
+
+		self._uploads_playlist_id: Optional[str] = None
+		# Requests made with the client share one HTTP connection, which isn't thread safe
+		self._lock = threading.RLock()
+
+	@staticmethod
+	def charge_quota (method: str, count: int = 1) -> None:
+		"""
+		Record the quota used by API requests, before they are sent
+		:param method: The API method, e.g. "videos.list"
+		:param count: The amount of requests
+		:return: None
+		:raises QuotaExceededException: If the requests would use more than the rest of today's quota
+		"""
+		today = datetime.now(_quota_timezone).date().isoformat()
+		cost = quota_costs[method] * count
+
+		with _quota_lock:
+			used = Config.get("youtube_quota_used") if Config.get("youtube_quota_day") == today else 0
+			if used + cost > Config.get("youtube_quota_units"):
+				raise QuotaExceededException(f"{method} needs {cost} quota units, but only "
+											 f"{Config.get('youtube_quota_units') - used} are left today")
+
+			Config.set("youtube_quota_day", today)
+			Config.set("youtube_quota_used", used + cost)
+
+	def _execute (self, method: str, request: googleapiclient.http.HttpRequest) -> dict[str, Any]:
+		self.charge_quota(method)
+		with self._lock:
+			return request.execute()
+
+	def _get_uploads_playlist_id (self) -> str:
+		if self._uploads_playlist_id is None:
+			response = self._execute("channels.list", self._youtube.channels().list(part = "contentDetails",
+																						mine = True))
+			self._uploads_playlist_id = response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+		return self._uploads_playlist_id
+
+	def find_uploads (self, search_terms: list[str]) -> dict[str, str]:
+		"""
+		Find the videos on the channel with each search term in their title or description, by going through the
+		channel's uploads once, newest first. This is much cheaper than using search.list for each term.
+		:param search_terms: The text to look for, e.g. job ids
+		:return: The id of the newest video containing each search term which was found
+		"""
+		remaining = set(search_terms)
+		found: dict[str, str] = {}
+
+		page_token = None
+		while len(remaining) != 0:
+			response = self._execute("playlistItems.list", self._youtube.playlistItems().list(
+				part = "snippet", playlistId = self._get_uploads_playlist_id(), maxResults = _batch_size,
+				pageToken = page_token))
+
+			for item in response.get("items", []):
+				text = f"{item['snippet'].get('title', '')}\n{item['snippet'].get('description', '')}"
+				for search_term in [search_term for search_term in remaining if search_term in text]:
+					found[search_term] = item["snippet"]["resourceId"]["videoId"]
+					remaining.remove(search_term)
+
+			page_token = response.get("nextPageToken")
+			if page_token is None:
+				break
+
+		return found
+
+	def get_videos (self, video_ids: list[str]) -> dict[str, dict[str, Any]]:
+		"""
+		Get the snippet and status of videos, with as few requests as possible
+		:param video_ids: The ids of the videos
+		:return: The details of each video which exists, by id
+		"""
+		videos: dict[str, dict[str, Any]] = {}
+		for start in range(0, len(video_ids), _batch_size):
+			response = self._execute("videos.list", self._youtube.videos().list(
+				part = "status,snippet", id = ",".join(video_ids[start:start + _batch_size]),
+				maxResults = _batch_size))
+			for item in response.get("items", []):
+				videos[item["id"]] = item
+		return videos
+
+	def update_videos (self, bodies: list[dict[str, Any]]) -> dict[str, Optional[Exception]]:
+		"""
+		Update the snippet and status of videos, sending the updates in batches
+		:param bodies: The new resource of each video, including its id
+		:return: The exception each update failed with by video id, or None if it succeeded
+		"""
+		results: dict[str, Optional[Exception]] = {}
+
+		def on_response (request_id: str, response: Any, exception: Optional[Exception]) -> None:
+			results[request_id] = exception
+
+		for start in range(0, len(bodies), _batch_size):
+			batch_bodies = bodies[start:start + _batch_size]
+			self.charge_quota("videos.update", len(batch_bodies))
+
+			batch = googleapiclient.http.BatchHttpRequest(callback = on_response, batch_uri = self._batch_uri)
+			for body in batch_bodies:
+				batch.add(self._youtube.videos().update(part = "status,snippet", body = body), request_id = body["id"])
+			with self._lock:
+				batch.execute()
+
+		return results
+
+	def upload_video (self, location: str, body: dict[str, Any], resumable_uri: Optional[str] = None,
+					  progress_callback: Callable[[str, int, int], Any] = None,
+					  should_stop: Callable[[], bool] = None) -> str:
+		"""
+		Upload a video in chunks, so an upload which fails part way can continue from the last chunk YouTube received.
+		Several videos can be uploaded at once, each uses its own connection.
+		:param location: The path of the video file
+		:param body: The snippet and status of the new video
+		:param resumable_uri: The session of an earlier upload of the same video which didn't finish, to continue it
+		:param progress_callback: A function called after each chunk with the upload session and the amount of bytes
+		received out of the total, so the session can be saved to continue later
+		:param should_stop: A function called between chunks, the upload stops with JobCancelledException if it returns
+		true
+		:return: The id of the uploaded video
+		"""
+		media = googleapiclient.http.MediaFileUpload(location, mimetype = "video/mp4", resumable = True,
+													 chunksize = Config.get("upload_chunk_mb") * 1024 * 1024)
+		request = self._youtube.videos().insert(part = "snippet,status", body = body, media_body = media)
+		if self._api_root != "":
+			# The library always sends uploads over https when the API root is changed, which a stand-in might not use
+			upload_url = urllib.parse.urlsplit(request.uri)
+			request.uri = urllib.parse.urljoin(self._api_root, f"{upload_url.path.lstrip('/')}?{upload_url.query}")
+		http = google_auth_httplib2.AuthorizedHttp(self._credentials, http = googleapiclient.http.build_http())
+
+		if resumable_uri is not None:
+			request.resumable_uri = resumable_uri
+			# Makes the next chunk start by asking YouTube how much it has already received
+			request._in_error_state = True
+		else:
+			self.charge_quota("videos.insert")
+
+		failures = 0
+		response = None
+		while response is None:
+			if should_stop is not None and should_stop():
+				raise JobCancelledException("Upload cancelled")
+
+			sent_before = request.resumable_progress
+			try:
+				# The library's own retries resend the chunk without rewinding the file, so retries are done here instead
+				_, response = request.next_chunk(http = http)
+				failures = 0
+			except googleapiclient.errors.HttpError as exception:
+				if resumable_uri is not None and exception.resp.status in (404, 410):
+					# The earlier session has expired, so start again
+					return self.upload_video(location, body, None, progress_callback, should_stop)
+				if exception.resp.status < 500 or failures >= Config.get("upload_retries"):
+					raise
+				failures += 1
+			except (OSError, httplib2.HttpLib2Error):
+				if failures >= Config.get("upload_retries"):
+					raise
+				failures += 1
+
+			if failures != 0:
+				# Wait longer after each failure in a row, then continue from what YouTube last received
+				time.sleep(2 ** failures)
+				continue
+
+			upload_limiter.consume(max(request.resumable_progress - sent_before, 0) if response is None
+								   else media.size() - sent_before)
+			if progress_callback is not None:
+				progress_callback(request.resumable_uri, request.resumable_progress if response is None
+								  else media.size(), media.size())
+
+		return response["id"]
+
+
+_client: Optional[YouTubeClient] = None
+_client_key: Optional[str] = None
+_client_lock = threading.Lock()
+
+
+def get_client () -> YouTubeClient:
+	"""
+	Get the shared API client, making a new one if the credentials or API root in the config file have changed
+	:return: The client
+	"""
+	global _client, _client_key
+
+	credentials_info = Config.get("credentials")
+	key = repr((sorted(credentials_info.items()), Config.get("youtube_api_root")))
+	with _client_lock:
+		if _client is None or _client_key != key:
+			_client = YouTubeClient(credentials_info, Config.get("youtube_api_root"))
+			_client_key = key
+		return _client